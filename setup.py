@@ -18,6 +18,8 @@ setup(
     entry_points = {
         'console_scripts': [
             # Define command-line scripts here
+            'topas_pattern_cache = topas_tools.utils.pattern_cache:main',
+            'topas_pattern_stack = topas_tools.utils.pattern_stack:main',
         ],
     },
     author= 'Dario C. Lewczyk',
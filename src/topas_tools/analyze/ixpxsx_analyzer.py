@@ -9,6 +9,7 @@ import os
 import numpy as np
 import pandas as pd
 from pathlib import Path
+from collections.abc import Mapping
 from glob import glob
 from scipy.stats import norm
 from typing import List, Dict, Tuple
@@ -17,7 +18,8 @@ from typing import List, Dict, Tuple
 from aps_11bm_tools.utils.utils import Utils as APSUtils
 
 ## These are necessary for parsing TOPAS files
-from topas_tools.utils.topas_parser import TOPAS_Parser
+from topas_tools.utils.out_stream_parser import OutStreamParser
+from topas_tools.utils.parse_cache import ParseCache
 from topas_tools.plotting.ixpxsx_plotting import IxPxSx_Plotter
 
 # This gives the ability to parse TOPAS 8 IxPxSx profiles.out files
@@ -31,7 +33,7 @@ else:
     from tqdm.notebook import tqdm
 #}}}
 # IxPxSxAnalyzer: {{{ 
-class IxPxSxAnalyzer(IxPxSx_Plotter, TOPAS_Parser, APSUtils):
+class IxPxSxAnalyzer(IxPxSx_Plotter, OutStreamParser, APSUtils):
     """  
     Class designed to make collection and analysis of 
     IxPxSx data (particularly automated) fast and easy
@@ -74,6 +76,12 @@ class IxPxSxAnalyzer(IxPxSx_Plotter, TOPAS_Parser, APSUtils):
         of an IxPxSx refinement set
 
         logfiles must be .txt
+
+        kwargs: 
+            log_separator: separator used in the logfile (default: tab)
+            data_extension: extension of the data files (default: xy)
+            use_cache: If True (default), the parsed OUT files are stored in 
+                refinement_dir/.topas_cache and only parsed again if they change
         """
         refinement_dict = {} 
         log_dict = {}
@@ -82,6 +90,11 @@ class IxPxSxAnalyzer(IxPxSx_Plotter, TOPAS_Parser, APSUtils):
 
         log_separator = kwargs.setdefault('log_separator', '\t')
         data_extension = kwargs.setdefault('data_extension', 'xy')
+        use_cache = kwargs.setdefault('use_cache', True)
+        self.parse_cache = ParseCache(
+            os.path.join(self.refinement_dir, '.topas_cache'), 
+            enabled = use_cache,
+        )
         
         # search for logfile and parse if given: {{{ 
         if log_fn:
@@ -124,11 +137,11 @@ class IxPxSxAnalyzer(IxPxSx_Plotter, TOPAS_Parser, APSUtils):
             } 
             # get XDD Pattern Info: {{{ 
             dummy_out = os.path.join(path, 'Dummy.out')
-            with open(dummy_out, 'r') as f:
-                lines = f.readlines()
-
-            dummy_dict = self.get_inp_out_dict(
-                lines, 
+            dummy_dict = self.parse_cache.get(
+                dummy_out, 
+                'inp_out_dict',
+                self.parse_topas_file,
+                section='body', # Stop before the C matrix
                 record_phase_prms=False,
                 record_bkg=False,
                 record_displacement=False,
@@ -218,10 +231,8 @@ class IxPxSxAnalyzer(IxPxSx_Plotter, TOPAS_Parser, APSUtils):
                         tth, yobs, ycalc, ydiff = self.load_output_xy(output_xy)
                     # 2) We get the profiles.out data into dictionaries
                     profile_data = ixpxsx_parser.parse_ixpxsx_dir(ixpxsx_dir)
-                    # 3) Get the out_dict
-                    with open(topas_out,'r') as f:
-                        lines = f.readlines()
-                    out_dict = self.get_inp_out_dict(lines)
+                    # 3) Get the out_dict and the phase info from the .out
+                    out_dict, out_phases = self.parse_cache.get(topas_out, 'out_stream', self.parse_out_file) # Both .out parsers in one pass
 
                     method_dict.update({
                         'pattern': {
@@ -232,6 +243,7 @@ class IxPxSxAnalyzer(IxPxSx_Plotter, TOPAS_Parser, APSUtils):
                         },
                         'profile_data': profile_data,
                         'out_dict':out_dict,
+                        'out_phases':out_phases,
                     }) 
             #}}}  
         #}}}
@@ -357,7 +369,7 @@ class IxPxSxAnalyzer(IxPxSx_Plotter, TOPAS_Parser, APSUtils):
                             continue
                         row = {"idx": idx, "method": method, "phase": phase_name}
                         for var, d in phase_dict.items():
-                            if isinstance(d, dict) and "value" in d:
+                            if isinstance(d, Mapping) and "value" in d:
                                 row[f"{var}_value"] = d["value"]
                                 row[f"{var}_error"] = d["error"]
                         phase_rows.append(row)
@@ -408,7 +420,7 @@ class IxPxSxAnalyzer(IxPxSx_Plotter, TOPAS_Parser, APSUtils):
                 if phase_name.startswith("Ph"):
                     for var, d in phase_dict.items():
                         # d = {"value": ..., "error": ...}
-                        if isinstance(d, dict) and 'keepS' not in var:
+                        if isinstance(d, Mapping) and 'keepS' not in var:
                             row[f"{phase_name}_{method}_{var}_value"] = d.get("value")
                             row[f"{phase_name}_{method}_{var}_error"] = d.get("error")
     
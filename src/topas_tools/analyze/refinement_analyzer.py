@@ -10,10 +10,15 @@ import copy
 import numpy as np
 import pandas as pd
 from tqdm import tqdm
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from topas_tools.utils.topas_utils import Utils, DataCollector
 from topas_tools.utils.metadata_parser import MetadataParser
-from topas_tools.utils.out_file_parser import OUT_Parser
+from topas_tools.utils.out_stream_parser import OutStreamParser
 from topas_tools.utils.result_parser import ResultParser
+from topas_tools.utils.parse_cache import ParseCache
+from topas_tools.utils.out_file import OutFile
+from topas_tools.utils.rietveld_entry import LazyRietveldEntry, EntryLRU
 from topas_tools.utils.tcalib import TCal
 from topas_tools.plotting.refinement_plotter import RefinementPlotter
 from topas_tools.plotting.plotting_utils import GenericPlotter, PlottingUtils
@@ -22,7 +27,7 @@ from topas_tools.plotting.plotting_utils import GenericPlotter, PlottingUtils
 class RefinementAnalyzer(
         Utils,
         DataCollector, 
-        OUT_Parser, 
+        OutStreamParser, 
         ResultParser, 
         TCal,
         RefinementPlotter
@@ -68,156 +73,285 @@ class RefinementAnalyzer(
             raise ValueError('metadata_data must be a dictionary!')
         self._metadata_data = new_metadata_data
     #}}} 
-    # _categorize_refined_data: {{{
-    def categorize_refined_data(
-            self,
+    # _get_entry_files: {{{
+    def _get_entry_files(self, i:int = None):
+        '''
+        returns the files of refinement i as (name, absolute path) pairs
+        so they can still be read after the working directory changes
+        (or after sorted_xy, etc. are replaced by another get_data):
+            {'xy', 'out', 'bkg_xy', 'hkli': {s: (substance, file)}, 'phase_xy': {s: (substance, file)}}
+        A file that is not there for refinement i is None.
+        '''
+        def get(files):
+            if files and i < len(files):
+                return (files[i], os.path.abspath(files[i]))
+            return None
+        return {
+            'xy': get(self.sorted_xy),
+            'out': get(self.sorted_out),
+            'bkg_xy': get(self.sorted_bkg_xy),
+            'hkli': {s: (v['substance'], get(v['files'])) for s, v in self._hkli.items()} if self.sorted_hkli else {},
+            'phase_xy': {s: (v['substance'], get(v['files'])) for s, v in self._phase_xy.items()} if self.sorted_phase_xy else {},
+        }
+    #}}}
+    # _load_refined_entry: {{{
+    def _load_refined_entry(self,
+            i:int = None,
+            csv:str = None,
             csv_labels:list = None,
             parse_out_files:bool = True, 
             correlation_threshold:int = 50, 
             flag_search:str = 'CHECK', 
             sort_hkli:bool = False,
-            
-        ): 
-        # Categorize the Refined Data: {{{
-        csvs = tqdm(self.sorted_csvs, desc = "Reading Files")
-        # import and process CSV, XY, OUT, HKLI:     
-        for i, csv in enumerate(csvs):
-            #csvs.set_description_str(f'Reading {csv}: ')
-            csv_contents = [float(line) for line in open(csv)] # This gives us the values in the csv. 
-            # Handle the XY Data: {{{
+            part:str = 'all',
+            files:dict = None,
+            strict:bool = False,
+            parse_cache:ParseCache = None,
+        ):
+        '''
+        Reads every file of refinement i (CSV, XY, OUT, HKLI, BKG, and phase XY)
+        and returns (entry, bkg_failed)
+            entry: The rietveld_data entry (None if it could not be made)
+            bkg_failed: True if the background file could not be read
+        This only reads attributes so it can run on a thread pool.
+
+        part: What to read
+            'all': everything
+            'light': everything but the LazyRietveldEntry.lazy_keys (CSV and OUT dictionaries)
+            'heavy': only the LazyRietveldEntry.lazy_keys (XY, C matrix, HKLI, BKG, and phase XY)
+                entry is then a dictionary of just those keys
+        files: The files of refinement i from _get_entry_files (default: from sorted_xy, etc.)
+        strict: If True, a file that cannot be read raises an error
+            (otherwise the XY data are zeros and the C matrix, etc. are None, as before).
+            The lazy loader uses this so a failed read never shows up as an empty plot.
+        parse_cache: The ParseCache for the OUT files (default: parse_cache)
+        '''
+        light = part in ('all', 'light')
+        heavy = part in ('all', 'heavy')
+        if files is None:
+            files = self._get_entry_files(i)
+        if parse_cache is None:
+            parse_cache = self.parse_cache
+        csv_contents = [float(line) for line in open(csv)] if light else None # This gives us the values in the csv. 
+        # Handle the XY Data: {{{
+        ttheta, yobs,ycalc,ydiff = (0,0,0,0)
+        if heavy:
             try:
                 #csvs.set_description_str(f'Reading {self.sorted_xy[i]}: ')
-                ttheta, yobs,ycalc,ydiff = self._parse_xy(self.sorted_xy[i])
+                ttheta, yobs,ycalc,ydiff = self._parse_xy(files['xy'][1])
             except:
+                if strict:
+                    raise
                 print(f'The xy file: {self.sorted_xy[i]} had an error.')
-                ttheta, yobs,ycalc,ydiff = (0,0,0,0)
-            #}}}
-            # Handle the OUT files: {{{  
-            if parse_out_files: 
-                try:
-                    #csvs.set_description_str(f'Reading {self.sorted_out[i]}: ')
-                    c_matrix = self._parse_c_matrix(out_file=self.sorted_out[i],correlation_threshold= correlation_threshold) 
-                    out_phase_dict = self._parse_out_phases(out_file=self.sorted_out[i]) # Read the output file.
+        #}}}
+        # Handle the OUT files: {{{  
+        c_matrix = None
+        out_phase_dict = None
+        inp_out_dict = None
+        corr_dict = None
+        if parse_out_files: 
+            try:
+                #csvs.set_description_str(f'Reading {self.sorted_out[i]}: ')
+                out_path = files['out'][1]
+                with OutFile(out_path) as out: # Mapped once (only if something is not cached) and shared by both parsers
+                    if heavy:
+                        c_matrix = parse_cache.get(out_path, 'c_matrix', lambda path, **kwargs: self._parse_c_matrix(out, **kwargs), correlation_threshold= correlation_threshold) 
+                    if light:
+                        inp_out_dict, out_phase_dict = parse_cache.get(out_path, 'out_stream', lambda path: self.parse_out_file(out)) # Read the output file (both parsers in one pass).
+                if heavy:
                     corr_dict = self._get_correlations(c_matrix,flag_search)
-                except:
-                    c_matrix = None
-                    out_phase_dict = None
-                    corr_dict = None
-            else:
+            except:
+                if strict:
+                    raise
                 c_matrix = None
                 out_phase_dict = None
+                inp_out_dict = None
                 corr_dict = None
-            #}}}
-            # Handle the hkli files: {{{ 
-            hkli_data_dict = {}
-            if self.sorted_hkli:
-                for si, s in enumerate(self._hkli):
-                    '''
-                    This section is used to get a dictionary for each substance. 
-                    '''
-                    hkli_entry = self._hkli[s] # This gets the dictionary entry for each substance. 
-                    hkli_substance = hkli_entry['substance'] # String of the substance
-                    hkli_file = hkli_entry['files'][i] # This is the hkli file we need for our current iter.
-                    #csvs.set_description_str(f'Reading {hkli_file}: ')
-                    hkli_data_dict.update({si:{
-                        'substance': hkli_substance,
-                        'hkli': self._parse_hkli(hkli_file=hkli_file,sort_hkli=sort_hkli),
-                        'file':hkli_file,
+        #}}}
+        # Handle the hkli files: {{{ 
+        hkli_data_dict = {}
+        if heavy and files['hkli']:
+            for si, s in enumerate(files['hkli']):
+                '''
+                This section is used to get a dictionary for each substance. 
+                '''
+                hkli_substance, (hkli_file, hkli_path) = files['hkli'][s] # The substance and the hkli file we need for our current iter.
+                #csvs.set_description_str(f'Reading {hkli_file}: ')
+                hkli_data_dict.update({si:{
+                    'substance': hkli_substance,
+                    'hkli': self._parse_hkli(hkli_file=hkli_path,sort_hkli=sort_hkli),
+                    'file':hkli_file,
+                    }
+                })
+        #}}}
+        # Handle BKG: {{{ 
+        bkg_dict = {}
+        bkg_name = None
+        bkg_failed = False
+        if heavy and files['bkg_xy'] is not None:
+            try:
+                #csvs.set_description_str(f'Reading {self.sorted_bkg_xy[i]}: ') # The background should be only 1D with one bkg for each pattern.
+                bkg_name, bkg_path = files['bkg_xy']
+                bkg_tth, bkg_yobs,bkg_ycalc, bkg_ydiff = self._parse_xy(bkg_path) # Get the data. only care about tth and ycalc.
+                bkg_dict.update({
+                    'tth': bkg_tth,
+                    'ycalc': bkg_ycalc,
+                })
+            except:
+                if strict:
+                    raise
+                bkg_name = None
+                bkg_failed = True # The rest of the patterns are read without a background
+        #}}}
+        # Handle the Phase XY files: {{{
+        phase_xy_data_dict = {}
+        if heavy and files['phase_xy']:
+            for si, s in enumerate(files['phase_xy']):
+                # This will get a dictionary for each substance.
+                try:
+                    phase_xy_substance, (phase_xy_file, phase_xy_path) = files['phase_xy'][s] # The substance and the phase xy file we need for the current iteration.
+                    #csvs.set_description_str(f'Reading {phase_xy_file}: ')
+                    tth_p, yobs_p, ycalc_p, ydiff_p = self._parse_xy(phase_xy_path) # This returns: tth, yobs, ycalc, ydiff We are only interested in ycalc and tth
+                    phase_xy_data_dict.update({
+                        si: {
+                            'substance': phase_xy_substance,
+                            'tth': tth_p,
+                            'ycalc': ycalc_p,
+                            'file': phase_xy_file,
                         }
                     })
-            #}}}
-            # Handle BKG: {{{ 
-            bkg_dict = {}
-            bkg_name = None
-            
-            if self.sorted_bkg_xy:
-                try:
-                    #csvs.set_description_str(f'Reading {self.sorted_bkg_xy[i]}: ') # The background should be only 1D with one bkg for each pattern.
-                    bkg_tth, bkg_yobs,bkg_ycalc, bkg_ydiff = self._parse_xy(self.sorted_bkg_xy[i]) # Get the data. only care about tth and ycalc.
-                    bkg_dict.update({
-                        'tth': bkg_tth,
-                        'ycalc': bkg_ycalc,
+                except:
+                    if strict:
+                        raise
+                    phase_xy_data_dict.update({
+                        'substance':'N/A',
+                        'tth': None,
+                        'ycalc':None,
+                        'file':None,
                     })
-                    bkg_name = self.sorted_bkg_xy[i]
+        #}}}
+        # Make the Rietveld Data entry: {{{
+        try:
+            entry = {
+                'csv': {},
+                'csv_name': csv,
+                'csv_contents': csv_contents,
+                'csv_labels': csv_labels,
+                'xy':{
+                    '2theta':ttheta,
+                    'yobs':yobs,
+                    'ycalc':ycalc,
+                    'ydiff':ydiff,
+                },
+                'xy_name':files['xy'][0],
+                'out_name': files['out'][0],
+                'c_matrix': c_matrix,
+                'out_dict': out_phase_dict,
+                'inp_out_dict': inp_out_dict,
+                'c_matrix_filtered': corr_dict,
+                'hkli':hkli_data_dict,
+                'phase_xy': phase_xy_data_dict,
+                'bkg': bkg_dict,
+                'bkg_name': bkg_name,
+ 
+            } # Create an entry for the csv data
+        except:
+            # IF the try statement doesnt work, we should neglect the entry entirely.
+            return None, bkg_failed
+        if part == 'heavy':
+            return {key: entry[key] for key in LazyRietveldEntry.lazy_keys}, bkg_failed
+        #}}}
+        # If you have provided CSV labels: {{{
+        if csv_labels:
+            for j, line in enumerate(csv_contents):
+                try:
+                    if j <= len(csv_labels)-1: 
+                        entry['csv'][csv_labels[j]] = line # This records a dictionary entry with the name of the float
+                    else:
+                        entry[f'csv_data_{j}'] = line # If too few labels given
                 except:
-                    self.sorted_bkg_xy = None
-            else:
-                self.sorted_bkg_xy = None
-            #}}}
-            # Handle the Phase XY files: {{{
-            phase_xy_data_dict = {}
-            if self.sorted_phase_xy:
-                for si, s in enumerate(self._phase_xy):
-                    # This will get a dictionary for each substance.
-                    try:
-                        phase_xy_entry = self._phase_xy[s]
-                        phase_xy_substance = phase_xy_entry['substance']
-                        phase_xy_file = phase_xy_entry['files'][i] # This is the phase xy file we need for the current iteration.
-                        #csvs.set_description_str(f'Reading {phase_xy_file}: ')
-                        tth_p, yobs_p, ycalc_p, ydiff_p = self._parse_xy(phase_xy_file) # This returns: tth, yobs, ycalc, ydiff We are only interested in ycalc and tth
-                        phase_xy_data_dict.update({
-                            si: {
-                                'substance': phase_xy_substance,
-                                'tth': tth_p,
-                                'ycalc': ycalc_p,
-                                'file': phase_xy_file,
-                            }
-                        })
-                    except:
-                        phase_xy_data_dict.update({
-                            'substance':'N/A',
-                            'tth': None,
-                            'ycalc':None,
-                            'file':None,
-                        })
-            #}}}
-            # UPDATE Rietveld Data: {{{
-            try:
-                self.rietveld_data[i] = {
-                    'csv': {},
-                    'csv_name': csv,
-                    'csv_contents': csv_contents,
-                    'csv_labels': csv_labels,
-                    'xy':{
-                        '2theta':ttheta,
-                        'yobs':yobs,
-                        'ycalc':ycalc,
-                        'ydiff':ydiff,
-                    },
-                    'xy_name':self.sorted_xy[i],
-                    'out_name': self.sorted_out[i],
-                    'c_matrix': c_matrix,
-                    'out_dict': out_phase_dict,
-                    'c_matrix_filtered': corr_dict,
-                    'hkli':hkli_data_dict,
-                    'phase_xy': phase_xy_data_dict,
-                    'bkg': bkg_dict,
-                    'bkg_name': bkg_name,
-     
-                } # Create an entry for the csv data
-            except:
-                # IF the try statement doesnt work, we should neglect the entry entirely.
-                pass
-            #}}}
-            # If you have provided CSV labels: {{{
-            if csv_labels:
-                for j, line in enumerate(csv_contents):
-                    try:
-                        if j <= len(csv_labels)-1: 
-                            self.rietveld_data[i]['csv'][csv_labels[j]] = line # This records a dictionary entry with the name of the float
-                        else:
-                            self.rietveld_data[i][f'csv_data_{j}'] = line # If too few labels given
-                    except:
-                        pass
-            #}}}
-            # If No Provided CSV labels: {{{
-            else:
-                for j, line in enumerate(csv_contents):
-                    try:
-                        self.rietveld_data[i]['csv'][f'csv_data_{j}'] = np.around(line,4) # Add a generic label
-                    except:
-                        pass
-            #}}}
+                    pass
+        #}}}
+        # If No Provided CSV labels: {{{
+        else:
+            for j, line in enumerate(csv_contents):
+                try:
+                    entry['csv'][f'csv_data_{j}'] = np.around(line,4) # Add a generic label
+                except:
+                    pass
+        #}}}
+        return entry, bkg_failed
+    #}}}
+    # _load_lazy_members: {{{
+    def _load_lazy_members(self, *args, **kwargs):
+        '''
+        The loader of a LazyRietveldEntry (args are those of _load_refined_entry).
+        Errors are raised rather than giving an entry of zeros.
+        '''
+        entry, _ = self._load_refined_entry(*args, part = 'heavy', strict = True, **kwargs)
+        if entry is None:
+            raise ValueError(f'Could not read the files of refinement {args[0]}')
+        return entry
+    #}}}
+    # _categorize_refined_data: {{{
+    def categorize_refined_data(
+            self,
+            csv_labels:list = None,
+            parse_out_files:bool = True, 
+            correlation_threshold:int = 50, 
+            flag_search:str = 'CHECK', 
+            sort_hkli:bool = False,
+            use_cache:bool = True,
+            workers:int = 1,
+            lazy:bool = False,
+            max_loaded:int = 64,
+        ): 
+        '''
+        use_cache: If True, the parsed C matrices and OUT phases are stored in .topas_cache 
+            (in the current directory) and only parsed again if an OUT file changes. 
+        workers: The number of threads used to read the files of each refinement. 
+            Reading is mostly waiting on the disk (or network share), so this can be well above the number of CPUs.
+            rietveld_data is still filled in order.
+        lazy: If True, the entries are LazyRietveldEntry objects. Only the CSV values and OUT dictionaries are read here.
+            The xy arrays, C matrix, hkli, phase xy, and background of a pattern are read the first time one of them is used
+            (their arrays are read only; call entry.pin() before changing them in place).
+            Off by default, so the entries are normal dictionaries.
+        max_loaded: With lazy, the most patterns whose xy arrays, etc. are kept in memory (the least recently used are dropped)
+        '''
+        self.parse_cache = ParseCache('.topas_cache', enabled = use_cache)
+        # Categorize the Refined Data: {{{
+        if not self.sorted_bkg_xy:
+            self.sorted_bkg_xy = None
+        part = 'light' if lazy else 'all'
+        load = lambda i: self._load_refined_entry(i, self.sorted_csvs[i], csv_labels, parse_out_files, correlation_threshold, flag_search, sort_hkli, part)
+        lru = EntryLRU(max_loaded)
+        # import and process CSV, XY, OUT, HKLI:     
+        if workers > 1:
+            pool = ThreadPoolExecutor(max_workers = workers)
+            results = pool.map(load, range(len(self.sorted_csvs))) # Returned in order
+        else:
+            pool = None
+            results = map(load, range(len(self.sorted_csvs)))
+        try:
+            bkg_failed = False
+            for i, (entry, entry_bkg_failed) in enumerate(tqdm(results, total = len(self.sorted_csvs), desc = "Reading Files")):
+                if entry_bkg_failed and not bkg_failed:
+                    bkg_failed = True
+                    self.sorted_bkg_xy = None # Later patterns do not get a background
+                elif bkg_failed and entry is not None:
+                    entry['bkg'] = {}
+                    entry['bkg_name'] = None
+                if entry is not None and lazy:
+                    loader = partial(self._load_lazy_members, i, self.sorted_csvs[i], csv_labels, parse_out_files, correlation_threshold, flag_search, sort_hkli,
+                        files = self._get_entry_files(i), # Absolute paths, so the working directory can change
+                        parse_cache = self.parse_cache,
+                    )
+                    entry = LazyRietveldEntry(entry, loader, lru)
+                if entry is not None:
+                    self.rietveld_data[i] = entry
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures = True)
         #}}} 
     #}}}
     # get_data: {{{
@@ -233,6 +367,10 @@ class RefinementAnalyzer(
             check_order:bool = False,
             time_offset:float = 0.0, 
             mtf_version:int = 1,
+            use_cache:bool = True,
+            workers:int = 1,
+            lazy:bool = False,
+            max_loaded:int = 64,
         ):
         '''
         1. csv_labels: A list of all of the data labels for the CSV files generated.
@@ -245,6 +383,10 @@ class RefinementAnalyzer(
         8. check_order: If your file's timecodes are out of order, use this. It cross references metadata epoch time.
         9. time_offset: The offset of time in seconds to shift t0 (useful for doing 2 part refinements) 
         10. mtf_version: This information will change if temperature is corrected. 
+        11. use_cache: Store the parsed OUT files in .topas_cache so they are only parsed again if they change
+        12. workers: Threads used to read the refined files (e.g. 16 on a network share)
+        13. lazy: Read the xy arrays, C matrices, hkli, phase xy, and backgrounds only when a pattern is used (see categorize_refined_data)
+        14. max_loaded: With lazy, how many patterns keep those in memory
         ''' 
         # Default Values Set: {{{
         print_files = False# Use this if you are having trouble finding files.
@@ -422,7 +564,7 @@ class RefinementAnalyzer(
         
         #}}}
         # categorize the data: {{{
-        self.categorize_refined_data(csv_labels, parse_out_files, correlation_threshold, flag_search, sort_hkli)
+        self.categorize_refined_data(csv_labels, parse_out_files, correlation_threshold, flag_search, sort_hkli, use_cache, workers, lazy, max_loaded)
         #}}} 
         # Update Rietveld Data With Original Pattern Info and Metadata: {{{
         if get_orig_patt_and_meta:
@@ -50,6 +50,7 @@ class Bkgsub(Utils, BkgsubUtils, BkgSubPlotter):
             tolerance = 0.001,
             mode = 0,
             initial_subtraction:bool = True,
+            pattern_stack = None,
         ):
         '''
         glass_dir: directory where your reference glass is
@@ -64,6 +65,7 @@ class Bkgsub(Utils, BkgsubUtils, BkgSubPlotter):
         tolerance: refers to the maximum difference for pattern file spacing to be equivalent
         mode: this tells DataCollector whether or not to look for timestamps.
         initial_subtraction: tells the program whether or not to do initial background subtraction
+        pattern_stack: A PatternStack (or the path to one) built from data_dir. If given, the data are sliced from it instead of read from each file.
         
         Peak finding parameters (SiO2)
             height
@@ -226,7 +228,7 @@ class Bkgsub(Utils, BkgsubUtils, BkgSubPlotter):
         #}}}
         # Import data: {{{
         #if initial_subtraction:
-        self.patterns = self._import_bkgsub_data(skiprows=skiprows, len_of_time = len_of_time) 
+        self.patterns = self._import_bkgsub_data(skiprows=skiprows, len_of_time = len_of_time, pattern_stack = pattern_stack) 
         #}}}
         # If an air file was loaded, subtract it from the glass pattern: {{{
         if air_file and initial_subtraction:
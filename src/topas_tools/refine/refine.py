@@ -7,13 +7,16 @@ import os
 import re
 import logging # This is so that I can quickly debug my code.
 from pprint import pformat
-import subprocess
 import time
 import copy
+import heapq
 from glob import glob
 import numpy as np
+import texttable
 from shutil import copyfile
 import shutil # Need this for the TOPAS8 stuff where we want to actually move files around
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, wait, as_completed, FIRST_COMPLETED
 if __name__ == "__main__":
     # In this case, import regular tqdm because running from CLI
     from tqdm import tqdm
@@ -23,10 +26,15 @@ else:
 from topas_tools.utils.topas_utils import Utils, UsefulUnicode, DataCollector
 from topas_tools.utils.metadata_parser import MetadataParser
 from topas_tools.utils.out_file_parser import OUT_Parser
+from topas_tools.utils.out_file import OutFile
 from topas_tools.utils.file_modifier import FileModifier
 #from topas_tools.utils.topas_parser import TOPAS_Parser # Don't need this anymore since it is subclassed by TOPAS_Modifier
 from topas_tools.utils.topas_modifier import TOPAS_Modifier
 from topas_tools.refine.topas_simulator import FakeTOPAS
+from topas_tools.refine.topas_executor import LocalTOPASExecutor
+from topas_tools.refine.refinement_journal import RefinementJournal
+from topas_tools.refine.topas_template import TopasTemplate
+from topas_tools.refine.refinement_profiler import RefinementProfiler
 #}}}
 topas = FakeTOPAS(noise = 0.02)
 # TOPAS_Refinements: {{{
@@ -43,15 +51,26 @@ class TOPAS_Refinements(Utils, UsefulUnicode, OUT_Parser, FileModifier, TOPAS_Mo
     def __init__(self,
             topas_version:int = 6,
             fileextension:str = 'xy',  
+            executor = None,
+            profile:bool = False,
         ):
         '''
         topas_version: Sets what what number to use when looking for the TOPAS directory. 
         fileextension: sets the fileextension of your datafiles. Typically, ".xy" 
+        executor: The backend used to run TOPAS (see refine/topas_executor.py). 
+                  Default: LocalTOPASExecutor which calls "tc" one refinement at a time.
+                  Use FakeTOPASExecutor to test automations without TOPAS installed.
+        profile: If True, the wall time of each stage of the automated refinements is recorded in self.profiler
+                  A timeline (CSV/JSON) is written and a summary is printed at the end of each run.
         '''
         # Make attrs based on inputs: {{{  
         self.topas_dir = f'C:\\TOPAS{topas_version}'# sets the directory
         
         self.fileextension= fileextension# This is the extension of your data. 
+        if executor is None:
+            executor = LocalTOPASExecutor(topas_dir = self.topas_dir)
+        self.executor = executor
+        self.profiler = RefinementProfiler() if profile else None
         #}}}
         # Additional initialization tasks: {{{
         self.current_dir = os.getcwd() # This saves the original location
@@ -69,13 +88,7 @@ class TOPAS_Refinements(Utils, UsefulUnicode, OUT_Parser, FileModifier, TOPAS_Mo
         This performs a Rietveld Refinement using TOPAS. 
         "input_file" is the filename of the input file we are refining 
         '''
-        working_dir = os.getcwd()
-         
-        refine_cmd = 'tc ' + working_dir + '\\'
- 
-        os.chdir(self.topas_dir) # This will change the directory to TOPAS Home
-        subprocess.call(refine_cmd + input_file)
-        os.chdir(working_dir)
+        self.submit_refinement(input_file).result() # Blocks until TOPAS finishes
     #}}}
     # refine_pattern_ixpxsx: {{{ 
     def refine_pattern_ixpxsx(self, input_file):
@@ -83,7 +96,39 @@ class TOPAS_Refinements(Utils, UsefulUnicode, OUT_Parser, FileModifier, TOPAS_Mo
         This performs a Rietveld Refinement using TOPAS. 
         "input_file" is the filename of the input file we are refining 
         ''' 
-        subprocess.call(os.path.join(self.topas_dir, f'tc {input_file}')) 
+        self.submit_refinement(input_file).result() # Blocks until TOPAS finishes
+    #}}}
+    # _stage: {{{
+    def _stage(self, stage:str = None, item:str = None):
+        '''
+        Times a stage of a refinement if profiling (see RefinementProfiler) 
+        otherwise, does nothing. 
+        '''
+        profiler = getattr(self, 'profiler', None)
+        if profiler is None:
+            return nullcontext()
+        return profiler.stage(stage, item)
+    #}}}
+    # _finish_profile: {{{
+    def _finish_profile(self, directory:str = None):
+        '''
+        Writes the timeline and prints the summary at the end of a run (if profiling)
+        '''
+        profiler = getattr(self, 'profiler', None)
+        if profiler is not None and profiler.records:
+            profiler.report(directory)
+    #}}}
+    # submit_refinement: {{{
+    def submit_refinement(self, input_file:str = None, cwd:str = None):
+        '''
+        Sends an input file to the executor without waiting for it to finish. 
+
+        input_file: filename of the input file (relative to cwd or absolute)
+        cwd: directory the input file is in. Default: current directory
+
+        returns a Future
+        '''
+        return self.executor.submit(input_file, cwd = cwd)
     #}}}
     # run_auto_rietveld: {{{
     def run_auto_rietveld(self,
@@ -104,6 +149,8 @@ class TOPAS_Refinements(Utils, UsefulUnicode, OUT_Parser, FileModifier, TOPAS_Mo
             on_sf_value:float = 1.0e-5, 
             check_order:bool = False,
             snr_threshold:float = 2.0,
+            resume:bool = False,
+            journal_fn:str = 'auto_rietveld_journal.jsonl',
             **kwargs
         ):
         '''
@@ -126,12 +173,114 @@ class TOPAS_Refinements(Utils, UsefulUnicode, OUT_Parser, FileModifier, TOPAS_Mo
             15. on_sf_value: SF Value(s) for when a phase is enabled.     
             16. check_order: If time recording gets messed up, this will ensure order is set properly
             17. snr_threshold: If you want to filter data that are possible of bad quality use this. Generally a good value is 2. 
+            18. resume: If True, picks up from the last pattern recorded in the journal 
+                (using the last good .out as the template and restoring the phase monitor)
+            19. journal_fn: Name of the journal written to the template directory after each pattern. 
         NOTE: both on and off methods can be lists because some phases you may want to treat
         in different ways.
 
         '''
         debug = kwargs.get('debug',False) # Set this to True if you want to see debugging information. 
-        
+        ctx = self._prepare_auto_rietveld(
+                refinements = refinements, 
+                time_range = time_range, 
+                data_dir = data_dir, 
+                template_dir = template_dir,
+                reverse_order = reverse_order,
+                get_individual_phases = get_individual_phases,
+                subtract_bkg = subtract_bkg,
+                phases_to_enable = phases_to_enable,
+                phases_to_disable = phases_to_disable,
+                threshold_for_on = threshold_for_on,
+                threshold_for_off = threshold_for_off,
+                on_method = on_method,
+                off_method = off_method,
+                time_error = time_error,
+                on_sf_value = on_sf_value,
+                check_order = check_order,
+                snr_threshold = snr_threshold,
+                debug = debug,
+        )
+        template = ctx['template'].lines
+        template_dir = ctx['template_dir']
+        # Begin the Refinements: {{{
+        '''
+        This part uses a range made by the selection of the user. 
+        Since we don't need to pair the data with the metadata, we should be able to simply reverse the order of the range. 
+        ''' 
+        numbers = ctx['numbers'] 
+        # Start or resume the journal: {{{
+        journal = RefinementJournal(os.path.join(template_dir, journal_fn))
+        start_idx = 0
+        last_good_out = None
+        run_info = {
+                'template': ctx['template_file'],
+                'data_dir': ctx['data_dir'],
+                'numbers': numbers,
+        }
+        if resume:
+            start_idx, template, last_good_out = self._resume_auto_rietveld(journal, run_info, template)
+        else:
+            journal.start(run_info)
+        #}}}
+        rng = tqdm(numbers[start_idx:]) # This sets the range of files we want to refine.  
+
+        for index,number in enumerate(rng, start = start_idx):     
+            output, new_template = self._refine_auto_rietveld_pattern(ctx, template, index, number)
+            if new_template is None:
+                journal.record(
+                        index = index, 
+                        number = number, 
+                        output = output, 
+                        status = 'skipped',
+                        out_file_monitor = self.out_file_monitor,
+                        last_good_out = last_good_out,
+                )
+            else:
+                template = new_template # Make the new template the output of the last refinement. 
+                # Commit the pattern to the journal: {{{
+                last_good_out = os.path.join(template_dir, f'{output}.out')
+                journal.record(
+                        index = index, 
+                        number = number, 
+                        output = output, 
+                        rwp = self._get_rwp_from_lines(template),
+                        status = 'refined',
+                        out_file_monitor = self.out_file_monitor,
+                        last_good_out = last_good_out,
+                )
+                #}}}
+        #}}}
+        self._finish_profile(template_dir)
+    #}}}
+    # _prepare_auto_rietveld: {{{
+    def _prepare_auto_rietveld(self,
+            refinements:int = 200, 
+            time_range:list = None, 
+            data_dir:str = None, 
+            template_dir:str = None,
+            reverse_order:bool = False,
+            get_individual_phases:bool = False,
+            subtract_bkg:bool = True,
+            phases_to_enable:list = None,
+            phases_to_disable:list = None,
+            threshold_for_on:float = 0.0195, 
+            threshold_for_off:float = 0.01, 
+            on_method:str = 'rwp', 
+            off_method:str = 'sf',
+            time_error:float = 1.1, 
+            on_sf_value:float = 1.0e-5, 
+            check_order:bool = False,
+            snr_threshold:float = 2.0,
+            debug:bool = False,
+        ):
+        '''
+        Does all of the setup for run_auto_rietveld 
+        (finding directories, reading the template, collecting the data, and picking the patterns to refine)
+
+        returns a dictionary with everything _refine_auto_rietveld_pattern needs to refine a pattern.
+        See run_auto_rietveld for the meaning of the arguments.
+        '''
         off_sf_value = 1.0e-100 # This SF val ensures a phase will stop refining. 
         self.reverse_order = reverse_order  
         # if you input a string for either "phases_to_disable" or "phases_to_enable": {{{
@@ -204,29 +353,8 @@ class TOPAS_Refinements(Utils, UsefulUnicode, OUT_Parser, FileModifier, TOPAS_Mo
         #}}}
         os.chdir(template_dir) # Go to the directory with the input file
         template_file = '{}.inp'.format(os.path.basename(template_dir))
-        template = [line for line in open(template_file)] # This reads the template file
-        # Parse the template for important linenumbers: {{{
-        xy_out_linenum = None
-        txt_out_linenum = None
-        my_csv_line = None
-        pattern_linenum = None
-        phase_hkli_out = []
-        phase_hkli_line = []
-        for i, line in enumerate(template):
-            line = line.strip() # cleans line of unnecessary leading spaces
-            if line.startswith('Out_X_Yobs_Ycalc_Ydiff'):
-                xy_out_linenum = i 
-            if line.startswith('out_prm_vals_on_convergence'):
-                txt_out_linenum = i
-            if line.startswith('out'):
-                # Don't need to look for anything but out by itself. 
-                my_csv_line = i
-            if line.startswith('xdd'):
-                pattern_linenum = i
-            if line.startswith('Create_hklm_d_Th2_Ip_file'):
-                phase_hkli_out.append(i)
-                phase_hkli_line.append(line) # We need to process this line to get the phase name 
-        
+        # Read the template and find the lines to patch for each pattern: {{{
+        template = TopasTemplate.from_file(template_file)
         #}}}
         # Get the data: {{{
         os.chdir(data_dir) # Go to the directory with the scans
@@ -261,112 +389,662 @@ class TOPAS_Refinements(Utils, UsefulUnicode, OUT_Parser, FileModifier, TOPAS_Mo
                     metadata_data=self.metadata_data
             )
         #}}}
-        # Begin the Refinements: {{{
+        numbers = [int(fl) for fl in tmp_rng]
+        # Check the quality of all of the diffraction patterns first: {{{
+        snr_skip = set() # pattern numbers to skip
+        self.snr_report = None
+        if snr_threshold != None:
+            filenames = [data.file_dict[data_dict_keys[number-1]] for number in numbers]
+            skip, self.snr_report = self.screen_patterns_by_snr(filenames, data_dir, snr_threshold)
+            snr_skip = {number for number, s in zip(numbers, skip) if s}
+        #}}}
+        # Store the context for the refinements: {{{
+        ctx = {
+            'data_dir': data_dir,
+            'template_dir': template_dir,
+            'template_file': template_file,
+            'template': template,
+            'file_dict': data.file_dict,
+            'data_dict_keys': data_dict_keys,
+            'numbers': numbers,
+            'get_individual_phases': get_individual_phases,
+            'subtract_bkg': subtract_bkg,
+            'phases_to_enable': phases_to_enable,
+            'phases_to_disable': phases_to_disable,
+            'threshold_for_on': threshold_for_on,
+            'threshold_for_off': threshold_for_off,
+            'on_method': on_method,
+            'off_method': off_method,
+            'time_error': time_error,
+            'on_sf_value': on_sf_value,
+            'off_sf_value': off_sf_value,
+            'snr_threshold': snr_threshold,
+            'snr_skip': snr_skip,
+            'debug': debug,
+        }
+        #}}}
+        return ctx
+    #}}}
+    # _refine_auto_rietveld_pattern: {{{
+    def _refine_auto_rietveld_pattern(self, 
+            ctx:dict = None, 
+            template:list = None, 
+            index:int = 0, 
+            number:int = 1, 
+            work_dir:str = None,
+        ):
         '''
-        This part uses a range made by the selection of the user. 
-        Since we don't need to pair the data with the metadata, we should be able to simply reverse the order of the range. 
-        ''' 
-        
-        rng = tqdm([int(fl) for fl in tmp_rng]) # This sets the range of files we want to refine.  
+        Refines a single pattern of run_auto_rietveld. 
+
+        ctx: The dictionary made by _prepare_auto_rietveld
+        template: The lines to start the refinement from (the template or the last output)
+        index: The position in the chain of refinements (0 initializes the phase monitor)
+        number: The pattern number (1 indexed)
+        work_dir: The directory to write Dummy.inp, Dummy.out and the results to. 
+                  Default: the template directory. 
 
-        for index,number in enumerate(rng):     
-            file_time = data_dict_keys[number-1]
-            xy_filename = data.file_dict[file_time]
+        returns: (output, new template)
+            new template is None if the pattern was skipped
+        '''
+        debug = ctx['debug']
+        data_dir = ctx['data_dir']
+        data_dict_keys = ctx['data_dict_keys']
+        if work_dir is None:
+            work_dir = ctx['template_dir']
+        template = ctx['template'].with_lines(template) # Don't modify the lines given
+        file_time = data_dict_keys[number-1]
+        xy_filename = ctx['file_dict'][file_time]
+        if debug:
+            print(f'Number: {number} ')
+            print(f'file_time: {file_time}\nxy_filename: {xy_filename}')
+        # Get the time (if needed): {{{
+        try:
+            md_keys = list(self.metadata_data.keys())
+            md_entry = self.metadata_data[file_time] # Get the metadata for the current time
+            start_time = self.metadata_data[md_keys[0]]['epoch_time'] # This gives us the starting time
+            current_epoch_time = md_entry['epoch_time'] # This gives the current epoch time
+            time = (current_epoch_time - start_time)/60 # This is in minutes 
+        except:
+            time = None
+        #}}} 
+        pattern = f'{data_dir}\\{xy_filename}' # Use the custom range we defined. Must subtract 1 to put it in accordance with the index. 
+        output = self._auto_rietveld_output(ctx, number) # Uses the timestamp and the zero-padded "number"
+        template.render(pattern = pattern, output = output) # Patch the lines in memory
+        # Skip the pattern if it failed the SNR check (see _prepare_auto_rietveld): {{{
+        if number in ctx['snr_skip']:
             if debug:
-                print(f'Number: {number} ')
-                print(f'file_time: {file_time}\nxy_filename: {xy_filename}')
-            # Get the time (if needed): {{{
-            try:
-                md_keys = list(self.metadata_data.keys())
-                md_entry = self.metadata_data[file_time] # Get the metadata for the current time
-                start_time = self.metadata_data[md_keys[0]]['epoch_time'] # This gives us the starting time
-                current_epoch_time = md_entry['epoch_time'] # This gives the current epoch time
-                time = (current_epoch_time - start_time)/60 # This is in minutes 
-            except:
-                time = None
-            #print(f'File Time: {file_time}\nXY_Filename: {xy_filename}\nTime = {time} minutes')
-            #}}} 
-            pattern = f'{data_dir}\\{xy_filename}' # Use the custom range we defined. Must subtract 1 to put it in accordance with the index. 
-            output = f'result_{data_dict_keys[number-1]}_{str(number).zfill(6)}' # zfill makes sure that we have enough space to record all of the numbers of the index, also use "number" to keep the timestamp. 
-            if pattern_linenum:
-                template[pattern_linenum] = f'xdd "{pattern}"\n' # write the current pattern
-            if xy_out_linenum:
-                template[xy_out_linenum] = f'Out_X_Yobs_Ycalc_Ydiff("{output}.xy")\n'
-            if txt_out_linenum:
-                template[txt_out_linenum] = f'out_prm_vals_on_convergence "{output}.txt"\n' # I am making this a text file since I manually output csv files. This would overwrite those.
-            if my_csv_line: 
-                template[my_csv_line] = f'out "{output}.csv"\n'
+                print(f'Skipping "{xy_filename}" (SNR above {ctx["snr_threshold"]})')
+            return output, None
+        #}}} 
+        # Use the Dummy.inp file: {{{
+        dummy_inp = os.path.join(work_dir, 'Dummy.inp')
+        with self._stage('template write', output):
+            template.write(dummy_inp) # The only write of the input
+        with self._stage('tc run', output):
+            self.refine_pattern(dummy_inp) # Run the actual refinement
+        out = os.path.join(work_dir, 'Dummy.out') # This is the name of the file we are looking for.
+        with self._stage('out parse', output):
+            with open(out, 'r') as f:
+                lines = f.readlines() # The only read of the output
+        # Monitor Refinement Parameters: {{{
+        '''
+        If you want to monitor scale factor values, it MUST
+        happen before the Dummy file is copied to a new file. 
 
-            
-            if phase_hkli_out:
-                for phase_i, line_idx in enumerate(phase_hkli_out):
-                    # We need to use Re to get the phase ID
-                    lne = phase_hkli_line[phase_i]
-                    fn_str = lne.split('(') [-1] # This takes whatever is written in the text field
-                    found = re.findall(r'(\w+\d?)*',fn_str)[0] # This will give all of the text you put for the filename. 
-                    split_hkli_fn = found.split('_')
-                    formula = []
-                    for word in split_hkli_fn:
-                        if word != 'result':
-                            formula.append(word)
-                        else:
-                            break
-                    #formula = found.split('_')[0]
-                    formula = '_'.join(formula) 
-                    template[line_idx] = f'\tCreate_hklm_d_Th2_Ip_file({formula}_{output}.hkli)\n'
+        Likewise, if you want a phase to be added...
 
-            # Use the Dummy.inp file: {{{
-            with open('Dummy.inp','w') as dummy:
-                for line in template:
-                    dummy.write(line) 
-            # Check the quality of the diffraction pattern first: {{{
-            skip_refinement = False
-            if snr_threshold != None:
-                xdat, ydat = self._load_raw_xy(xy_filename, data_dir) # This gets you the pattern data and also returns you to the same directory
-                snr = self.calculate_snr(ydat)
-                if snr > snr_threshold:
-                    print(f'Your SNR threshold of: {snr_threshold} triggered to prevent \npattern: "{xy_filename}" from being refined')
-                    skip_refinement = True 
-            #}}} 
-            if not skip_refinement:
-                self.refine_pattern('Dummy.inp') # Run the actual refinement
-                # Monitor Refinement Parameters: {{{
-                '''
-                If you want to monitor scale factor values, it MUST
-                happen before the Dummy file is copied to a new file. 
-    
-                Likewise, if you want a phase to be added...
-    
-                Both will be handled with the same function.
-                '''
-                out = 'Dummy.out' # This is the name of the file we are looking for.
-                if phases_to_disable != None or phases_to_enable != None:   
-                    self._modify_out_for_monitoring(
-                            out=out, 
-                            on_phases=phases_to_enable,
-                            off_phases=phases_to_disable,
-                            threshold_for_on=threshold_for_on,
-                            threshold_for_off=threshold_for_off,
-                            current_idx=index,
-                            off_sf_value=off_sf_value,
-                            on_sf_value=on_sf_value,
-                            on_method = on_method, # This is to tell if we are working with times or not
-                            off_method = off_method, # This tells whether to look for times of scale factors
-                            current_time = time, # This is either a time or None
-                            debug=debug,
-                            time_error=time_error, # This is the +/- the time can be off to trigger the turning on of a phase.
-                        )
-    
-                 
+        Both will be handled with the same function.
+        The lines are modified in memory.
+        '''
+        modified = False
+        with self._stage('monitoring', output):
+            if ctx['phases_to_disable'] != None or ctx['phases_to_enable'] != None:   
+                modified = self._modify_out_for_monitoring(
+                        out=out, 
+                        on_phases=ctx['phases_to_enable'],
+                        off_phases=ctx['phases_to_disable'],
+                        threshold_for_on=ctx['threshold_for_on'],
+                        threshold_for_off=ctx['threshold_for_off'],
+                        current_idx=index,
+                        off_sf_value=ctx['off_sf_value'],
+                        on_sf_value=ctx['on_sf_value'],
+                        on_method = ctx['on_method'], # This is to tell if we are working with times or not
+                        off_method = ctx['off_method'], # This tells whether to look for times of scale factors
+                        current_time = time, # This is either a time or None
+                        debug=debug,
+                        time_error=ctx['time_error'], # This is the +/- the time can be off to trigger the turning on of a phase.
+                        lines = lines,
+                    )
+        #}}}
+        # Save the output: {{{
+        output_out = os.path.join(work_dir, f'{output}.out')
+        with self._stage('copy/move', output):
+            os.replace(out, output_out) # Renaming is cheaper than copying
+            if modified:
+                with open(output_out, 'w') as f:
+                    f.write(''.join(lines)) # Only written again if a phase was turned on or off
+        template = lines # Make the new template the output of the last refinement. 
+        #}}}
+        #}}}
+        # Get the single phase patterns: {{{ 
+        if ctx['get_individual_phases']:
+            with self._stage('phase deconvolution', output):
+                self._calculate_phase_from_out(out = output_out,subtract_bkg=ctx['subtract_bkg'])
+        #}}}
+        return output, template
+    #}}}
+    # run_segmented_rietveld: {{{
+    def run_segmented_rietveld(self,
+            segments:int = 4,
+            workers:int = None,
+            backward:bool = False,
+            stitch_tolerance:float = 0.01,
+            rwp_tolerance:float = 0.05,
+            **kwargs
+        ):
+        '''
+        A parallel version of run_auto_rietveld. 
+
+        The patterns are split into segments, each beginning at a seed pattern 
+        spread evenly along the patterns you would refine with run_auto_rietveld. 
+            1. Every seed is refined from the template (in parallel)
+            2. Every segment is then refined as a chain starting from its seed (in parallel)
+        This keeps the benefit of chaining the refinements while using more than one core. 
+
+        segments: The number of seed patterns (and segments)
+        workers: The number of processes to use (default: number of CPUs)
+        backward: If True, each seed also refines backward toward the previous seed.
+                  The space between seeds is then split in half, so the chains are half as long.
+                  NOTE: Phase monitoring in a backward chain behaves like reverse_order.
+        stitch_tolerance: Relative difference of a parameter where segments meet 
+                  that gets flagged in the stitching report.
+        rwp_tolerance: Relative change in Rwp where segments meet that gets flagged in the stitching report.
+
+        All other keyword arguments are the same as run_auto_rietveld 
+        (refinements, time_range, data_dir, template_dir, phases_to_enable, etc.)
+        resume is not supported in this mode. 
+
+        The outputs are written to the template directory with the same names as run_auto_rietveld.
+        The stitching report is stored in self.stitching_report
+        '''
+        debug = kwargs.pop('debug', False)
+        if kwargs.pop('resume', False):
+            raise ValueError('resume is not supported by run_segmented_rietveld')
+        kwargs.pop('journal_fn', None)
+        ctx = self._prepare_auto_rietveld(debug = debug, **kwargs)
+        template_dir = ctx['template_dir']
+        numbers = ctx['numbers']
+        if workers is None:
+            workers = os.cpu_count() or 1
+        seeds, chains = self._plan_rietveld_segments(len(numbers), segments, backward)
+        # Make the working directories: {{{
+        work_dirs = {}
+        for key in chains:
+            work_dirs[key] = os.path.join(template_dir, f'segment_{key[0]}' + ('_backward' if key[1] == 'backward' else ''))
+            os.makedirs(work_dirs[key], exist_ok = True)
+        #}}}
+        refined = {} # index: (number, output, status)
+        with ProcessPoolExecutor(max_workers = workers) as pool:
+            # Refine the seeds: {{{
+            futures = {}
+            for k, seed in enumerate(seeds):
+                future = pool.submit(
+                        self._run_rietveld_chain,
+                        ctx = ctx,
+                        work_dir = work_dirs[(k, 'forward')],
+                        template = ctx['template'].lines,
+                        chain = [seed],
+                )
+                futures[future] = k
+            seed_results = {}
+            pbar = tqdm(total = len(seeds), desc = 'Seeds')
+            for future in as_completed(futures):
+                seed_results[futures[future]] = future.result()
+                pbar.update(1)
+            pbar.close()
+            for k, result in seed_results.items():
+                refined.update(result['refined'])
+                if self.profiler is not None:
+                    self.profiler.extend(result['profile'])
+            #}}}
+            # Refine the segments from their seeds: {{{
+            futures = {}
+            for key, chain in chains.items():
+                if not chain:
+                    continue
+                seed_result = seed_results[key[0]]
+                template = seed_result['template'] or ctx['template'].lines # A skipped seed falls back on the template
+                future = pool.submit(
+                        self._run_rietveld_chain,
+                        ctx = ctx,
+                        work_dir = work_dirs[key],
+                        template = template,
+                        chain = chain,
+                        out_file_monitor = seed_result['out_file_monitor'],
+                        first_idx = 1, # The seed is index 0 of the chain
+                )
+                futures[future] = key
+            pbar = tqdm(total = len(futures), desc = 'Segments')
+            for future in as_completed(futures):
+                result = future.result()
+                refined.update(result['refined'])
+                if self.profiler is not None:
+                    self.profiler.extend(result['profile'])
+                pbar.update(1)
+            pbar.close()
+            #}}}
+        #}}}
+        # Move the results to the template directory: {{{
+        for work_dir in work_dirs.values():
+            for f in os.listdir(work_dir):
+                if f.startswith('Dummy'):
+                    continue
+                os.replace(os.path.join(work_dir, f), os.path.join(template_dir, f))
+            shutil.rmtree(work_dir)
+        #}}}
+        self.stitching_report = self._stitch_rietveld_segments(
+                refined = refined, 
+                seeds = seeds,
+                chains = chains,
+                template_dir = template_dir,
+                stitch_tolerance = stitch_tolerance,
+                rwp_tolerance = rwp_tolerance,
+        )
+        self._finish_profile(template_dir)
+        return self.stitching_report
+    #}}}
+    # _plan_rietveld_segments: {{{
+    def _plan_rietveld_segments(self, n_patterns:int = None, segments:int = 4, backward:bool = False):
+        '''
+        Picks the seed indices and the chain of indices refined from each seed. 
+
+        returns: (seeds, chains)
+            seeds: list of indices
+            chains: dict with keys (segment, 'forward' or 'backward') and lists of indices in the order refined
+        '''
+        segments = max(1, min(segments, n_patterns))
+        seeds = sorted(set(int(round(v)) for v in np.linspace(0, n_patterns - 1, segments)))
+        chains = {}
+        for k, seed in enumerate(seeds):
+            next_seed = seeds[k+1] if k+1 < len(seeds) else n_patterns 
+            if backward and k+1 < len(seeds):
+                forward_end = (seed + next_seed)//2 # The forward chain stops halfway
+            else:
+                forward_end = next_seed - 1
+            chains[(k, 'forward')] = list(range(seed + 1, forward_end + 1))
+            if backward and k > 0:
+                previous_seed = seeds[k-1]
+                backward_end = (previous_seed + seed)//2 + 1
+                chains[(k, 'backward')] = list(range(seed - 1, backward_end - 1, -1))
+        return seeds, chains
+    #}}}
+    # _run_rietveld_chain: {{{
+    def _run_rietveld_chain(self, 
+            ctx:dict = None, 
+            work_dir:str = None, 
+            template:list = None, 
+            chain:list = None, 
+            out_file_monitor:dict = None,
+            first_idx:int = 0,
+        ):
+        '''
+        This runs inside of a worker process for run_segmented_rietveld. 
+        It refines the indices in chain one after another, each from the output of the last. 
+
+        returns a dictionary with: 
+            refined: {index: (number, output, status)}
+            template: the lines of the last good output (None if nothing was refined)
+            out_file_monitor: the monitor after the last refinement
+            profile: the profiler records made by this chain
+        '''
+        os.chdir(work_dir) # Each chain works inside of its own directory
+        if self.profiler is not None:
+            self.profiler = RefinementProfiler() # Only return what this chain recorded
+        self.out_file_monitor = copy.deepcopy(out_file_monitor or {})
+        refined = {}
+        last_template = None
+        for i, index in enumerate(chain, start = first_idx):
+            number = ctx['numbers'][index]
+            output, new_template = self._refine_auto_rietveld_pattern(ctx, template, i, number, work_dir = work_dir)
+            if new_template is None:
+                refined[index] = (number, output, 'skipped')
+            else:
+                refined[index] = (number, output, 'refined')
+                template = new_template
+                last_template = new_template
+        return {
+            'refined': refined,
+            'template': last_template,
+            'out_file_monitor': self.out_file_monitor,
+            'profile': self.profiler.records if self.profiler is not None else [],
+        }
+    #}}}
+    # _stitch_rietveld_segments: {{{
+    def _stitch_rietveld_segments(self, 
+            refined:dict = None, 
+            seeds:list = None,
+            chains:dict = None,
+            template_dir:str = None,
+            stitch_tolerance:float = 0.01,
+            rwp_tolerance:float = 0.05,
+        ):
+        '''
+        Compares the refined parameters and Rwp of neighboring patterns 
+        that were refined by different segments. 
+
+        Large jumps where segments meet are a sign that a segment's seed 
+        did not converge to the same minimum as its neighbor. 
+        The flag of a junction is:
+            CHECK: a parameter changes by more than stitch_tolerance or the Rwp by more than rwp_tolerance
+            OK: everything compared is within the tolerances
+            N/A: nothing could be compared (a pattern was skipped, or there are no parameters or Rwps in common)
+
+        returns a list of dictionaries (one per junction)
+        '''
+        # Find which segment refined each index: {{{
+        segment_of = {}
+        for k, seed in enumerate(seeds):
+            segment_of[seed] = k
+        for (k, direction), chain in chains.items():
+            for index in chain:
+                segment_of[index] = k
+        #}}}
+        report = []
+        indices = sorted(segment_of)
+        for a, b in zip(indices[:-1], indices[1:]):
+            if segment_of[a] == segment_of[b]:
+                continue
+            number_a, output_a, status_a = refined[a]
+            number_b, output_b, status_b = refined[b]
+            entry = {
+                'segments': (segment_of[a], segment_of[b]),
+                'numbers': (number_a, number_b),
+                'rwp': (None, None),
+                'rwp_rel_diff': None,
+                'max_rel_diff': None,
+                'max_rel_diff_prm': None,
+                'flag': 'N/A',
+            }
+            if status_a == 'refined' and status_b == 'refined':
+                out_a = self._parse_out_phases(os.path.join(template_dir, f'{output_a}.out'))
+                out_b = self._parse_out_phases(os.path.join(template_dir, f'{output_b}.out'))
+                entry['rwp'] = (out_a.get('rwp'), out_b.get('rwp'))
+                rwp_a, rwp_b = entry['rwp']
+                if isinstance(rwp_a, float) and isinstance(rwp_b, float) and max(abs(rwp_a), abs(rwp_b)) > 0:
+                    entry['rwp_rel_diff'] = abs(rwp_a - rwp_b)/max(abs(rwp_a), abs(rwp_b))
+                # Compare all of the numbers recorded for each phase: {{{
+                max_diff = 0
+                max_prm = None
+                for phase, prms in out_a.items():
+                    if not isinstance(prms, dict) or phase not in out_b:
+                        continue
+                    for prm, value in prms.items():
+                        other = out_b[phase].get(prm)
+                        if not isinstance(value, float) or not isinstance(other, float):
+                            continue
+                        scale = max(abs(value), abs(other))
+                        if scale == 0:
+                            continue
+                        diff = abs(value - other)/scale
+                        if diff > max_diff:
+                            max_diff = diff
+                            max_prm = f'{prms.get("phase_name", phase)}: {prm}'
                 #}}}
-                copyfile(out,f'{output}.out')
-                template = [line for line in open(out)] # Make the new template the output of the last refinement. 
+                if max_prm is not None:
+                    entry['max_rel_diff'] = max_diff
+                    entry['max_rel_diff_prm'] = max_prm
+                # Flag the junction: {{{
+                checks = [] # True for each comparison that is out of tolerance
+                if entry['max_rel_diff_prm'] is not None:
+                    checks.append(max_diff > stitch_tolerance)
+                if entry['rwp_rel_diff'] is not None:
+                    checks.append(entry['rwp_rel_diff'] > rwp_tolerance)
+                if checks:
+                    entry['flag'] = 'CHECK' if any(checks) else 'OK'
                 #}}}
-                # Get the single phase patterns: {{{ 
-                if get_individual_phases:
-                    self._calculate_phase_from_out(out = f'{output}.out',subtract_bkg=subtract_bkg)
+            report.append(entry)
+        # Print the report: {{{
+        if report:
+            rows = [[
+                f'{e["segments"][0]} | {e["segments"][1]}',
+                f'{e["numbers"][0]} | {e["numbers"][1]}',
+                f'{e["rwp"][0]} | {e["rwp"][1]} ({e["rwp_rel_diff"]})',
+                f'{e["max_rel_diff_prm"]} ({e["max_rel_diff"]})',
+                e['flag'],
+            ] for e in report]
+            table = texttable.Texttable()
+            table.set_cols_align(['c', 'c', 'c', 'l', 'c'])
+            table.set_cols_dtype(['t', 't', 't', 't', 't'])
+            table.add_rows([['Segments', 'Patterns', 'Rwp', 'Largest Change', 'Flag']] + rows)
+            print(table.draw())
+        #}}}
+        return report
+    #}}}
+    # run_adaptive_rietveld: {{{
+    def run_adaptive_rietveld(self,
+            coarse:int = 50,
+            budget:int = 200,
+            rwp_threshold:float = 0.05,
+            scale_threshold:float = 0.10,
+            lattice_threshold:float = 1.0e-3,
+            **kwargs
+        ):
+        '''
+        An adaptive version of run_auto_rietveld. 
+
+        Rather than refining evenly spaced patterns, this: 
+            1. Refines "coarse" evenly spaced patterns (chained, just like run_auto_rietveld)
+            2. Finds neighboring refined patterns where the Rwp, scale factors, or lattice parameters 
+               change by more than a threshold and refines the pattern halfway between them 
+               (chained from the neighbor refined first). 
+            3. Repeats step 2 on the largest changes first until "budget" refinements are done 
+               or nothing changes faster than the thresholds. 
+
+        coarse: Number of patterns in the first pass
+        budget: Total number of refinements allowed (including the coarse pass). 
+            Patterns skipped by the SNR check during the adaptive pass do not count; 
+            the closest pattern to the middle of the interval that passes is refined instead.
+        rwp_threshold: Fractional change in Rwp between neighbors that triggers more refinements
+        scale_threshold: Fractional change in any scale factor that triggers more refinements
+        lattice_threshold: Fractional change in any lattice parameter that triggers more refinements
+
+        All other keyword arguments are the same as run_auto_rietveld 
+        ("refinements" is replaced by "coarse", resume is not supported).
+        The phase monitor (phases_to_enable/phases_to_disable) is only used during the coarse pass. 
+        Patterns added later start from the output of a neighbor, so they inherit the phases turned on or off. 
+
+        returns a sorted list of the pattern numbers refined
+        The order and reason for each refinement is stored in self.adaptive_report
+        '''
+        debug = kwargs.pop('debug', False)
+        if kwargs.pop('resume', False):
+            raise ValueError('resume is not supported by run_adaptive_rietveld')
+        kwargs.pop('journal_fn', None)
+        kwargs.pop('refinements', None)
+        ctx = self._prepare_auto_rietveld(refinements = min(coarse, budget), debug = debug, **kwargs)
+        template_dir = ctx['template_dir']
+        numbers = list(dict.fromkeys(ctx['numbers'])) # More coarse patterns than files gives repeats
+        ctx['numbers'] = numbers
+        forward = numbers[0] <= numbers[-1] # reverse_order refines from high to low numbers
+        refined = {} # number: metrics (None if skipped)
+        self.adaptive_report = []
+        # Coarse pass: {{{
+        template = ctx['template'].lines
+        for index, number in enumerate(tqdm(numbers, desc = 'Coarse pass')):
+            output, new_template = self._refine_auto_rietveld_pattern(ctx, template, index, number)
+            refined[number] = None
+            if new_template is not None:
+                template = new_template
+                refined[number] = self._get_adaptive_metrics(new_template)
+            self.adaptive_report.append({'number': number, 'pass': 'coarse', 'score': None})
+        #}}}
+        # Bisection: {{{
+        bisect_ctx = dict(ctx, phases_to_enable = None, phases_to_disable = None) # No monitoring here
+        thresholds = {'rwp': rwp_threshold, 'scale': scale_threshold, 'lattice': lattice_threshold}
+        queue = []
+        ordered = sorted(refined)
+        for a, b in zip(ordered[:-1], ordered[1:]):
+            self._push_adaptive_interval(queue, a, b, refined, thresholds)
+        pbar = tqdm(total = max(budget - len(refined), 0), desc = 'Adaptive pass')
+        excluded = set() # Patterns that failed the SNR check or did not refine (these do not count against the budget)
+        while queue and len(refined) < budget:
+            neg_score, a, b = heapq.heappop(queue)
+            mid = self._next_adaptive_number(ctx, a, b, refined, excluded)
+            if mid is None:
+                continue # Nothing left to refine between a and b
+            neighbor = a if forward else b # Chain from the neighbor refined first in time order 
+            with open(os.path.join(template_dir, f'{self._auto_rietveld_output(ctx, neighbor)}.out'), 'r') as f:
+                template = f.readlines()
+            output, new_template = self._refine_auto_rietveld_pattern(bisect_ctx, template, len(refined), mid)
+            if new_template is None:
+                # Try another pattern in the same interval: {{{
+                excluded.add(mid)
+                heapq.heappush(queue, (neg_score, a, b))
+                continue
                 #}}}
+            refined[mid] = self._get_adaptive_metrics(new_template)
+            self.adaptive_report.append({'number': mid, 'pass': 'adaptive', 'score': -neg_score})
+            pbar.update(1)
+            self._push_adaptive_interval(queue, a, mid, refined, thresholds)
+            self._push_adaptive_interval(queue, mid, b, refined, thresholds)
+        pbar.close()
         #}}}
+        print(f'Refined {len(refined)} patterns ({len(numbers)} coarse, {len(refined) - len(numbers)} adaptive)')
+        self._finish_profile(template_dir)
+        return sorted(refined)
+    #}}}
+    # _next_adaptive_number: {{{
+    def _next_adaptive_number(self, ctx:dict = None, a:int = None, b:int = None, refined:dict = None, excluded:set = None):
+        '''
+        Picks the pattern to refine between a and b for run_adaptive_rietveld: 
+        the closest one to the middle that is not refined or excluded and passes the SNR check. 
+        Patterns that fail the SNR check are added to excluded.
+
+        returns the pattern number (None if there is none left)
+        '''
+        mid = (a + b)//2
+        for offset in range(b - a):
+            for number in ((mid - offset, mid + offset) if offset else (mid,)): # Outward from the middle
+                if not a < number < b or number in refined or number in excluded:
+                    continue
+                # Check the SNR of the pattern (the coarse pass was checked by _prepare_auto_rietveld): {{{
+                if ctx['snr_threshold'] != None:
+                    filename = ctx['file_dict'][ctx['data_dict_keys'][number-1]]
+                    skip, _ = self.screen_patterns_by_snr([filename], ctx['data_dir'], ctx['snr_threshold'], workers = 1, print_report = False)
+                    if skip[0]:
+                        excluded.add(number)
+                        continue
+                #}}}
+                return number
+        return None
+    #}}}
+    # _auto_rietveld_output: {{{
+    def _auto_rietveld_output(self, ctx:dict = None, number:int = None):
+        '''
+        Returns the output name used for a pattern number by _refine_auto_rietveld_pattern
+        zfill makes sure that we have enough space to record all of the numbers of the index
+        '''
+        return f'result_{ctx["data_dict_keys"][number-1]}_{str(number).zfill(6)}'
+    #}}}
+    # _get_adaptive_metrics: {{{
+    def _get_adaptive_metrics(self, lines:list = None):
+        '''
+        Gets the quantities that run_adaptive_rietveld watches from the lines of an output file: 
+            rwp: The Rwp
+            scale: scale factors (by name)
+            lattice: lattice parameters (by phase and parameter)
+        '''
+        metrics = {'rwp': self._get_rwp_from_lines(lines), 'scale': {}, 'lattice': {}}
+        phase_name = None
+        for line in lines:
+            line = line.split("'")[0] # Remove comments
+            if 'phase_name' in line:
+                phase_name = line.split('phase_name')[-1].strip().strip('"')
+            if re.match(r'^\s*scale\s', line):
+                words = re.findall(r'\S+', line)
+                try:
+                    metrics['scale'][words[1]] = self._parse_scale_factor_line(line)
+                except (IndexError, ValueError):
+                    pass
+            m = re.match(r'^\s*(a|b|c|al|be|ga)\s+!?@?\s*\w*?\s*([-+]?\d+\.?\d*(?:[eE][-+]?\d+)?)', line)
+            if m:
+                metrics['lattice'][(phase_name, m.group(1))] = float(m.group(2))
+        return metrics
+    #}}}
+    # _push_adaptive_interval: {{{
+    def _push_adaptive_interval(self, queue:list = None, a:int = None, b:int = None, refined:dict = None, thresholds:dict = None):
+        '''
+        Adds the interval between two refined patterns to the queue 
+        if there is a pattern between them and something changes faster than its threshold. 
+
+        The score is the largest (change / threshold) so the fastest changes are refined first.
+        '''
+        if b - a < 2 or refined.get(a) is None or refined.get(b) is None:
+            return
+        ma = refined[a]
+        mb = refined[b]
+        score = 0
+        # Rwp: {{{
+        if ma['rwp'] and mb['rwp']:
+            change = abs(mb['rwp'] - ma['rwp'])/min(ma['rwp'], mb['rwp'])
+            score = max(score, change/thresholds['rwp'])
+        #}}}
+        # Scale factors and lattice parameters: {{{
+        for key in ['scale', 'lattice']:
+            for prm, va in ma[key].items():
+                vb = mb[key].get(prm)
+                if vb is None:
+                    continue
+                denom = max(abs(va), abs(vb))
+                if denom == 0:
+                    continue
+                score = max(score, abs(vb - va)/denom/thresholds[key])
+        #}}}
+        if score > 1:
+            heapq.heappush(queue, (-score, a, b))
+    #}}}
+    # _resume_auto_rietveld: {{{
+    def _resume_auto_rietveld(self, journal:RefinementJournal = None, run_info:dict = None, template:list = None):
+        '''
+        Reads the journal for run_auto_rietveld and restores the state 
+        needed to continue from the last pattern recorded. 
+
+        returns: (index to start at, template lines, last good out)
+        '''
+        header, last = journal.last_committed()
+        if header is None:
+            print(f'No journal found at: {journal.path}. Starting from the beginning.')
+            journal.start(run_info)
+            return 0, template, None
+        if header.get('numbers') != run_info.get('numbers'):
+            raise ValueError(
+                'The patterns to refine do not match the journal. '+
+                'Use the same refinements, time_range, reverse_order, and check_order as the original run '+
+                'or set resume = False.'
+            )
+        if last is None:
+            return 0, template, None
+        start_idx = last['index'] + 1
+        last_good_out = last.get('last_good_out')
+        self.out_file_monitor = journal.restore_out_file_monitor(last.get('out_file_monitor'))
+        if last_good_out:
+            # The chained template is the output of the last good refinement
+            with open(last_good_out, 'r') as f:
+                template = f.readlines()
+        print(f'Resuming from pattern {start_idx + 1} of {len(run_info["numbers"])}')
+        return start_idx, template, last_good_out
+    #}}}
+    # _get_rwp_from_lines: {{{
+    def _get_rwp_from_lines(self, lines:list = None):
+        '''
+        Returns the Rwp from the lines of an output file (or None)
+        The last Rwp in the file is the most recent one. 
+        '''
+        for line in reversed(lines):
+            fit_metrics = self.parse_fit_metrics_line(line)
+            if fit_metrics and 'r_wp' in fit_metrics:
+                return fit_metrics['r_wp']
+        return None
     #}}}
     # _get_line_info: {{{
     def _get_line_info(self,string:str, index:int = 0, mode = 0, return_re_list:bool = False):
@@ -512,6 +1190,7 @@ class TOPAS_Refinements(Utils, UsefulUnicode, OUT_Parser, FileModifier, TOPAS_Mo
         #print(f'inp_dict after: {inp_dict["phases"]}') # FAILED
         #}}}
         # Loop through the structures: {{{  
+        futures = [] # Each phase gets its own input file so TOPAS can refine them at the same time
         for phase in inp_dict['phases']:  
             inp_file = []
             entry = inp_dict['phases'][phase]  
@@ -531,11 +1210,11 @@ class TOPAS_Refinements(Utils, UsefulUnicode, OUT_Parser, FileModifier, TOPAS_Mo
                 inp_file.append(line)
             inp_file.append(output)
             # Use the Dummy.inp file: {{{
-            with open('Dummy_PS.inp','w') as dummy:
+            with open(f'Dummy_PS_{phase}.inp','w') as dummy:
                 for line in inp_file:
                     dummy.write(line)
                 dummy.close()
-            self.refine_pattern('Dummy_PS.inp') # Run the actual refinement
+            futures.append(self.submit_refinement(f'Dummy_PS_{phase}.inp')) # Run the actual refinement
             #copyfile('Dummy.out',f'{output}.out')
             #template = [line for line in open('Dummy.out')] # Make the new template the output of the last refinement. 
         #}}}
@@ -548,12 +1227,13 @@ class TOPAS_Refinements(Utils, UsefulUnicode, OUT_Parser, FileModifier, TOPAS_Mo
         #print(output)
         #print(bkg_inp)
         # Use the dummy.inp; {{{
-        with open('Dummy_PS.inp','w') as dummy:
+        with open('Dummy_PS_bkg.inp','w') as dummy:
             for line in bkg_inp:
                 dummy.write(line)
             dummy.close()
-            self.refine_pattern('Dummy_PS.inp') # Run the actual refinement.
+        futures.append(self.submit_refinement('Dummy_PS_bkg.inp')) # Run the actual refinement.
         #}}}
+        self.executor.wait_all(futures) # Wait for all of the phases and the bkg to finish
         #}}}
         #}}}
     #}}}
@@ -564,7 +1244,9 @@ class TOPAS_Refinements(Utils, UsefulUnicode, OUT_Parser, FileModifier, TOPAS_Mo
             data_extension:str = 'xy', 
             ixpxsx_types:list = ['IPS', 'xPS', 'xPx', 'xxx'], 
             modes_for_phases:dict = None,
-            debug:bool = False
+            debug:bool = False,
+            workers:int = 1,
+            warm_start:bool = True,
             ):
         ''' 
         This function allows us to automate IxPxSx refinements 
@@ -587,6 +1269,14 @@ class TOPAS_Refinements(Utils, UsefulUnicode, OUT_Parser, FileModifier, TOPAS_Mo
                         specific phase to a specific type regardless of what refinement
                         the program expects
                         ex: {1: 'xxx'} if you want Ph1 to always be xxx
+        workers: Number of processes to refine directories with. 
+                        1 (default) runs every directory one after another.
+                        If > 1, directories are scheduled on a process pool and 
+                        each worker refines inside of its own directory. 
+                        A directory only waits for the directory whose out_dict it 
+                        borrows as a warm start (the same one the serial loop would pick).
+        warm_start: If False, no directory borrows an out_dict from another one. 
+                        With workers > 1, this lets every directory refine at once.
         '''
         previous_inp_dict = None # Store the base inp_dict
         self._inp_file_version = 0 # Counts different types of input file
@@ -602,36 +1292,26 @@ class TOPAS_Refinements(Utils, UsefulUnicode, OUT_Parser, FileModifier, TOPAS_Mo
         dirs = self.get_dirs_for_ixpxsx_automations(
                 home_dir, data_extension, ixpxsx_types
         ) 
+        # If running on a process pool: {{{
+        if workers > 1:
+            self._run_parallel_ixpxsx_refinements(
+                    dirs = dirs,
+                    home_dir = home_dir,
+                    data_extension = data_extension,
+                    ixpxsx_types = ixpxsx_types,
+                    modes_for_phases = modes_for_phases,
+                    debug = debug,
+                    workers = workers,
+                    warm_start = warm_start,
+            )
+            self._finish_profile(home_dir)
+            return
+        #}}}
         
         pbar = tqdm(dirs, position = 0, leave = True) 
         
         for path in pbar:
-            refinements_completed = 0 # Tracks the number of refinements
-            
-            dummy_inp_path = os.path.join(path, 'Dummy.inp')
-            dummy_out_path = os.path.join(path, "Dummy.out")
-            self.logger.debug(f'Working through {path}') 
-            ## GET TEMP: {{{
-            basename = os.path.basename(path)
-            pbar.set_description_str(f'Working through {basename}')
-            m = re.search(r'(\d+C)', basename)
-            temp = None # should be assigned 
-            if m:
-                temp = m.group(1) # This should be the temperature e.g. 50C 
-            #}}} 
-            # search the directory for input file including temperature
-            inp_file = glob(os.path.join(path, f'*{temp}*.inp'))[0] 
-            inp_basename = os.path.basename(inp_file)
-            if debug:
-                print(f'{temp}, {inp_basename}')
-            # Get important information & Linenumbers from the INP: {{{
-            with open(os.path.join(path, inp_basename)) as inp:
-                lines = inp.readlines() # These are all the lines of the INP file
-            self.logger.debug(f'Loading {inp_basename} into a dict')
-            inp_dict = self.get_inp_out_dict(
-                    lines, record_fit_metrics = False, 
-                    record_xdd = True, fileextension = data_extension
-            ) # This gives us the INP dictionary  
+            temp, inp_file, inp_dict = self._get_ixpxsx_dir_info(path, data_extension, debug)
             # Check for a fundamental change to the INP: {{{
             if previous_inp_dict is not None:
                 if self._inp_fundamentally_changed(previous_inp_dict, inp_dict):
@@ -642,52 +1322,285 @@ class TOPAS_Refinements(Utils, UsefulUnicode, OUT_Parser, FileModifier, TOPAS_Mo
      
             previous_inp_dict = inp_dict
             #}}}
-            #}}}
-            refined_xy_file = inp_dict['xdd'].get('filename') 
-            # Clean up the directory before beginning: {{{
-            if not debug:
-                # This prepares the home directory so that it is clean  
-                self.clean_directory(exclude = [inp_file, refined_xy_file],
-                                     path = os.path.join(home_dir, path)
-                ) 
-            #}}}
-            # Now, we want to run the actual input file.   
+            out_dicts = self.out_dicts
+            if not warm_start:
+                out_dicts = {} # Nothing is borrowed (the same as workers > 1)
+            debug_out_dict = self._refine_ixpxsx_dir(
+                    path = path,
+                    temp = temp, 
+                    inp_file = inp_file,
+                    inp_dict = inp_dict,
+                    home_dir = home_dir,
+                    data_extension = data_extension,
+                    ixpxsx_types = ixpxsx_types,
+                    modes_for_phases = modes_for_phases,
+                    debug = debug,
+                    pbar = pbar,
+                    out_dicts = out_dicts,
+            )
+            self.out_dicts.update(out_dicts) # Keeps the out_dicts of every temperature refined
+            if debug_out_dict is not None:
+                return debug_out_dict
+        #}}}
+        self._finish_profile(home_dir)
+    #}}}
+    # _get_ixpxsx_dir_info: {{{
+    def _get_ixpxsx_dir_info(self, path:str = None, data_extension:str = 'xy', debug:bool = False):
+        '''
+        Finds the temperature and the input file for an IxPxSx directory 
+        and parses the input file into an inp_dict. 
+
+        returns: (temp, inp_file, inp_dict)
+        '''
+        ## GET TEMP: {{{
+        basename = os.path.basename(path)
+        m = re.search(r'(\d+C)', basename)
+        temp = None # should be assigned 
+        if m:
+            temp = m.group(1) # This should be the temperature e.g. 50C 
+        #}}} 
+        # search the directory for input file including temperature
+        inp_file = glob(os.path.join(path, f'*{temp}*.inp'))[0] 
+        inp_basename = os.path.basename(inp_file)
+        if debug:
+            print(f'{temp}, {inp_basename}')
+        # Get important information & Linenumbers from the INP: {{{
+        with open(os.path.join(path, inp_basename)) as inp:
+            lines = inp.readlines() # These are all the lines of the INP file
+        self.logger.debug(f'Loading {inp_basename} into a dict')
+        inp_dict = self.get_inp_out_dict(
+                lines, record_fit_metrics = False, 
+                record_xdd = True, fileextension = data_extension
+        ) # This gives us the INP dictionary  
+        #}}}
+        return temp, inp_file, inp_dict
+    #}}}
+    # _get_ixpxsx_dependencies: {{{
+    def _get_ixpxsx_dependencies(self, temps:list = None, warm_start:bool = True):
+        '''
+        For each directory (in the order given), this finds the index of the 
+        directory whose out_dict the serial loop would borrow as a warm start.
+
+        The serial loop uses get_closest_entry_in_out_dict on every temperature 
+        refined before the current one. Since later directories overwrite earlier 
+        ones with the same temperature, the dependency is the latest directory 
+        with the selected temperature.
+
+        returns a list with an index or None (no warm start) for each directory
+        '''
+        dependencies = []
+        latest_idx = {} # temp: index of the latest directory with that temp
+        for i, temp in enumerate(temps):
+            if not warm_start or not latest_idx:
+                dependencies.append(None)
+            else:
+                target = self.get_closest_entry_in_out_dict(temp, {t:t for t in latest_idx}) 
+                dependencies.append(latest_idx[target])
+            latest_idx[temp] = i
+        return dependencies
+    #}}}
+    # _ixpxsx_dir_worker: {{{
+    def _ixpxsx_dir_worker(self, 
+            path:str = None,
+            temp:str = None, 
+            inp_file:str = None,
+            inp_dict:dict = None,
+            inp_file_version:int = 0,
+            warm_start_out_dicts:dict = None,
+            **kwargs
+        ):
+        '''
+        This runs inside of a worker process. 
+
+        The worker only knows about the out_dict it borrows as a warm start and 
+        works from inside of its own directory. 
+
+        returns: (temp, out_dict recorded for temp, profiler records)
+        '''
+        os.chdir(path) # Each worker refines in its own directory
+        self._inp_file_version = inp_file_version
+        if self.profiler is not None:
+            self.profiler = RefinementProfiler() # Only return what this worker recorded
+        self.out_dicts = dict(warm_start_out_dicts or {})
+        self._refine_ixpxsx_dir(
+                path = path, 
+                temp = temp, 
+                inp_file = inp_file,
+                inp_dict = inp_dict,
+                pbar = None,
+                **kwargs
+        )
+        records = self.profiler.records if self.profiler is not None else []
+        return temp, self.out_dicts.get(temp), records
+    #}}}
+    # _run_parallel_ixpxsx_refinements: {{{
+    def _run_parallel_ixpxsx_refinements(self,
+            dirs:list = None,
+            home_dir:str = None, 
+            data_extension:str = 'xy', 
+            ixpxsx_types:list = ['IPS', 'xPS', 'xPx', 'xxx'],
+            modes_for_phases:dict = None,
+            debug:bool = False,
+            workers:int = 2,
+            warm_start:bool = True,
+        ):
+        '''
+        Schedules the IxPxSx directories on a process pool. 
+
+        A directory is submitted as soon as the directory it borrows its 
+        warm start from has finished. Directories without a dependency 
+        are submitted right away.
+        '''
+        # Parse all of the INPs first (this is cheap and keeps the file versions in order): {{{
+        infos = []
+        previous_inp_dict = None
+        versions = []
+        for path in dirs:
+            temp, inp_file, inp_dict = self._get_ixpxsx_dir_info(path, data_extension, debug)
+            if previous_inp_dict is not None:
+                if self._inp_fundamentally_changed(previous_inp_dict, inp_dict):
+                    self.bump_inp_file_version() 
+                    self.propagate_inp_file_version(inp_dict) 
+            previous_inp_dict = inp_dict
+            infos.append((path, temp, inp_file, inp_dict))
+            versions.append(self._inp_file_version)
+        dependencies = self._get_ixpxsx_dependencies([info[1] for info in infos], warm_start)
+        #}}}
+        # Schedule the directories: {{{
+        results = {} # index: (temp, out_dict, profiler records)
+        submitted = set()
+        pbar = tqdm(total = len(infos), position = 0, leave = True, desc = 'IxPxSx Directories')
+        with ProcessPoolExecutor(max_workers = workers) as pool: 
+            running = {}
+            while len(results) < len(infos):
+                # Submit everything that is ready: {{{
+                for i, (path, temp, inp_file, inp_dict) in enumerate(infos):
+                    dep = dependencies[i]
+                    if i in submitted or (dep is not None and dep not in results):
+                        continue
+                    warm_start_out_dicts = {}
+                    if dep is not None and results[dep][1] is not None:
+                        warm_start_out_dicts = {results[dep][0]: results[dep][1]}
+                    self.logger.debug(f'Submitting {os.path.basename(path)} (waits on: {dep})')
+                    future = pool.submit(
+                            self._ixpxsx_dir_worker,
+                            path = path,
+                            temp = temp, 
+                            inp_file = inp_file,
+                            inp_dict = inp_dict,
+                            inp_file_version = versions[i],
+                            warm_start_out_dicts = warm_start_out_dicts,
+                            home_dir = home_dir,
+                            data_extension = data_extension,
+                            ixpxsx_types = ixpxsx_types,
+                            modes_for_phases = modes_for_phases,
+                            debug = debug,
+                    )
+                    running[future] = i
+                    submitted.add(i)
+                #}}}
+                done, _ = wait(list(running.keys()), return_when = FIRST_COMPLETED)
+                for future in done:
+                    i = running.pop(future)
+                    results[i] = future.result() # Raises if the worker failed 
+                    pbar.set_description_str(f'Finished {os.path.basename(infos[i][0])}')
+                    pbar.update(1)
+        pbar.close()
+        #}}}
+        # Record the out_dicts in directory order (later directories overwrite earlier ones): {{{
+        for i in sorted(results):
+            temp, out_dict, records = results[i]
+            if out_dict is not None:
+                self.out_dicts[temp] = out_dict
+            if self.profiler is not None:
+                self.profiler.extend(records)
+        #}}}
+    #}}}
+    # _refine_ixpxsx_dir: {{{
+    def _refine_ixpxsx_dir(self,
+            path:str = None,
+            temp:str = None,
+            inp_file:str = None,
+            inp_dict:dict = None,
+            home_dir:str = None,
+            data_extension:str = 'xy',
+            ixpxsx_types:list = ['IPS', 'xPS', 'xPx', 'xxx'],
+            modes_for_phases:dict = None,
+            debug:bool = False,
+            pbar = None,
+            out_dicts:dict = None,
+        ):
+        '''
+        Runs Rietveld and then each of the IxPxSx refinements for a single directory. 
+
+        out_dicts: The out_dicts used (and updated) for the warm start (default: self.out_dicts)
+
+        returns the out_dict when debug stops early at xPx, otherwise None
+        '''
+        if out_dicts is None:
+            out_dicts = self.out_dicts
+        refinements_completed = 0 # Tracks the number of refinements
+        
+        dummy_inp_path = os.path.join(path, 'Dummy.inp')
+        dummy_out_path = os.path.join(path, "Dummy.out")
+        self.logger.debug(f'Working through {path}') 
+        basename = os.path.basename(path)
+        self._set_pbar_description(pbar, f'Working through {basename}')
+        inp_basename = os.path.basename(inp_file)
+        refined_xy_file = inp_dict['xdd'].get('filename') 
+        # Clean up the directory before beginning: {{{
+        if not debug:
+            # This prepares the home directory so that it is clean  
+            self.clean_directory(exclude = [inp_file, refined_xy_file],
+                                 path = os.path.join(home_dir, path)
+            ) 
+        #}}}
+        # Now, we want to run the actual input file.   
+        rietveld_item = f'{basename} Rietveld' # Name used by the profiler
+        with self._stage('template write', rietveld_item):
             copyfile(inp_file, dummy_inp_path) 
-            # IF OUT DICTS RECORDED, READ THEM: {{{
-            self.logger.debug('Looking to see if we match an out dict')
-            if len(self.out_dicts) > 0:
-                
-                out_dict = self.get_closest_entry_in_out_dict(
-                        temp, self.out_dicts
-                ) 
-                self.logger.debug(f'Reading OUT Dict closest to {temp}: \n{pformat(out_dict)}')
-                # We need to make sure that these file versions match
-                self.refresh_out_dict(out_dict, inp_dict) 
-                self.logger.debug('Ensuring that the lines from INP dict and OUT dict match')
-                with open(dummy_inp_path, 'r') as f:  
-                    lines = f.readlines() # Gives access to all the lines 
-                # Update the INP to have the values from the output: {{{
-                lines, _ = self.modify_inp_lines(
-                        lines, 
-                        out_dict, 
-                        I, 
-                        P, 
-                        S, 
-                        cry_files = None,
-                        modify_ph=True, 
-                        modify_specimen_displacement = True, 
-                        modify_bkg = True,
-                        write_ixpxsx_lines = False,
-                        update_output_xy_line = False,
-                        new_suffix = None,
-                )
-                self.logger.debug('Writing lines to Dummy.inp')
+        with open(dummy_inp_path, 'r') as f:  
+            template_lines = f.readlines() # Gives access to all the lines 
+        lines = list(template_lines)
+        # IF OUT DICTS RECORDED, READ THEM: {{{
+        self.logger.debug('Looking to see if we match an out dict')
+        if len(out_dicts) > 0:
+            
+            out_dict = self.get_closest_entry_in_out_dict(
+                    temp, out_dicts
+            ) 
+            self.logger.debug(f'Reading OUT Dict closest to {temp}: \n{pformat(out_dict)}')
+            # We need to make sure that these file versions match
+            self.refresh_out_dict(out_dict, inp_dict) 
+            self.logger.debug('Ensuring that the lines from INP dict and OUT dict match')
+            # The warm start uses the last IxPxSx mode refined: {{{
+            I, P, S = ixpxsx_types[-1][0], ixpxsx_types[-1][1], ixpxsx_types[-1][2]
+            #}}}
+            # Update the INP to have the values from the output: {{{
+            lines, _ = self.modify_inp_lines(
+                    lines, 
+                    out_dict, 
+                    I, 
+                    P, 
+                    S, 
+                    cry_files = None,
+                    modify_ph=True, 
+                    modify_specimen_displacement = True, 
+                    modify_bkg = True,
+                    write_ixpxsx_lines = False,
+                    update_output_xy_line = False,
+                    new_suffix = None,
+                    inp_dict = inp_dict, # inp_dict was parsed from these lines
+            )
+            self.logger.debug('Writing lines to Dummy.inp')
+            with self._stage('template write', rietveld_item):
                 with open(dummy_inp_path, 'w') as f:
                     f.writelines(lines) # This updates the file with the new lines
-                #}}}
             #}}}
-            #  REFINE RIETVELD: {{{ 
-            pbar.set_description_str(f'Refining Rietveld {basename}') 
+        #}}}
+        #  REFINE RIETVELD: {{{ 
+        self._set_pbar_description(pbar, f'Refining Rietveld {basename}') 
+        with self._stage('tc run', rietveld_item):
             if debug: 
                 topas.simulate(lines = lines,
                         inp_dict = inp_dict,
@@ -697,105 +1610,96 @@ class TOPAS_Refinements(Utils, UsefulUnicode, OUT_Parser, FileModifier, TOPAS_Mo
                 refinements_completed +=1
             else:
                 self.logger.debug(f'Rietveld Dummy.inp at {temp}')
-                
+            
                 self.refine_pattern_ixpxsx(dummy_inp_path) # Refine the pattern
                 refinements_completed += 1 # Tells the code it has just finished Rietveld
                 self.logger.debug('Finished refinement of Dummy.inp')
-            #}}}
-            #  Manage CRY Files: {{{ 
-            self.logger.debug('Finding CRY.OUT files')
-            cry_files = glob(os.path.join(path,'*_cry.out')) 
-            for file in cry_files:
-                file_basename = os.path.basename(file)
-                self.logger.debug(f'Converting {file_basename} to an INP')
-                copyfile(file, file.replace('.out', '.inp')) 
-            #}}} 
-            #######################################
-            # IxPxSx Refinements
-            #######################################
-            # Loop through IxPxSx Modes: {{{ 
-            recorded_out_dict = False
-            for type_idx, ixpxsx in enumerate(ixpxsx_types):
-                pbar.set_description_str(f'Working on {ixpxsx} for {basename}')
-                '''
-                The ixpxsx variable will be the string
-                of the type of refinement we want to do. 
-                '''
-                I = ixpxsx[0]
-                P = ixpxsx[1]
-                S = ixpxsx[2]
-                self.logger.debug(f'Starting {ixpxsx} Refinement for {temp}')
-                
-                # Check to see if we already have an out dict recorded: {{{
-                self.logger.debug('Making an OUT dictionary for Dummy.out')
-                if len(self.out_dicts) > 0 and refinements_completed > 1:
-                    #print(f'Retrieving out dict from out dicts for {temp} MODE: {I}{P}{S}')
-                    # retrieve out_dict closest to current temp:{{{ 
-                    out_dict = self.get_closest_entry_in_out_dict(
-                            temp, self.out_dicts
-                    ) 
-                    # Make sure that the recorded dict is okay to use.
-                    #before = out_dict['Ph2']['lp_a']
-                    #print(f'Before Refresh:\n\t{before}')
-                    #self.refresh_out_dict(out_dict, inp_dict)  
-                    #after = out_dict['Ph2']['lp_a']
-                    #print(f'After Refresh:\n\t{after}')
-                    #}}}
-                else: 
-                    # if not, get new out_dict: {{{ 
-                    with open(dummy_out_path, 'r') as out:
-                        lines = out.readlines() 
+        #}}}
+        #  Manage CRY Files: {{{ 
+        self.logger.debug('Finding CRY.OUT files')
+        cry_files = glob(os.path.join(path,'*_cry.out')) 
+        for file in cry_files:
+            file_basename = os.path.basename(file)
+            self.logger.debug(f'Converting {file_basename} to an INP')
+            copyfile(file, file.replace('.out', '.inp')) 
+        #}}} 
+        #######################################
+        # IxPxSx Refinements
+        #######################################
+        # Loop through IxPxSx Modes: {{{ 
+        recorded_out_dict = False
+        for type_idx, ixpxsx in enumerate(ixpxsx_types):
+            self._set_pbar_description(pbar, f'Working on {ixpxsx} for {basename}')
+            '''
+            The ixpxsx variable will be the string
+            of the type of refinement we want to do. 
+            '''
+            I = ixpxsx[0]
+            P = ixpxsx[1]
+            S = ixpxsx[2]
+            self.logger.debug(f'Starting {ixpxsx} Refinement for {temp}')
+            item = f'{basename} {ixpxsx}' # Name used by the profiler
+            
+            # Check to see if we already have an out dict recorded: {{{
+            self.logger.debug('Making an OUT dictionary for Dummy.out')
+            if len(out_dicts) > 0 and refinements_completed > 1:
+                # retrieve out_dict closest to current temp:{{{ 
+                out_dict = self.get_closest_entry_in_out_dict(
+                        temp, out_dicts
+                ) 
+                #}}}
+            else: 
+                # if not, get new out_dict: {{{ 
+                with self._stage('out parse', item):
+                    with OutFile(dummy_out_path) as out:
+                        lines = out.lines('body') # The C matrix is never needed here
                     out_dict = self.get_inp_out_dict(
                             lines, fileextension=data_extension, 
                             record_output_xy = True, debug = debug
                     )
-                    if refinements_completed == 1:
-                        # This means that it has just finished normal Rietveld
-                        out_dict['Rietveld'] = True
-                    #}}}
-                #}}} 
-                #print(f'START OF {I}{P}{S} REFINEMENT')
-                #out_ph = out_dict['Ph1']['lp_a']['fixed']
-                #print(f'Ph2 LPa is fixed: {out_ph}')
-                # Update the out_dicts for the temperature: {{{
-                if not recorded_out_dict and not out_dict.get('Rietveld'): 
-                    self.logger.debug('Recording out dict first time') 
-                    self.out_dicts[temp] = out_dict #
-                    recorded_out_dict = True
-                #}}} 
-                self.logger.debug(f'Copying {inp_basename} to Dummy.inp')
-                copyfile(inp_file, dummy_inp_path) 
-                # Manipulate the Dummy.inp file: {{{
-                with open(dummy_inp_path, 'r') as f:
-                    lines = f.readlines() # Gives access to all the lines 
-                # Update the INP to have the values from the output: {{{
-                lines, new_name = self.modify_inp_lines(
-                        lines, 
-                        out_dict, 
-                        I=I, 
-                        P=P, 
-                        S=S, 
-                        cry_files = cry_files,
-                        modify_ph=True, 
-                        modify_specimen_displacement = True, 
-                        modify_bkg = True,
-                        write_ixpxsx_lines = True,
-                        update_output_xy_line = True,
-                        new_suffix = f'{temp}_{I}{P}{S}', 
-                        modes_for_phases=modes_for_phases,
-                )
-                # make sure that new_name is a full path
-                new_name = os.path.join(path, new_name) + '.xy' 
-                # Write the updates to the Dummy file: {{{
-                self.logger.debug('Writing to Dummy.inp')
+                if refinements_completed == 1:
+                    # This means that it has just finished normal Rietveld
+                    out_dict['Rietveld'] = True
+                #}}}
+            #}}} 
+            # Update the out_dicts for the temperature: {{{
+            if not recorded_out_dict and not out_dict.get('Rietveld'): 
+                self.logger.debug('Recording out dict first time') 
+                out_dicts[temp] = out_dict #
+                recorded_out_dict = True
+            #}}} 
+            # Manipulate a copy of the template lines: {{{
+            lines = list(template_lines) # The template is only read once per directory
+            # Update the INP to have the values from the output: {{{
+            lines, new_name = self.modify_inp_lines(
+                    lines, 
+                    out_dict, 
+                    I=I, 
+                    P=P, 
+                    S=S, 
+                    cry_files = cry_files,
+                    modify_ph=True, 
+                    modify_specimen_displacement = True, 
+                    modify_bkg = True,
+                    write_ixpxsx_lines = True,
+                    update_output_xy_line = True,
+                    new_suffix = f'{temp}_{I}{P}{S}', 
+                    modes_for_phases=modes_for_phases,
+                    inp_dict = inp_dict, # inp_dict was parsed from the template
+            )
+            # make sure that new_name is a full path
+            new_name = os.path.join(path, new_name) + '.xy' 
+            # Write the updates to the Dummy file: {{{
+            self.logger.debug('Writing to Dummy.inp')
+            with self._stage('template write', item):
                 with open(dummy_inp_path, 'w') as f:
                     f.writelines(lines)
-                #}}} 
-                #    break # THIS IS TO TEST IF THE DUMMY IS UPDATING WELL
-                #}}} 
-                #}}}
-                # RUN IxPxSx REFINEMENT: {{{ 
-                pbar.set_description_str(f'Refining {ixpxsx} for {basename}')
+            #}}} 
+            #}}} 
+            #}}}
+            # RUN IxPxSx REFINEMENT: {{{ 
+            self._set_pbar_description(pbar, f'Refining {ixpxsx} for {basename}')
+            with self._stage('tc run', item):
                 if debug:
                     topas.simulate(
                         lines = lines, 
@@ -811,105 +1715,106 @@ class TOPAS_Refinements(Utils, UsefulUnicode, OUT_Parser, FileModifier, TOPAS_Mo
                     self.refine_pattern_ixpxsx(dummy_inp_path) 
                     refinements_completed += 1
                     self.logger.debug(f'Finished  {ixpxsx} refinement...')
-                #}}}
-                # Get current and previous Rwps: {{{
-                self.logger.debug(f'Reading the OUT file for {ixpxsx}')
-                with open(dummy_out_path, 'r') as f:
-                    lines = f.readlines()
+            #}}}
+            # Get current and previous Rwps: {{{
+            self.logger.debug(f'Reading the OUT file for {ixpxsx}')
+            with self._stage('out parse', item):
+                with OutFile(dummy_out_path) as out:
+                    lines = out.lines('body') # The C matrix is never needed here
                 current_out_dict = self.get_inp_out_dict(
                         lines, fileextension = data_extension, 
                         record_output_xy=True, debug = debug
                 ) 
-                current_rwp = current_out_dict['fit_metrics'].get('r_wp') 
-                if debug:
-                    current_rwp = 0 # This makes sure that we always do everything
-                previous_rwp =out_dict['fit_metrics'].get('r_wp') 
-                self.logger.debug(f'Current Rwp: {current_rwp} ' + 
-                                  f'Previous Rwp: {previous_rwp} '+
-                                  f'∆Rwp: {current_rwp - previous_rwp}'
-                )
-                #}}} 
-                # AFTER REFINEMENT Update Out Dict if meeting criteria: {{{
-                self.logger.debug('Update the self.out_dicts?')
-                #ph_entry_out_dict = out_dict['Ph2']['lp_a']['fixed']
-                #ph_entry_curr_out_dict =current_out_dict['Ph2']['lp_a']['fixed']
-                #print(f'CURRENT MODE: {I}{P}{S}, REFINEMENTS DONE {refinements_completed}')
-                #out_dict_rietveld = out_dict.get('Rietveld')
-                #current_rietveld = current_out_dict.get('Rietveld')
-                #print(f'OUT DICT RIETVELD: {out_dict_rietveld}\nCURRENT OUT DICT RIETVELD: {current_rietveld}')
-                #print(f'Out Dict LPa is fixed: {ph_entry_out_dict}\nCurrent out dict LPa is fixed: {ph_entry_curr_out_dict}')
-                if out_dict.get('Rietveld'):
-                    #print(f'Updating the out_dicts with the current one')
-                    self.out_dicts[temp] = current_out_dict 
-                    recorded_out_dict = True
-                elif current_rwp < previous_rwp and P != 'x':
-                    #print(f'Updating the out_dicts with the current one')
-                    self.logger.debug(f'Replacing out_dicts entry for {temp}')
-                     #  Overwrite the previous entry of out_dict 
-                    self.out_dicts[temp] = current_out_dict 
-                    recorded_out_dict = True
-                elif current_rwp > previous_rwp and P != 'x':
-                    # May need to update just in case. 
-                    self.logger.debug(f'Replacing out_dicts entry for {temp}')
-                    self.out_dicts[temp] = out_dict
-                    recorded_out_dict = True
-                #final_save = self.out_dicts[temp]['Ph2']['lp_a']['fixed']
-                #print(f'AFTER UPDATING SELF.OUT_DICTS:\n\tPh2 LPa Fixed: {final_save}')
-                #}}}
-                # Rename the OUT and Move Relevant Files to the IxPxSx Dir:  {{{ 
-                # make sure the new_out_name is a full path
-                #new_out_name = dummy_out_path.replace('.out', f'_{ixpxsx}.out')
-                new_out_name = inp_basename.replace('.inp', f'_{ixpxsx}.out')
-                new_inp_name = inp_basename.replace('.inp',f'_{ixpxsx}.inp')
+            current_rwp = current_out_dict['fit_metrics'].get('r_wp') 
+            if debug:
+                current_rwp = 0 # This makes sure that we always do everything
+            previous_rwp =out_dict['fit_metrics'].get('r_wp') 
+            self.logger.debug(f'Current Rwp: {current_rwp} ' + 
+                              f'Previous Rwp: {previous_rwp} '+
+                              f'∆Rwp: {current_rwp - previous_rwp}'
+            )
+            #}}} 
+            # AFTER REFINEMENT Update Out Dict if meeting criteria: {{{
+            self.logger.debug('Update the out_dicts?')
+            if out_dict.get('Rietveld'):
+                out_dicts[temp] = current_out_dict 
+                recorded_out_dict = True
+            elif current_rwp < previous_rwp and P != 'x':
+                self.logger.debug(f'Replacing out_dicts entry for {temp}')
+                 #  Overwrite the previous entry of out_dict 
+                out_dicts[temp] = current_out_dict 
+                recorded_out_dict = True
+            elif current_rwp > previous_rwp and P != 'x':
+                # May need to update just in case. 
+                self.logger.debug(f'Replacing out_dicts entry for {temp}')
+                out_dicts[temp] = out_dict
+                recorded_out_dict = True
+            #}}}
+            # Rename the OUT and Move Relevant Files to the IxPxSx Dir:  {{{ 
+            # make sure the new_out_name is a full path
+            new_out_name = os.path.join(path, inp_basename.replace('.inp', f'_{ixpxsx}.out'))
+            new_inp_name = os.path.join(path, inp_basename.replace('.inp',f'_{ixpxsx}.inp'))
  
+            with self._stage('copy/move', item):
                 copyfile(dummy_out_path, new_out_name) 
                 copyfile(dummy_inp_path, new_inp_name)
-                time.sleep(0.1) # Give TOPAS some time 
-                profile_data_files = glob(os.path.join(path, '*_profiles.out') )
-                 
-                files_to_move = profile_data_files
-                files_to_move.extend([new_out_name, new_inp_name])
-                
-                # Check that TOPAS Properly Output your XY if you output one: {{{
-                if new_name: 
+            profile_data_files = glob(os.path.join(path, '*_profiles.out') )
+             
+            files_to_move = profile_data_files
+            files_to_move.extend([new_out_name, new_inp_name])
+            
+            # Check that TOPAS Properly Output your XY if you output one: {{{
+            if new_name: 
+                self.logger.debug(
+                        f'Expecting to move {os.path.basename(new_name)}'
+                )
+                with self._stage('wait', item):
+                    self.wait_for_file_ready(new_name) # Give TOPAS time to finish writing the XY
+                try:
+                    new_name = glob(new_name)[0]
+                    files_to_move.append(new_name)
+                except:
                     self.logger.debug(
-                            f'Expecting to move {os.path.basename(new_name)}'
+                        f'Failed to find {os.path.basename(new_name)}'
                     )
-                    try:
-                        new_name = glob(new_name)[0]
-                        files_to_move.append(new_name)
-                    except:
-                        self.logger.debug(
-                            f'Failed to find {os.path.basename(new_name)}'
+                    if not debug:
+                        print('LAST OUTPUT DICTIONARY FOR REFERENCE: ')
+                        print(f'out_dict:\n{out_dict}')
+                        raise ValueError(
+                            'TOPAS tried to make '+
+                            f'{os.path.basename(new_name)} but failed!'
                         )
-                        if not debug:
-                            print('LAST OUTPUT DICTIONARY FOR REFERENCE: ')
-                            print(f'out_dict:\n{out_dict}')
-                            raise ValueError(
-                                'TOPAS tried to make '+
-                                f'{os.path.basename(new_name)} but failed!'
-                            )
-                #}}}
-             
-                pbar2 = tqdm(files_to_move, position = 1, leave = False)
-                for f in pbar2:  
-                    f_basename = os.path.basename(f)
-                    dest = os.path.join(path, ixpxsx)
-                    pbar2.set_description_str(
-                        f'Moving {os.path.basename(f)} to {ixpxsx}'
-                    )
-                    if os.path.exists(os.path.join(dest,f_basename)):
-                        # If file already exists in the directory, removed
-                        os.remove(os.path.join(dest,f_basename)) 
-                    time.sleep(0.5)
+            #}}}
+         
+            pbar2 = tqdm(files_to_move, position = 1, leave = False, disable = pbar is None)
+            for f in pbar2:  
+                f_basename = os.path.basename(f)
+                dest = os.path.join(path, ixpxsx)
+                pbar2.set_description_str(
+                    f'Moving {os.path.basename(f)} to {ixpxsx}'
+                )
+                if os.path.exists(os.path.join(dest,f_basename)):
+                    # If file already exists in the directory, removed
+                    os.remove(os.path.join(dest,f_basename)) 
+                with self._stage('wait', item):
+                    self.wait_for_file_ready(f) # Returns as soon as TOPAS is done with the file
+                with self._stage('copy/move', item):
                     try:
                         shutil.move(f, dest)
                     except:
                         # Give topas some extra time
-                        time.sleep(1)
+                        self.wait_for_file_ready(f, timeout = 30)
                         shutil.move(f, dest) 
-                #}}}  
-            #}}}
-        #}}}
+            #}}}  
         #}}}
+    #}}}
+    # _set_pbar_description: {{{
+    def _set_pbar_description(self, pbar = None, description:str = None):
+        '''
+        Worker processes do not get a progress bar, so only 
+        update the description if there is one. 
+        '''
+        if pbar is not None:
+            pbar.set_description_str(description)
+    #}}}
 #}}}
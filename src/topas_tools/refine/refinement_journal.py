@@ -0,0 +1,152 @@
+# Authorship: {{{
+'''
+Written by: Dario C. Lewczyk
+Date: 10/18/26
+'''
+#}}}
+# Imports: {{{
+import os
+import json
+import logging
+import numpy as np
+#}}}
+# RefinementJournal: {{{
+class RefinementJournal:
+    '''
+    An append-only record of the progress of run_auto_rietveld.
+
+    Each line of the journal is a JSON object.
+    Every run begins with a "header" record (the settings of the run and
+    the pattern numbers it will refine), followed by one record per pattern:
+        index: position in the list of patterns to refine
+        number: pattern number (1 indexed)
+        output: name of the output (no extension)
+        rwp: Rwp of the refinement (None if skipped)
+        status: "refined" or "skipped"
+        out_file_monitor: state of the phase on/off monitor after the refinement
+        last_good_out: path to the last .out file that was successfully refined
+
+    Since the file is flushed after each record, a crash can at most lose
+    the pattern being refined at the time.
+    '''
+    logger = logging.getLogger(__name__)
+    # __init__: {{{
+    def __init__(self, path:str = None):
+        '''
+        path: The filename of the journal
+        '''
+        self.path = path
+    #}}}
+    # _append: {{{
+    def _append(self, record:dict = None):
+        line = json.dumps(record, default = self._to_json) + '\n'
+        if self._ends_with_partial_line():
+            line = '\n' + line # Keep a torn record from swallowing this one
+        with open(self.path, 'a') as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno()) # Make sure the record survives a crash
+    #}}}
+    # _ends_with_partial_line: {{{
+    def _ends_with_partial_line(self):
+        if not os.path.isfile(self.path) or os.path.getsize(self.path) == 0:
+            return False
+        with open(self.path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) != b'\n'
+    #}}}
+    # _to_json: {{{
+    @staticmethod
+    def _to_json(obj):
+        '''
+        Handles the numpy types that show up in the monitor
+        '''
+        if isinstance(obj, np.generic):
+            return obj.item()
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        raise TypeError(f'{type(obj)} cannot be written to the journal')
+    #}}}
+    # start: {{{
+    def start(self, run_info:dict = None):
+        '''
+        Writes the header for a new run.
+        run_info: dictionary of settings needed to check that a resumed run matches
+        '''
+        record = {'record': 'header'}
+        record.update(run_info or {})
+        self._append(record)
+    #}}}
+    # record: {{{
+    def record(self,
+            index:int = None,
+            number:int = None,
+            output:str = None,
+            rwp:float = None,
+            status:str = 'refined',
+            out_file_monitor:dict = None,
+            last_good_out:str = None,
+        ):
+        '''
+        Writes the record for a single pattern.
+        '''
+        self._append({
+            'record': 'pattern',
+            'index': index,
+            'number': number,
+            'output': output,
+            'rwp': rwp,
+            'status': status,
+            'out_file_monitor': out_file_monitor,
+            'last_good_out': last_good_out,
+        })
+    #}}}
+    # read: {{{
+    def read(self):
+        '''
+        Reads the records of the most recent run.
+
+        returns: (header, records)
+            header is None if there is no journal
+        '''
+        header = None
+        records = []
+        if not os.path.isfile(self.path):
+            return header, records
+        with open(self.path, 'r') as f:
+            for i, line in enumerate(f):
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash while writing leaves a partial line at the end
+                    self.logger.debug(f'Ignoring incomplete journal line: {i}')
+                    continue
+                if entry.get('record') == 'header':
+                    header = entry
+                    records = [] # A new run starts here
+                else:
+                    records.append(entry)
+        return header, records
+    #}}}
+    # last_committed: {{{
+    def last_committed(self):
+        '''
+        returns: (header, last pattern record)
+            the last record is None if no patterns have been recorded
+        '''
+        header, records = self.read()
+        last = records[-1] if records else None
+        return header, last
+    #}}}
+    # restore_out_file_monitor: {{{
+    @staticmethod
+    def restore_out_file_monitor(out_file_monitor:dict = None):
+        '''
+        JSON turns the integer keys of the monitor into strings.
+        This puts them back.
+        '''
+        if not out_file_monitor:
+            return {}
+        return {int(k): v for k, v in out_file_monitor.items()}
+    #}}}
+#}}}
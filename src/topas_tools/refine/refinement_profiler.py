@@ -0,0 +1,115 @@
+# Authorship: {{{
+'''
+Written by: Dario C. Lewczyk
+Date: 10/18/26
+'''
+#}}}
+# Imports: {{{
+import os
+import csv
+import json
+import time
+from contextlib import contextmanager
+import texttable
+#}}}
+# RefinementProfiler: {{{
+class RefinementProfiler:
+    '''
+    Records the wall time spent in each stage of an automated refinement.
+
+    Use it as:
+        with profiler.stage('tc run', item = 'result_000001'):
+            ...
+
+    Every stage makes one record:
+        item: the pattern or directory being worked on
+        stage: e.g. template write, tc run, out parse, monitoring, copy/move, wait, phase deconvolution
+        start: epoch time the stage started
+        duration: wall time in seconds
+        pid: the process that did the work (useful for parallel runs)
+    '''
+    fields = ['item', 'stage', 'start', 'duration', 'pid']
+    # __init__: {{{
+    def __init__(self):
+        self.records = []
+    #}}}
+    # stage: {{{
+    @contextmanager
+    def stage(self, stage:str = None, item:str = None):
+        start = time.time()
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.records.append({
+                'item': item,
+                'stage': stage,
+                'start': start,
+                'duration': time.perf_counter() - t0,
+                'pid': os.getpid(),
+            })
+    #}}}
+    # extend: {{{
+    def extend(self, records:list = None):
+        '''
+        Adds records made somewhere else (e.g. in a worker process)
+        '''
+        self.records.extend(records or [])
+    #}}}
+    # reset: {{{
+    def reset(self):
+        self.records = []
+    #}}}
+    # to_csv: {{{
+    def to_csv(self, filename:str = None):
+        with open(filename, 'w', newline = '') as f:
+            writer = csv.DictWriter(f, fieldnames = self.fields)
+            writer.writeheader()
+            writer.writerows(sorted(self.records, key = lambda r: r['start']))
+    #}}}
+    # to_json: {{{
+    def to_json(self, filename:str = None):
+        with open(filename, 'w') as f:
+            json.dump(sorted(self.records, key = lambda r: r['start']), f, indent = 1)
+    #}}}
+    # summary: {{{
+    def summary(self):
+        '''
+        returns a dictionary with the count, total, mean and max time of each stage
+        '''
+        summary = {}
+        for record in self.records:
+            entry = summary.setdefault(record['stage'], {'count': 0, 'total': 0.0, 'max': 0.0})
+            entry['count'] += 1
+            entry['total'] += record['duration']
+            entry['max'] = max(entry['max'], record['duration'])
+        for entry in summary.values():
+            entry['mean'] = entry['total']/entry['count']
+        return summary
+    #}}}
+    # print_summary: {{{
+    def print_summary(self):
+        summary = self.summary()
+        grand_total = sum(entry['total'] for entry in summary.values()) or 1
+        table = texttable.Texttable()
+        table.set_cols_align(['l', 'r', 'r', 'r', 'r', 'r'])
+        table.set_cols_dtype(['t', 'i', 'f', 'f', 'f', 'f'])
+        table.set_precision(3)
+        rows = [['Stage', 'Count', 'Total (s)', 'Mean (s)', 'Max (s)', '% of Total']]
+        for stage, entry in sorted(summary.items(), key = lambda kv: -kv[1]['total']):
+            rows.append([stage, entry['count'], entry['total'], entry['mean'], entry['max'], 100*entry['total']/grand_total])
+        table.add_rows(rows)
+        print(table.draw())
+    #}}}
+    # report: {{{
+    def report(self, directory:str = None, basename:str = 'refinement_profile'):
+        '''
+        Writes the timeline as CSV and JSON to the directory given
+        and prints the summary table.
+        '''
+        if directory is not None:
+            self.to_csv(os.path.join(directory, f'{basename}.csv'))
+            self.to_json(os.path.join(directory, f'{basename}.json'))
+        self.print_summary()
+    #}}}
+#}}}
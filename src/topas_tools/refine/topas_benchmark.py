@@ -0,0 +1,449 @@
+# Authorship: {{{
+'''
+Written by: Dario C. Lewczyk
+Date: 10/18/26
+'''
+#}}}
+# Imports: {{{
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import texttable
+from topas_tools.refine.refine import TOPAS_Refinements
+from topas_tools.refine.topas_executor import FakeTOPASExecutor
+from topas_tools.utils.topas_parser import TOPAS_Parser
+#}}}
+# Synthetic INP templates: {{{
+IXPXSX_INP = '''macro WPF_IPS_1() {{ }}
+macro WPF_xPS_1() {{ }}
+macro WPF_xPx_1() {{ }}
+macro WPF_xxx_1() {{ }}
+
+r_wp 0
+xdd "{basename}.xy"
+  bkg @ 10`_1 2`_0.5 0.1`_0.01
+  Specimen_Displacement(@ , 0.01`_0.001)
+  Out_X_Yobs_Ycalc_Ydiff("result_{temp}C_Rietveld.xy")
+  str
+    phase_name "A"
+    prm Ph1(lp_a) {a:.5f}`_0.001 min 3 max 4
+    prm Ph1(lp_c) {c:.5f}`_0.001
+'''
+RIETVELD_INP_HEADER = '''r_wp 0
+xdd "placeholder.xy"
+  bkg @ 10`_1 2`_0.5 0.1`_0.01
+  Specimen_Displacement(@ , 0.01`_0.001)
+  Out_X_Yobs_Ycalc_Ydiff("result.xy")
+'''
+RIETVELD_INP_PHASE = '''
+  str
+    phase_name "P{k}"
+    scale sf_P{k} 1.0e-4
+    prm P{k}(lp_a) {a:.5f}`_0.001 min 3 max 6
+    a {a:.5f}`_0.001
+'''
+#}}}
+# Reference tokenizer (before the compiled lexer): {{{
+def _reference_tokenize_line(line:str = None):
+    '''
+    The per-line tokenizer as it was: the alternation regex is joined and compiled on each call
+    '''
+    tok_regex = "|".join(
+        f"(?P<{name}>{pattern})"
+        for name, pattern in TOPAS_Parser.TOKEN_SPEC
+    )
+    tokens = []
+    for m in re.finditer(tok_regex, line):
+        kind = m.lastgroup
+        value = m.group()
+        if kind in ("SKIP", "COMMENT", "NEWLINE"):
+            continue
+        tokens.append((kind, value))
+    return tokens
+
+def _reference_build_ast(parser:TOPAS_Parser = None, topas_lines:dict = None):
+    '''
+    The AST builder as it was: one tokenize call per line, then a regex parse of each prm line
+    '''
+    token_stream = [(lineno, _reference_tokenize_line(topas_lines[lineno])) for lineno in sorted(topas_lines.keys())]
+    ast = {"macros": [], "prms": []}
+    i = 0
+    while i < len(token_stream):
+        lineno, tokens = token_stream[i]
+        macro, new_i = parser.collect_macro_block(token_stream, i)
+        if macro:
+            ast["macros"].append(macro)
+            i = new_i + 1
+            continue
+        prm = parser.parse_generic_prm_line(topas_lines[lineno])
+        if prm:
+            prm["linenumber"] = lineno
+            ast["prms"].append(prm)
+        i += 1
+    return ast
+#}}}
+# TOPAS_Benchmark: {{{
+class TOPAS_Benchmark:
+    '''
+    Runs the refinement automations end to end on synthetic data
+    using FakeTOPASExecutor, so no TOPAS licence is needed.
+
+    Nothing is refined for real, so the time measured is the overhead of the
+    automation itself (file handling, parsing, monitoring, scheduling).
+    This makes it useful to catch regressions in the orchestration code.
+
+    Each run reports the throughput in patterns/s.
+    For IxPxSx, every refinement (Rietveld + each mode) counts as a pattern.
+    '''
+    # __init__: {{{
+    def __init__(self,
+            work_dir:str = None,
+            noise:float = 0.02,
+            max_workers:int = 1,
+            n_points:int = 2000,
+            profile:bool = False,
+            keep:bool = False,
+            seed:int = 0,
+        ):
+        '''
+        work_dir: Where the synthetic data are written (default: a temporary directory)
+        noise: Relative noise FakeTOPAS applies to the refined values
+        max_workers: Number of simulated refinements allowed at once by the executor
+        n_points: Number of points in each synthetic pattern
+        profile: If True, the per-stage profile of each run is kept with the results
+        keep: If True, the synthetic data are not deleted after each run
+        seed: Seed for the synthetic patterns
+        '''
+        self.work_dir = work_dir
+        self.noise = noise
+        self.max_workers = max_workers
+        self.n_points = n_points
+        self.profile = profile
+        self.keep = keep
+        self.rng = np.random.default_rng(seed)
+        self.results = []
+    #}}}
+    # _make_pattern: {{{
+    def _make_pattern(self, n_peaks:int = 8):
+        '''
+        Makes a synthetic diffraction pattern (tth, intensity)
+        with a few gaussian peaks on a sloped background.
+        '''
+        tth = np.linspace(5, 60, self.n_points)
+        y = 200 - 1.5*tth
+        for center in self.rng.uniform(10, 55, n_peaks):
+            y += self.rng.uniform(500, 5000)*np.exp(-(tth - center)**2/0.02)
+        y += self.rng.normal(0, 5, self.n_points)
+        return tth, y
+    #}}}
+    # _new_dir: {{{
+    def _new_dir(self, name:str = None):
+        base = self.work_dir or tempfile.gettempdir()
+        os.makedirs(base, exist_ok = True)
+        return tempfile.mkdtemp(prefix = f'{name}_', dir = base)
+    #}}}
+    # make_ixpxsx_tree: {{{
+    def make_ixpxsx_tree(self,
+            n_temps:int = 10,
+            home_dir:str = None,
+            ixpxsx_types:list = ['IPS', 'xPS', 'xPx', 'xxx'],
+            start_temp:int = 25,
+            temp_step:int = 25,
+        ):
+        '''
+        Makes the directory structure used by run_auto_ixpxsx_refinements:
+            home_dir/
+                1_25C/
+                    1_25C.inp
+                    1_25C.xy
+                    IPS/ xPS/ xPx/ xxx/
+                2_50C/
+                ...
+
+        returns: home_dir
+        '''
+        if home_dir is None:
+            home_dir = self._new_dir('ixpxsx_benchmark')
+        for n in range(1, n_temps + 1):
+            temp = start_temp + (n-1)*temp_step
+            basename = f'{n}_{temp}C'
+            path = os.path.join(home_dir, basename)
+            for ixpxsx in ixpxsx_types:
+                os.makedirs(os.path.join(path, ixpxsx), exist_ok = True)
+            with open(os.path.join(path, f'{basename}.inp'), 'w') as f:
+                f.write(IXPXSX_INP.format(
+                    basename = basename,
+                    temp = temp,
+                    a = 3.5*(1 + 1e-5*temp), # Thermal expansion so the warm start matters
+                    c = 5.5*(1 + 1e-5*temp),
+                ))
+            tth, y = self._make_pattern()
+            np.savetxt(os.path.join(path, f'{basename}.xy'), np.c_[tth, y], fmt = '%.5f')
+        return home_dir
+    #}}}
+    # make_time_series: {{{
+    def make_time_series(self,
+            n_patterns:int = 100,
+            base_dir:str = None,
+            n_phases:int = 2,
+            time_step:int = 10,
+        ):
+        '''
+        Makes the data and template directories used by run_auto_rietveld:
+            base_dir/
+                data/
+                    scan_000001_100000.xy
+                    ...
+                template/
+                    template.inp
+
+        returns: (data_dir, template_dir)
+        '''
+        if base_dir is None:
+            base_dir = self._new_dir('rietveld_benchmark')
+        data_dir = os.path.join(base_dir, 'data')
+        template_dir = os.path.join(base_dir, 'template')
+        os.makedirs(data_dir, exist_ok = True)
+        os.makedirs(template_dir, exist_ok = True)
+        for i in range(n_patterns):
+            tth, y = self._make_pattern()
+            np.savetxt(
+                os.path.join(data_dir, f'scan_{i+1:06d}_{100000 + i*time_step:06d}.xy'),
+                np.c_[tth, y],
+                fmt = '%.5f',
+                header = 'tth intensity',
+            )
+        lines = [RIETVELD_INP_HEADER]
+        for k in range(1, n_phases + 1):
+            lines.append(RIETVELD_INP_PHASE.format(k = k, a = 3.0 + 0.5*k))
+        with open(os.path.join(template_dir, 'template.inp'), 'w') as f:
+            f.write(''.join(lines))
+        return data_dir, template_dir
+    #}}}
+    # _get_refinements: {{{
+    def _get_refinements(self):
+        return TOPAS_Refinements(
+                executor = FakeTOPASExecutor(noise = self.noise, max_workers = self.max_workers),
+                profile = self.profile,
+        )
+    #}}}
+    # _record: {{{
+    def _record(self, name:str = None, patterns:int = None, seconds:float = None, refinements = None, **info):
+        result = {
+            'name': name,
+            'patterns': patterns,
+            'seconds': seconds,
+            'patterns_per_s': patterns/seconds if seconds else float('nan'),
+        }
+        result.update(info)
+        if self.profile and refinements is not None and refinements.profiler is not None:
+            result['profile'] = refinements.profiler.summary()
+        self.results.append(result)
+        return result
+    #}}}
+    # _cleanup: {{{
+    def _cleanup(self, path:str = None):
+        if not self.keep:
+            shutil.rmtree(path, ignore_errors = True)
+    #}}}
+    # run_ixpxsx: {{{
+    def run_ixpxsx(self,
+            n_temps:int = 10,
+            workers:int = 1,
+            warm_start:bool = True,
+            ixpxsx_types:list = ['IPS', 'xPS', 'xPx', 'xxx'],
+            **kwargs
+        ):
+        '''
+        Times run_auto_ixpxsx_refinements on n_temps synthetic directories.
+        kwargs are passed to run_auto_ixpxsx_refinements.
+        '''
+        home_dir = self.make_ixpxsx_tree(n_temps, ixpxsx_types = ixpxsx_types)
+        refinements = self._get_refinements()
+        cwd = os.getcwd() # The automation changes directories
+        try:
+            t0 = time.perf_counter()
+            refinements.run_auto_ixpxsx_refinements(
+                    home_dir = home_dir,
+                    ixpxsx_types = ixpxsx_types,
+                    workers = workers,
+                    warm_start = warm_start,
+                    **kwargs
+            )
+            seconds = time.perf_counter() - t0
+        finally:
+            os.chdir(cwd)
+            self._cleanup(home_dir)
+        return self._record(
+                name = f'ixpxsx (workers={workers})',
+                patterns = n_temps*(1 + len(ixpxsx_types)),
+                seconds = seconds,
+                refinements = refinements,
+                n_temps = n_temps,
+        )
+    #}}}
+    # run_rietveld: {{{
+    def run_rietveld(self,
+            n_patterns:int = 100,
+            mode:str = 'auto',
+            n_phases:int = 2,
+            **kwargs
+        ):
+        '''
+        Times one of the sequential Rietveld automations on n_patterns synthetic patterns.
+
+        mode:
+            "auto": run_auto_rietveld
+            "segmented": run_segmented_rietveld
+            "adaptive": run_adaptive_rietveld
+        kwargs are passed to the automation (e.g. segments, workers, coarse, budget, phases_to_disable)
+        '''
+        runs = {
+            'auto': 'run_auto_rietveld',
+            'segmented': 'run_segmented_rietveld',
+            'adaptive': 'run_adaptive_rietveld',
+        }
+        if mode not in runs:
+            raise ValueError(f'mode must be one of: {list(runs)}, got: {mode}')
+        data_dir, template_dir = self.make_time_series(n_patterns, n_phases = n_phases)
+        base_dir = os.path.dirname(data_dir)
+        kwargs.setdefault('snr_threshold', None) # Synthetic patterns are not screened unless you ask
+        refinements = self._get_refinements()
+        cwd = os.getcwd() # The automation changes directories
+        try:
+            t0 = time.perf_counter()
+            getattr(refinements, runs[mode])(
+                    refinements = n_patterns,
+                    data_dir = data_dir,
+                    template_dir = template_dir,
+                    **kwargs
+            )
+            seconds = time.perf_counter() - t0
+            patterns = len([f for f in os.listdir(template_dir) if f.startswith('result') and f.endswith('.out')])
+        finally:
+            os.chdir(cwd)
+            self._cleanup(base_dir)
+        return self._record(
+                name = f'rietveld ({mode})',
+                patterns = patterns,
+                seconds = seconds,
+                refinements = refinements,
+                n_patterns = n_patterns,
+        )
+    #}}}
+    # run_tokenizer: {{{
+    def run_tokenizer(self,
+            n_files:int = 50,
+            n_phases:int = 20,
+            repeat:int = 3,
+        ):
+        '''
+        Micro-benchmark of the TOPAS_Parser lexer.
+        Compares the reference (regex rebuilt on every line) against the compiled lexer
+        for build_ast_from_topas_lines on n_files synthetic INPs with n_phases phases each.
+
+        The best of "repeat" runs is recorded for each.
+        '''
+        parser = TOPAS_Parser()
+        text = RIETVELD_INP_HEADER + ''.join(RIETVELD_INP_PHASE.format(k = k, a = 3.0 + 0.01*k) for k in range(n_phases))
+        topas_lines = {i: line for i, line in enumerate(text.splitlines())}
+        runs = {
+            'tokenizer (reference)': lambda: _reference_build_ast(parser, topas_lines),
+            'tokenizer (compiled)': lambda: parser.build_ast_from_topas_lines(topas_lines),
+        }
+        results = {}
+        for name, build in runs.items():
+            best = float('inf')
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                for _ in range(n_files):
+                    build()
+                best = min(best, time.perf_counter() - t0)
+            results[name] = self._record(
+                    name = name,
+                    patterns = n_files,
+                    seconds = best,
+                    lines = len(topas_lines)*n_files,
+            )
+        speedup = results['tokenizer (reference)']['seconds']/results['tokenizer (compiled)']['seconds']
+        results['tokenizer (compiled)']['speedup'] = speedup
+        print(f'Compiled lexer: {speedup:.2f}x faster than the reference on {len(topas_lines)*n_files} lines')
+        return results['tokenizer (compiled)']
+    #}}}
+    # print_results: {{{
+    def print_results(self):
+        table = texttable.Texttable()
+        table.set_cols_align(['l', 'r', 'r', 'r'])
+        table.set_cols_dtype(['t', 'i', 'f', 'f'])
+        table.set_precision(3)
+        rows = [['Benchmark', 'Patterns', 'Time (s)', 'Patterns/s']]
+        for result in self.results:
+            rows.append([result['name'], result['patterns'], result['seconds'], result['patterns_per_s']])
+        table.add_rows(rows)
+        print(table.draw())
+    #}}}
+    # to_json: {{{
+    def to_json(self, filename:str = None):
+        with open(filename, 'w') as f:
+            json.dump(self.results, f, indent = 1)
+    #}}}
+#}}}
+# main: {{{
+def main(argv:list = None):
+    '''
+    Command line entry point:
+
+        python -m topas_tools.refine.topas_benchmark --ixpxsx 10 --rietveld 100 --min-throughput 5
+
+    Exits with 1 if any benchmark is slower than --min-throughput (patterns/s)
+    so it can be used as a check on a CI box.
+    '''
+    parser = argparse.ArgumentParser(description = 'Benchmark the TOPAS automations on synthetic data with FakeTOPAS')
+    parser.add_argument('--ixpxsx', type = int, default = 10, help = 'Number of temperatures for run_auto_ixpxsx_refinements (0 to skip)')
+    parser.add_argument('--rietveld', type = int, default = 100, help = 'Number of patterns for the Rietveld automations (0 to skip)')
+    parser.add_argument('--tokenizer', type = int, default = 0, help = 'Number of synthetic INPs for the lexer micro-benchmark (0 to skip)')
+    parser.add_argument('--modes', nargs = '+', default = ['auto'], choices = ['auto', 'segmented', 'adaptive'], help = 'Rietveld automations to run')
+    parser.add_argument('--phases', type = int, default = 2, help = 'Number of phases in the Rietveld template')
+    parser.add_argument('--workers', type = int, default = 1, help = 'Worker processes for the parallel modes')
+    parser.add_argument('--points', type = int, default = 2000, help = 'Points per synthetic pattern')
+    parser.add_argument('--work-dir', default = None, help = 'Where to write the synthetic data (default: temp dir)')
+    parser.add_argument('--keep', action = 'store_true', help = 'Keep the synthetic data')
+    parser.add_argument('--profile', action = 'store_true', help = 'Record the per-stage profile of each run')
+    parser.add_argument('--json', default = None, help = 'Write the results to this file')
+    parser.add_argument('--min-throughput', type = float, default = None, help = 'Fail if any benchmark is below this many patterns/s')
+    args = parser.parse_args(argv)
+
+    benchmark = TOPAS_Benchmark(
+            work_dir = args.work_dir,
+            n_points = args.points,
+            profile = args.profile,
+            keep = args.keep,
+    )
+    if args.ixpxsx > 0:
+        benchmark.run_ixpxsx(n_temps = args.ixpxsx, workers = args.workers)
+    if args.rietveld > 0:
+        for mode in args.modes:
+            kwargs = {}
+            if mode == 'segmented':
+                kwargs['workers'] = args.workers
+            benchmark.run_rietveld(n_patterns = args.rietveld, mode = mode, n_phases = args.phases, **kwargs)
+    if args.tokenizer > 0:
+        benchmark.run_tokenizer(n_files = args.tokenizer, n_phases = args.phases)
+    benchmark.print_results()
+    if args.json:
+        benchmark.to_json(args.json)
+    if args.min_throughput is not None:
+        slow = [r['name'] for r in benchmark.results if r['patterns_per_s'] < args.min_throughput]
+        if slow:
+            print(f'Below {args.min_throughput} patterns/s: {slow}')
+            return 1
+    return 0
+#}}}
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,254 @@
+# Authorship: {{{
+'''
+Written by: Dario C. Lewczyk
+Date: 10/18/26
+'''
+#}}}
+# Imports: {{{
+import os
+import re
+import logging
+import asyncio
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait
+from topas_tools.refine.topas_simulator import FakeTOPAS
+from topas_tools.utils.topas_parser import TOPAS_Parser
+#}}}
+# TOPASExecutor: {{{
+class TOPASExecutor:
+    '''
+    Base class for the backends that run TOPAS.
+
+    An executor takes the path to an INP file and returns a
+    concurrent.futures.Future that resolves to the return code of the refinement.
+    No more than max_workers refinements will ever run at the same time.
+
+    Subclasses only need to implement _run(input_path, inp_dir)
+    '''
+    logger = logging.getLogger(__name__)
+    # __init__: {{{
+    def __init__(self, max_workers:int = 1):
+        '''
+        max_workers: The maximum number of refinements allowed to run at once.
+        '''
+        if max_workers < 1:
+            raise ValueError(f'max_workers must be at least 1, got: {max_workers}')
+        self.max_workers = max_workers
+        self._pool = None # Created on the first submission
+    #}}}
+    # __getstate__: {{{
+    def __getstate__(self):
+        '''
+        Thread pools cannot be pickled.
+        This allows an executor to be sent to a worker process
+        where a new pool is made on the first submission.
+        '''
+        state = self.__dict__.copy()
+        state['_pool'] = None
+        return state
+    #}}}
+    # _get_pool: {{{
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers = self.max_workers)
+        return self._pool
+    #}}}
+    # _resolve_input: {{{
+    def _resolve_input(self, input_file:str = None, cwd:str = None):
+        '''
+        Returns the absolute path of the INP file and the
+        directory it sits in.
+        '''
+        if cwd is None:
+            cwd = os.getcwd()
+        input_path = os.path.join(cwd, input_file) # If input_file is absolute, cwd is ignored
+        return input_path, os.path.dirname(input_path)
+    #}}}
+    # submit: {{{
+    def submit(self, input_file:str = None, cwd:str = None):
+        '''
+        input_file: The INP file you want to refine
+        cwd: The directory the INP file is relative to (default: current directory)
+
+        returns a Future
+        '''
+        input_path, inp_dir = self._resolve_input(input_file, cwd)
+        self.logger.debug(f'Submitting {input_path}')
+        return self._get_pool().submit(self._run, input_path, inp_dir)
+    #}}}
+    # run: {{{
+    def run(self, input_file:str = None, cwd:str = None):
+        '''
+        Blocking version of submit.
+        returns the return code of the refinement
+        '''
+        return self.submit(input_file, cwd).result()
+    #}}}
+    # wait_all: {{{
+    def wait_all(self, futures:list = None):
+        '''
+        Waits for all of the futures given and raises
+        the first error encountered (if any)
+        '''
+        wait(futures)
+        return [future.result() for future in futures]
+    #}}}
+    # _run: {{{
+    def _run(self, input_path:str = None, inp_dir:str = None):
+        raise NotImplementedError('Executors must implement _run()')
+    #}}}
+    # shutdown: {{{
+    def shutdown(self, wait:bool = True):
+        if self._pool is not None:
+            self._pool.shutdown(wait = wait)
+            self._pool = None
+    #}}}
+#}}}
+# LocalTOPASExecutor: {{{
+class LocalTOPASExecutor(TOPASExecutor):
+    '''
+    Runs "tc" from the TOPAS directory as a blocking subprocess
+    on a pool of threads.
+
+    Each refinement is given the TOPAS directory as its working directory
+    so the process never has to change directories (which is not thread safe).
+    '''
+    # __init__: {{{
+    def __init__(self, topas_dir:str = 'C:\\TOPAS6', max_workers:int = 1):
+        '''
+        topas_dir: The TOPAS installation directory (where "tc" is found)
+        max_workers: The maximum number of "tc" processes allowed at once
+        '''
+        super().__init__(max_workers = max_workers)
+        self.topas_dir = topas_dir
+    #}}}
+    # _run: {{{
+    def _run(self, input_path:str = None, inp_dir:str = None):
+        tc = os.path.join(self.topas_dir, 'tc')
+        return subprocess.call([tc, input_path], cwd = self.topas_dir)
+    #}}}
+#}}}
+# AsyncTOPASExecutor: {{{
+class AsyncTOPASExecutor(TOPASExecutor):
+    '''
+    Runs "tc" with asyncio subprocesses on an event loop
+    that lives in a background thread.
+
+    Concurrency is limited by an asyncio.Semaphore rather than
+    by a pool of blocked threads, so this scales well when many
+    refinements are queued at once.
+    '''
+    # __init__: {{{
+    def __init__(self, topas_dir:str = 'C:\\TOPAS6', max_workers:int = 1):
+        '''
+        topas_dir: The TOPAS installation directory (where "tc" is found)
+        max_workers: The maximum number of "tc" processes allowed at once
+        '''
+        super().__init__(max_workers = max_workers)
+        self.topas_dir = topas_dir
+        self._loop = None
+        self._thread = None
+        self._semaphore = None
+    #}}}
+    # __getstate__: {{{
+    def __getstate__(self):
+        state = super().__getstate__()
+        state.update({'_loop': None, '_thread': None, '_semaphore': None})
+        return state
+    #}}}
+    # _get_loop: {{{
+    def _get_loop(self):
+        '''
+        Starts the event loop thread on the first submission.
+        '''
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target = self._loop.run_forever, daemon = True)
+            self._thread.start()
+        return self._loop
+    #}}}
+    # _run_async: {{{
+    async def _run_async(self, input_path:str = None, inp_dir:str = None):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+        async with self._semaphore:
+            tc = os.path.join(self.topas_dir, 'tc')
+            proc = await asyncio.create_subprocess_exec(tc, input_path, cwd = self.topas_dir)
+            return await proc.wait()
+    #}}}
+    # submit: {{{
+    def submit(self, input_file:str = None, cwd:str = None):
+        input_path, inp_dir = self._resolve_input(input_file, cwd)
+        self.logger.debug(f'Submitting {input_path}')
+        return asyncio.run_coroutine_threadsafe(
+                self._run_async(input_path, inp_dir),
+                self._get_loop()
+        )
+    #}}}
+    # shutdown: {{{
+    def shutdown(self, wait:bool = True):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            if wait:
+                self._thread.join()
+            self._loop = None
+            self._thread = None
+            self._semaphore = None
+    #}}}
+#}}}
+# FakeTOPASExecutor: {{{
+class FakeTOPASExecutor(TOPASExecutor):
+    '''
+    Drop-in backend that uses FakeTOPAS instead of calling "tc".
+
+    The INP is parsed, the refined values are perturbed, and the following are written
+    next to the INP (just like TOPAS would):
+        <inp name>.out
+        <phase>_cry.out
+        any files requested with Out_X_Yobs_Ycalc_Ydiff
+
+    This makes it possible to run the automations on any OS without a TOPAS install.
+    '''
+    output_xy_re = re.compile(r'Out_X_Yobs_Ycalc_Ydiff\(\s*"?([^")]+?)"?\s*\)')
+    # __init__: {{{
+    def __init__(self, noise:float = 0.02, max_workers:int = 1, fileextension:str = 'xy'):
+        '''
+        noise: Relative noise applied to the refined values
+        max_workers: The maximum number of simulated refinements allowed at once
+        fileextension: The extension of the data files referenced by the INP
+        '''
+        super().__init__(max_workers = max_workers)
+        self.noise = noise
+        self.fileextension = fileextension
+    #}}}
+    # _run: {{{
+    def _run(self, input_path:str = None, inp_dir:str = None):
+        with open(input_path, 'r') as f:
+            lines = f.readlines()
+        inp_dict = TOPAS_Parser().get_inp_out_dict(
+                lines,
+                record_fit_metrics = False,
+                fileextension = self.fileextension,
+        )
+        # Find the XY file TOPAS would output: {{{
+        output_xy = None
+        for line in lines:
+            stripped = line.strip()
+            if stripped.startswith("'"):
+                continue # Commented out
+            m = self.output_xy_re.search(stripped)
+            if m:
+                output_xy = os.path.join(inp_dir, m.group(1))
+        #}}}
+        out_filename = os.path.splitext(input_path)[0] + '.out'
+        FakeTOPAS(noise = self.noise).simulate(
+                lines = lines,
+                inp_dict = inp_dict,
+                out_filename = out_filename,
+                output_xy = output_xy,
+                cry_dir = inp_dir,
+        )
+        return 0
+    #}}}
+#}}}
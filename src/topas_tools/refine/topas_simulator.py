@@ -8,6 +8,7 @@ Date: 01/27/26
 import numpy as np
 import random
 import copy
+import os
 from shutil import copyfile
 #}}}
 # FakeTOPAS: {{{
@@ -30,11 +31,14 @@ class FakeTOPAS:
             inp_dict, 
             out_filename = 'Dummy.out',
             output_xy:str = None,
+            cry_dir:str = None,
             ):
         ''' 
         lines: These are the lines from the inp file you read in
         inp_dict: the dictionary with all your inp stuff
         out_filename: The name of the .out file made
+        output_xy: The name of the xy file to make (if any)
+        cry_dir: Where to write the *_cry.out files (default: current directory)
         '''
 
         # Working copy of lines:
@@ -43,7 +47,7 @@ class FakeTOPAS:
         for ph, params in inp_dict.items():
             if not ph.startswith('Ph'):
                 continue
-            with open(f'{ph}_cry.out', 'w') as f:
+            with open(os.path.join(cry_dir or '', f'{ph}_cry.out'), 'w') as f:
                 f.write('CRY LINES')
             for var, entry in params.items():
                 ln = entry['linenumber']
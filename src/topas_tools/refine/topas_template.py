@@ -0,0 +1,128 @@
+# Authorship: {{{
+'''
+Written by: Dario C. Lewczyk
+Date: 10/18/26
+'''
+#}}}
+# Imports: {{{
+import re
+#}}}
+# TopasTemplate: {{{
+class TopasTemplate:
+    '''
+    Holds the lines of a template INP in memory along with the
+    linenumbers of the lines that change for every pattern in run_auto_rietveld:
+        xdd
+        Out_X_Yobs_Ycalc_Ydiff
+        out_prm_vals_on_convergence
+        out
+        Create_hklm_d_Th2_Ip_file (one per phase)
+
+    The linenumbers are found once from the original template.
+    Since TOPAS writes the .out with the same lines as the .inp,
+    the output of a refinement can be used as the next template without re-indexing.
+    '''
+    # __init__: {{{
+    def __init__(self, lines:list = None, slots:dict = None):
+        '''
+        lines: the lines of the template
+        slots: linenumbers of the lines to patch (found from lines if not given)
+        '''
+        self.lines = list(lines or [])
+        if slots is None:
+            slots = self._index_slots(self.lines)
+        self.slots = slots
+    #}}}
+    # from_file: {{{
+    @classmethod
+    def from_file(cls, filename:str = None):
+        with open(filename, 'r') as f:
+            lines = f.readlines()
+        return cls(lines)
+    #}}}
+    # _index_slots: {{{
+    @staticmethod
+    def _index_slots(lines:list = None):
+        '''
+        Finds the linenumbers for each of the lines we patch.
+        If a keyword is present more than once, the last one is used
+        (this is the same behavior as the original loop in run_auto_rietveld)
+        '''
+        slots = {
+            'xdd': None,
+            'xy_out': None,
+            'txt_out': None,
+            'csv_out': None,
+            'hkli': [], # list of (linenumber, formula)
+        }
+        for i, line in enumerate(lines):
+            line = line.strip() # cleans line of unnecessary leading spaces
+            if line.startswith('Out_X_Yobs_Ycalc_Ydiff'):
+                slots['xy_out'] = i
+            if line.startswith('out_prm_vals_on_convergence'):
+                slots['txt_out'] = i
+            if line.startswith('out'):
+                # Don't need to look for anything but out by itself.
+                slots['csv_out'] = i
+            if line.startswith('xdd'):
+                slots['xdd'] = i
+            if line.startswith('Create_hklm_d_Th2_Ip_file'):
+                slots['hkli'].append((i, TopasTemplate._get_hkli_formula(line)))
+        return slots
+    #}}}
+    # _get_hkli_formula: {{{
+    @staticmethod
+    def _get_hkli_formula(line:str = None):
+        '''
+        Gets the phase ID from the filename written in a
+        Create_hklm_d_Th2_Ip_file line (everything before "result")
+        '''
+        fn_str = line.split('(') [-1] # This takes whatever is written in the text field
+        found = re.findall(r'(\w+\d?)*',fn_str)[0] # This will give all of the text you put for the filename.
+        formula = []
+        for word in found.split('_'):
+            if word != 'result':
+                formula.append(word)
+            else:
+                break
+        return '_'.join(formula)
+    #}}}
+    # with_lines: {{{
+    def with_lines(self, lines:list = None):
+        '''
+        returns a new template with the same slots but different lines
+        (e.g. the lines of the last .out file)
+        '''
+        return TopasTemplate(lines, slots = self.slots)
+    #}}}
+    # render: {{{
+    def render(self, pattern:str = None, output:str = None):
+        '''
+        Patches the lines in memory for a pattern.
+
+        pattern: the path to the data file
+        output: the name to give all of the outputs (no extension)
+        '''
+        slots = self.slots
+        # The checks are truthy on purpose. A slot at line 0 is skipped, like the original loop.
+        if slots['xdd']:
+            self.lines[slots['xdd']] = f'xdd "{pattern}"\n' # write the current pattern
+        if slots['xy_out']:
+            self.lines[slots['xy_out']] = f'Out_X_Yobs_Ycalc_Ydiff("{output}.xy")\n'
+        if slots['txt_out']:
+            self.lines[slots['txt_out']] = f'out_prm_vals_on_convergence "{output}.txt"\n' # I am making this a text file since I manually output csv files. This would overwrite those.
+        if slots['csv_out']:
+            self.lines[slots['csv_out']] = f'out "{output}.csv"\n'
+        for line_idx, formula in slots['hkli']:
+            self.lines[line_idx] = f'\tCreate_hklm_d_Th2_Ip_file({formula}_{output}.hkli)\n'
+        return self.lines
+    #}}}
+    # write: {{{
+    def write(self, filename:str = None):
+        '''
+        Writes the lines to a file in a single call
+        '''
+        with open(filename, 'w') as f:
+            f.write(''.join(self.lines))
+    #}}}
+#}}}
@@ -18,6 +18,8 @@ from tqdm import tqdm
 from scipy.signal import find_peaks
 
 from topas_tools.utils.topas_utils import Utils
+from topas_tools.utils.xy_loader import load_xy
+from topas_tools.utils.pattern_stack import PatternStack
 #}}}
 # BkgsubUtils: {{{
 class BkgsubUtils:
@@ -69,11 +71,16 @@ class BkgsubUtils:
         return bkgsub_data
     #}}}
     # _import_bkgsub_data: {{{
-    def _import_bkgsub_data(self,skiprows:int = 1,len_of_time:int = 6):
+    def _import_bkgsub_data(self,skiprows:int = 1,len_of_time:int = 6, pattern_stack = None):
         '''
         This function is built to get all of the data
         from the directories you define in Bkgsub
+
+        pattern_stack: A PatternStack (or the path to one) with the data files. 
+            Files in it are sliced from the stack rather than read.
         '''
+        if isinstance(pattern_stack, str):
+            pattern_stack = PatternStack(pattern_stack)
         data_dict = {}
         # Data Imports: {{{
         dirs = tqdm([self._glass_dir, self._air_dir, self._data_dir]) # Directories with data
@@ -98,7 +105,10 @@ class BkgsubUtils:
             elif type(fn) != str and type(fn) != type(None):
                 for j, (time,f) in enumerate(fn.items()):
                     try:
-                        data = np.loadtxt(f, skiprows= skiprows)
+                        if pattern_stack is not None and f in pattern_stack:
+                            data = pattern_stack.get_data(f)
+                        else:
+                            data = load_xy(f, skiprows= skiprows)
                     except: 
                         print(f'Warning: {f} has a formatting error')
                         new_f = []
@@ -108,7 +118,7 @@ class BkgsubUtils:
                                 cols = re.findall(r'\w+\.?\w*', line)
                                 if len(cols) >=2:
                                     new_f.append(line)
-                        data = np.loadtxt(new_f,skiprows=skiprows) 
+                        data = load_xy(new_f,skiprows=skiprows) 
                     tth = data[:,0]
                     yobs = data[:,1]
                     data_dict[entry][j] = {
@@ -123,7 +133,7 @@ class BkgsubUtils:
             # Get background data: {{{
             else:
                 if not skip_iter:
-                    data = np.loadtxt(fn, skiprows=skiprows)
+                    data = load_xy(fn, skiprows=skiprows)
                     tth = data[:,0]
                     yobs = data[:,1]
                     data_dict[entry].update({
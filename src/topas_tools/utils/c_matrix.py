@@ -0,0 +1,195 @@
+# Authorship: {{{
+'''
+Written by: Dario C. Lewczyk
+Date: 10/18/26
+'''
+#}}}
+# Imports: {{{
+import re
+from collections.abc import Mapping
+import numpy as np
+#}}}
+# CMatrix: {{{
+class CMatrix(Mapping):
+    '''
+    The normalized correlation matrix (C_matrix_normalized) of a TOPAS .out file
+    stored as a dense array.
+
+        values: int8 array (n x n) of the correlations (-100 to 100)
+        names: The names of the refined parameters (row order)
+        numbers: The numbers TOPAS gives each parameter (row order)
+        index: name -> row
+
+    The flags for a threshold are computed on the whole array at once (flag_mask).
+
+    For compatibility, this also behaves like the dictionary _parse_c_matrix used to return:
+        c_matrix[num] = {'name': name, 'correlations': {j: {'name', 'correlation', 'flag'}}}
+    Those entries are only built for the rows you actually look at.
+    '''
+    _row_re = re.compile(r'^\s*(\S+)\s+(\d+):(.*)$')
+    _merged_re = re.compile(r'(\d)-') # e.g. "100-100" when TOPAS runs out of column width
+    # __init__: {{{
+    def __init__(self,
+            names:list = None,
+            numbers = None,
+            values = None,
+            correlation_threshold:int = None,
+        ):
+        self.names = list(names or [])
+        self.numbers = np.asarray(numbers if numbers is not None else [], dtype = int)
+        n = len(self.names)
+        self.values = np.asarray(values, dtype = np.int8) if values is not None else np.zeros((n, n), dtype = np.int8)
+        self.correlation_threshold = correlation_threshold
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self._rows = {int(num): i for i, num in enumerate(self.numbers)}
+        self._entries = {} # Dictionary entries built so far
+    #}}}
+    # from_lines: {{{
+    @classmethod
+    def from_lines(cls, lines:list = None, correlation_threshold:int = None):
+        '''
+        lines: The lines of a .out file
+        Reads the last C_matrix_normalized block.
+        Returns an empty CMatrix if there is none.
+        '''
+        start = None
+        for i in range(len(lines)-1, -1, -1):
+            if 'C_matrix_normalized' in lines[i]:
+                start = i
+                break
+        if start is None:
+            return cls(correlation_threshold = correlation_threshold)
+        # Get the rows of the matrix: {{{
+        header = None
+        names = []
+        numbers = []
+        rows = []
+        for line in lines[start+1:]:
+            if not line.strip():
+                continue
+            if header is None:
+                header = line.split() # The variable numbers
+                continue
+            m = cls._row_re.match(line)
+            if not m:
+                break # The end of the matrix
+            names.append(m.group(1))
+            numbers.append(int(m.group(2)))
+            rows.append(m.group(3))
+        #}}}
+        # Convert all of the correlations at once: {{{
+        text = cls._merged_re.sub(r'\1 -', ' '.join(rows))
+        values = np.fromstring(text, dtype = np.int16, sep = ' ') if text.strip() else np.zeros(0, dtype = np.int16)
+        if values.size != len(rows)*len(header or []):
+            raise ValueError(f'The C matrix has {values.size} values for {len(rows)} rows of {len(header or [])} columns')
+        values = values.reshape(len(rows), len(header or [])).astype(np.int8)
+        #}}}
+        return cls(names, numbers, values, correlation_threshold)
+    #}}}
+    # from_out_file: {{{
+    @classmethod
+    def from_out_file(cls, out_file:str = None, correlation_threshold:int = None):
+        with open(out_file, 'r') as out:
+            lines = out.readlines()
+        return cls.from_lines(lines, correlation_threshold)
+    #}}}
+    # flag_mask: {{{
+    def flag_mask(self, flag_search:str = 'CHECK', correlation_threshold:int = None):
+        '''
+        returns a boolean array that is True wherever the flag is flag_search
+            'CHECK': |correlation| > correlation_threshold
+            'OK': |correlation| <= correlation_threshold
+            'N/A': No threshold was given
+        '''
+        if correlation_threshold is None:
+            correlation_threshold = self.correlation_threshold
+        if not correlation_threshold:
+            return np.full(self.values.shape, flag_search == 'N/A')
+        check = np.abs(self.values.astype(np.int16)) > correlation_threshold
+        if flag_search == 'CHECK':
+            return check
+        elif flag_search == 'OK':
+            return ~check
+        return np.zeros(self.values.shape, dtype = bool)
+    #}}}
+    # correlation: {{{
+    def correlation(self, var1 = None, var2 = None):
+        '''
+        var1, var2: parameter names or TOPAS numbers
+        returns the correlation between them
+        '''
+        i = self.index[var1] if isinstance(var1, str) else self._rows[int(var1)]
+        j = self.index[var2] if isinstance(var2, str) else self._rows[int(var2)]
+        return int(self.values[i, j])
+    #}}}
+    # get_correlations: {{{
+    def get_correlations(self, flag_search:str = 'CHECK', debug:bool = False):
+        '''
+        returns: {num: {name: {j: {name2: correlation}}}}
+        for every pair of different parameters flagged as flag_search.
+        Parameters without any are left out.
+        '''
+        mask = self.flag_mask(flag_search)
+        if not mask.any():
+            return {}
+        names = np.asarray(self.names)
+        mask &= names[:, None] != names[None, :] # A parameter is always correlated with itself
+        corr_dict = {}
+        for i in np.flatnonzero(mask.any(axis = 1)):
+            name1 = self.names[i]
+            js = np.flatnonzero(mask[i])
+            corr_dict[int(self.numbers[i])] = {name1: {int(j)+1: {self.names[j]: float(self.values[i, j])} for j in js}}
+            if debug:
+                print(f'{self.numbers[i]}: {name1}')
+                for j in js:
+                    print(f'\t{j+1} ({self.names[j]}): {float(self.values[i, j])}')
+        return corr_dict
+    #}}}
+    # _get_entry: {{{
+    def _get_entry(self, row:int = None):
+        '''
+        Builds the dictionary entry of a row the way _parse_c_matrix used to
+        '''
+        if self.correlation_threshold:
+            check = self.flag_mask('CHECK')[row]
+            flags = np.where(check, 'CHECK', 'OK')
+        else:
+            flags = ['N/A']*len(self.names)
+        correlations = {}
+        for j, v in enumerate(self.values[row].tolist()):
+            correlations[j+1] = {
+                    'name': self.names[j],
+                    'correlation': float(v),
+                    'flag': str(flags[j]),
+            }
+        return {'name': self.names[row], 'correlations': correlations}
+    #}}}
+    # Mapping: {{{
+    def __getitem__(self, key):
+        key = int(key)
+        if key not in self._entries:
+            self._entries[key] = self._get_entry(self._rows[key])
+        return self._entries[key]
+    def __iter__(self):
+        return iter(self._rows)
+    def __len__(self):
+        return len(self._rows)
+    #}}}
+    # to_dict: {{{
+    def to_dict(self):
+        '''
+        returns the whole matrix in the dictionary format
+        '''
+        return {key: self[key] for key in self}
+    #}}}
+    # __getstate__: {{{
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_entries'] = {} # These are rebuilt if needed
+        return state
+    #}}}
+    # __repr__: {{{
+    def __repr__(self):
+        return f'CMatrix({len(self.names)} parameters, correlation_threshold={self.correlation_threshold})'
+    #}}}
+#}}}
@@ -43,6 +43,7 @@ class FileModifier():
             current_time:float = None,
             debug:bool =False,
             time_error:float = 1.1,
+            lines:list = None,
         ):
         '''
         This function handles the actual runtime modifications of output files 
@@ -66,7 +67,14 @@ class FileModifier():
         off_method: can be either "time" or "sf"
 
         time_error is the amount of +/- that the time can be off to trigger the phase on or off
+
+        lines: If given, these are the lines of the output file. They are modified 
+                in memory and the file is not read or written. 
+
+        returns True if a phase was turned on or off
         '''
+        if lines is not None:
+            original_lines = list(lines) # To check if anything changed
         # get the relevant lines: {{{
         relevant_lines = self._get_relevant_lines_for_monitoring(
                 out, 
@@ -76,7 +84,8 @@ class FileModifier():
                 threshold_for_on,
                 on_method,
                 off_method,
-                debug
+                debug,
+                lines = lines,
                 )
         #}}} 
         # check to see if the index is zero or not: {{{
@@ -136,7 +145,7 @@ class FileModifier():
                         if rwp_pct_diff >= threshold and not stopped:
                             entry['stopped'] = True # We are adding the phase so we can stop monitoring
                             # IF this is the case, we have yet to enable the phase. 
-                            self._modify_sf_line(out=out,line_idx=line_idx,str_num=str_num,replacement_value=on_sf_value,debug=debug) 
+                            self._modify_sf_line(out=out,line_idx=line_idx,str_num=str_num,replacement_value=on_sf_value,debug=debug, lines=lines) 
                             print(f'ENABLED {name}')
                         elif rwp_pct_diff < threshold:
                             # No need to add the phase
@@ -152,7 +161,7 @@ class FileModifier():
                         if np.abs(current_time - threshold) <= time_error and not stopped: 
                             # This ensures that whether you are running forward or reverse direction, you can trigger at an appropriate time. 
                             entry['stopped'] = True # We are adding the phase and can stop monitoring. 
-                            self._modify_sf_line(out=out,line_idx=line_idx,str_num=str_num,replacement_value=on_sf_value,debug=debug) 
+                            self._modify_sf_line(out=out,line_idx=line_idx,str_num=str_num,replacement_value=on_sf_value,debug=debug, lines=lines) 
                             print(f'ENABLED {name}')
                         elif current_time - threshold >= 0 and not stopped:
                             # If there is a gap in data collection, you may need this. 
@@ -161,7 +170,7 @@ class FileModifier():
                                     line_idx=line_idx,
                                     str_num=str_num,
                                     replacement_value=on_sf_value,
-                                    debug=debug)  
+                                    debug=debug, lines=lines)  
                             print(f'ENABLED {name}')
 
                     except:
@@ -180,7 +189,7 @@ class FileModifier():
                     elif norm_val <= threshold and not stopped:
                         entry['stopped'] = True # We are removing the phase, so stop monitoring it. 
                         # Now, DISABLE the phase: {{{
-                        self._modify_sf_line(out=out,line_idx=line_idx,str_num=str_num,replacement_value=off_sf_value,debug=debug)
+                        self._modify_sf_line(out=out,line_idx=line_idx,str_num=str_num,replacement_value=off_sf_value,debug=debug, lines=lines)
                         print(f'DISABLED {name}')
                         #}}} 
                 #}}}
@@ -192,7 +201,7 @@ class FileModifier():
                         if np.abs(current_time - threshold) <= time_error and not stopped: 
                             # This ensures that whether you are running forward or reverse direction, you can trigger at an appropriate time. 
                             entry['stopped'] = True # We are adding the phase and can stop monitoring. 
-                            self._modify_sf_line(out=out,line_idx=line_idx,str_num=str_num,replacement_value=off_sf_value,debug=debug) 
+                            self._modify_sf_line(out=out,line_idx=line_idx,str_num=str_num,replacement_value=off_sf_value,debug=debug, lines=lines) 
                             print(f'DISABLED {name}')
                     except:
                         pass
@@ -202,6 +211,9 @@ class FileModifier():
 
             #}}} 
         #}}} 
+        if lines is not None:
+            return lines != original_lines
+        return None
     #}}}
     # _parse_scale_factor_line: {{{
     def _parse_scale_factor_line(self,line:str = None, debug:bool = False):
@@ -222,14 +234,18 @@ class FileModifier():
 
     #}}}
     # _modify_sf_line: {{{
-    def _modify_sf_line(self, out:str = None, line_idx:int = None, str_num:str = None, replacement_value:float = None, debug:bool = False,):
+    def _modify_sf_line(self, out:str = None, line_idx:int = None, str_num:str = None, replacement_value:float = None, debug:bool = False, lines:list = None):
         '''
         The purpose of this function is to make modifications to the scale factor line
         of an output file to either turn on or off a phase. 
+
+        If lines are given, they are modified in place and the file is untouched.
         '''
-        with open(out,'r') as f:
-            lines = f.readlines() 
-            f.close()
+        in_memory = lines is not None
+        if not in_memory:
+            with open(out,'r') as f:
+                lines = f.readlines() 
+                f.close()
                         
         relevant_line = lines[line_idx] # Recall the line we stored 
                         
@@ -241,6 +257,8 @@ class FileModifier():
         #line.replace(name,f'!{name}') # This locks the phase to 0
         if debug:
             print(f'relevant_line: {line_idx}, line to be written: {relevant_line}, TEST: {lines[line_idx]}')
+        if in_memory:
+            return
         with open(out,'w') as f:
             f.writelines(lines) # Just rewrite the lines to the file 
             f.close()
@@ -256,7 +274,8 @@ class FileModifier():
             threshold_for_on:float = None, 
             on_method = 'rwp',
             off_method = 'sf',
-            debug:bool = False
+            debug:bool = False,
+            lines:list = None,
             ):
         '''
         Since we are adding more kinds of monitoring than simply scale factor to remove a phase, 
@@ -264,108 +283,110 @@ class FileModifier():
 
         turning off phases can be accomplished by looking at times or scale factors
         turning on phases can be accomplished by looking at times or rwp
+
+        lines: If given, these are used instead of reading the output file
         '''
         relevant_lines = {}
         rwp = None # This will store the Rwp for those phases we want to turn on. 
         # Open the Output File: {{{
-        with open(out,'r') as f:
-            lines = f.readlines()
-            # Go through each of the lines: {{{
-            for i, line in enumerate(lines):
-                scale_kwd = re.findall(r'^\s*scale',line) # Search the output for the line pertaining to scale factor
-                rwp_kwd = re.findall('r_wp\s+\d+\.\d+',line) # Search the ouput for the line pertaining to the Rwp
-                if rwp_kwd:
-                    rwp = float(rwp_kwd[0].split(' ')[-1]) # This should give me the rwp value
-                if scale_kwd:
-                    line_prms = re.findall(r'\S+',line) # This will split the line into only words and values.
-                    prm_name = line_prms[1] # The second word should always be a parameter name for the scale factor.
-                    str_value = line_prms[2] # The third item is the value (may include an error oo.)
-                    # Handle cases where you want to turn a phase off: {{{
-                    if off_phases != None:
-                        for j, off in enumerate(off_phases):
-                            # assign its threshold: {{{
-                            if type(threshold_for_off) == list:
-                                threshold = threshold_for_off[j] # If the user gave a list of thresholds for each phase...
-                            else:
-                                threshold = threshold_for_off
-                            #}}}
-                            # assign the off methods: {{{
-                            if debug:
-                                print(f'off method: {off_method}, type: {type(off_method)}')
-                            if type(off_method) == list: 
-                                method= off_method[j] # IF the user gave a list of off methods
-                            else:
-                                method= off_method
-                            #}}}
-                            #define the index for the dict: {{{ 
-                            if j == 0 and len(relevant_lines) == 0:
-                                # This is the first entry
-                                k = j
-                            else:
-                                k = len(relevant_lines)
-                            #}}}
-                            if debug: 
-                                print(off.lower()) 
-                                print(prm_name.lower())
-                            if  off.lower() in prm_name.lower():
-                                if debug:
-                                    print('%s Inside'%off.lower()) 
-                                    print('%s Inside'%prm_name.lower())
-                                value = self._parse_scale_factor_line(line,debug=debug)
-                                relevant_lines[k] = {
-                                        'linenumber': i,
-                                        'line': line,
-                                        'value': value, 
-                                        'name': prm_name, 
-                                        'string_number':str_value,
-                                        'type': 'off',
-                                        'threshold': threshold,
-                                        'method':method,
-                                }# Record the line 
-                             
-                                if j == len(off_phases):
-                                    break # If you reach the end, no point in reading more lines.
-                    #}}}
-                    # Handle the cases where you want to turn on a phase: {{{
-                    if on_phases != None:
-                        for j, on in enumerate(on_phases):
-                            # Assign its threshold: {{{
-                            if type(threshold_for_on) == list:
-                                threshold = threshold_for_on[j]  # IF the user gave a list of thresholds
-                            else:
-                                threshold = threshold_for_on
-                            #}}}
-                            # Assign its method: {{{
+        if lines is None:
+            with open(out,'r') as f:
+                lines = f.readlines()
+        # Go through each of the lines: {{{
+        for i, line in enumerate(lines):
+            scale_kwd = re.findall(r'^\s*scale',line) # Search the output for the line pertaining to scale factor
+            rwp_kwd = re.findall('r_wp\s+\d+\.\d+',line) # Search the ouput for the line pertaining to the Rwp
+            if rwp_kwd:
+                rwp = float(rwp_kwd[0].split(' ')[-1]) # This should give me the rwp value
+            if scale_kwd:
+                line_prms = re.findall(r'\S+',line) # This will split the line into only words and values.
+                prm_name = line_prms[1] # The second word should always be a parameter name for the scale factor.
+                str_value = line_prms[2] # The third item is the value (may include an error oo.)
+                # Handle cases where you want to turn a phase off: {{{
+                if off_phases != None:
+                    for j, off in enumerate(off_phases):
+                        # assign its threshold: {{{
+                        if type(threshold_for_off) == list:
+                            threshold = threshold_for_off[j] # If the user gave a list of thresholds for each phase...
+                        else:
+                            threshold = threshold_for_off
+                        #}}}
+                        # assign the off methods: {{{
+                        if debug:
+                            print(f'off method: {off_method}, type: {type(off_method)}')
+                        if type(off_method) == list: 
+                            method= off_method[j] # IF the user gave a list of off methods
+                        else:
+                            method= off_method
+                        #}}}
+                        #define the index for the dict: {{{ 
+                        if j == 0 and len(relevant_lines) == 0:
+                            # This is the first entry
+                            k = j
+                        else:
+                            k = len(relevant_lines)
+                        #}}}
+                        if debug: 
+                            print(off.lower()) 
+                            print(prm_name.lower())
+                        if  off.lower() in prm_name.lower():
                             if debug:
-                                print(f'on method: {on_method}, type: {type(on_method)}')
-                            if type(on_method) == list: 
-                                method = on_method[j]
-                            else:
-                                method = on_method
-                            #}}}
-                            if j == 0 and len(relevant_lines) == 0:
-                                k = j
-                            else:
-                                k = len(relevant_lines)
-                            if on.lower() in prm_name.lower():
-                                value = self._parse_scale_factor_line(line,debug)
-                                relevant_lines[k] = {
-                                    'linenumber': i, 
-                                    'line': line, 
+                                print('%s Inside'%off.lower()) 
+                                print('%s Inside'%prm_name.lower())
+                            value = self._parse_scale_factor_line(line,debug=debug)
+                            relevant_lines[k] = {
+                                    'linenumber': i,
+                                    'line': line,
                                     'value': value, 
-                                    'name':prm_name, 
-                                    'string_number': str_value,
-                                    'type': 'on',
+                                    'name': prm_name, 
+                                    'string_number':str_value,
+                                    'type': 'off',
+                                    'threshold': threshold,
                                     'method':method,
-                                    'threshold':threshold,
-                                    'rwp':rwp,
-                                } # record the line 
-                                if j == len(on_phases)-1:
-                                    break # IF you reach the end, stop reading
-    
-                    #}}}
-            #}}}
-            f.close()
+                            }# Record the line 
+                         
+                            if j == len(off_phases):
+                                break # If you reach the end, no point in reading more lines.
+                #}}}
+                # Handle the cases where you want to turn on a phase: {{{
+                if on_phases != None:
+                    for j, on in enumerate(on_phases):
+                        # Assign its threshold: {{{
+                        if type(threshold_for_on) == list:
+                            threshold = threshold_for_on[j]  # IF the user gave a list of thresholds
+                        else:
+                            threshold = threshold_for_on
+                        #}}}
+                        # Assign its method: {{{
+                        if debug:
+                            print(f'on method: {on_method}, type: {type(on_method)}')
+                        if type(on_method) == list: 
+                            method = on_method[j]
+                        else:
+                            method = on_method
+                        #}}}
+                        if j == 0 and len(relevant_lines) == 0:
+                            k = j
+                        else:
+                            k = len(relevant_lines)
+                        if on.lower() in prm_name.lower():
+                            value = self._parse_scale_factor_line(line,debug)
+                            relevant_lines[k] = {
+                                'linenumber': i, 
+                                'line': line, 
+                                'value': value, 
+                                'name':prm_name, 
+                                'string_number': str_value,
+                                'type': 'on',
+                                'method':method,
+                                'threshold':threshold,
+                                'rwp':rwp,
+                            } # record the line 
+                            if j == len(on_phases)-1:
+                                break # IF you reach the end, stop reading
+
+                #}}}
+        #}}}
         #}}}
         return relevant_lines
     #}}} 
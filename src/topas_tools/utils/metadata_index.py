@@ -0,0 +1,168 @@
+# Authorship: {{{
+'''
+Written by: Dario C. Lewczyk
+Date: 10/18/26
+'''
+#}}}
+# Imports: {{{
+import os
+import json
+import sqlite3
+import logging
+#}}}
+# MetadataIndex: {{{
+class MetadataIndex:
+    '''
+    A small SQLite file (kept in the metadata folder) with the parsed entry of every metadata file.
+
+    Each row is stored with the size and modification time of its file
+    and the options (keys) it was parsed with.
+    A file is only parsed again if it changed, or if it was parsed with other options.
+    So during a beamtime, each run only parses the files written since the last one.
+
+    e.g.
+        index = MetadataIndex('meta', options = {'temp_key': 'element_temp'})
+        for fn in files:
+            entry = index.get(fn, parse_func) # parse_func(fn, **options) if fn is new
+        index.save()
+
+    If the folder is read only, nothing is stored and every file is parsed (as before).
+    '''
+    logger = logging.getLogger(__name__)
+    version = 1 # Bump this if the parser changes the format of its entries
+    filename = '.topas_metadata.sqlite'
+    # __init__: {{{
+    def __init__(self, meta_dir:str = '.', options:dict = None, enabled:bool = True):
+        '''
+        meta_dir: The metadata folder (the index is stored here)
+        options: The keyword arguments of the parser (part of the key)
+        enabled: If False, every call just runs the parser
+        '''
+        self.meta_dir = os.path.abspath(meta_dir)
+        self.path = os.path.join(self.meta_dir, self.filename)
+        self.options = dict(options or {})
+        self.enabled = enabled
+        self._options_key = json.dumps([self.version, sorted(self.options.items())])
+        self._rows = None # name: (size, mtime_ns, entry json)
+        self._new = [] # Rows to store
+        self.hits = 0
+        self.misses = 0
+    #}}}
+    # _connect: {{{
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout = 30)
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            'name TEXT, options TEXT, size INTEGER, mtime_ns INTEGER, entry TEXT, '
+            'PRIMARY KEY (name, options))'
+        )
+        return conn
+    #}}}
+    # _load: {{{
+    def _load(self):
+        '''
+        Reads every stored row for these options at once
+        '''
+        self._rows = {}
+        if not os.path.exists(self.path):
+            return
+        try:
+            with self._connect() as conn:
+                cursor = conn.execute('SELECT name, size, mtime_ns, entry FROM entries WHERE options = ?', (self._options_key,))
+                self._rows = {name: (size, mtime_ns, entry) for name, size, mtime_ns, entry in cursor}
+            conn.close()
+        except sqlite3.Error as e:
+            self.logger.debug(f'Ignoring unreadable metadata index {self.path}: {e}')
+    #}}}
+    # _get_name: {{{
+    def _get_name(self, filename:str = None):
+        '''
+        Files are stored relative to the metadata folder so it can be moved
+        '''
+        return os.path.relpath(os.path.abspath(filename), self.meta_dir)
+    #}}}
+    # get: {{{
+    def get(self, filename:str = None, parse_func = None):
+        '''
+        filename: A metadata file
+        parse_func: Called as parse_func(filename, **options) if the file is new or changed.
+            It has to return a dictionary that can be stored as JSON.
+
+        returns the parsed entry
+        '''
+        if not self.enabled:
+            return parse_func(filename, **self.options)
+        if self._rows is None:
+            self._load()
+        name = self._get_name(filename)
+        stat = os.stat(filename)
+        row = self._rows.get(name)
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            self.hits += 1
+            return json.loads(row[2])
+        self.misses += 1
+        entry = parse_func(filename, **self.options)
+        row = (stat.st_size, stat.st_mtime_ns, json.dumps(entry))
+        self._rows[name] = row
+        self._new.append((name, self._options_key) + row)
+        return entry
+    #}}}
+    # get_many: {{{
+    def get_many(self, filenames:list = None, parse_func = None):
+        '''
+        Same as get for a list of files, but the new files are parsed together
+        by parse_func(new_filenames, **options) (e.g. on a process pool), which returns their entries in order.
+
+        returns the entries (in the order of filenames)
+        '''
+        if not self.enabled:
+            return parse_func(list(filenames), **self.options)
+        if self._rows is None:
+            self._load()
+        entries = [None]*len(filenames)
+        new = [] # (position, name, stat)
+        for i, filename in enumerate(filenames):
+            name = self._get_name(filename)
+            stat = os.stat(filename)
+            row = self._rows.get(name)
+            if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+                entries[i] = json.loads(row[2])
+            else:
+                new.append((i, name, stat))
+        self.hits += len(filenames) - len(new)
+        self.misses += len(new)
+        if new:
+            parsed = parse_func([filenames[i] for i, _, _ in new], **self.options)
+            for (i, name, stat), entry in zip(new, parsed):
+                entries[i] = entry
+                row = (stat.st_size, stat.st_mtime_ns, json.dumps(entry))
+                self._rows[name] = row
+                self._new.append((name, self._options_key) + row)
+        return entries
+    #}}}
+    # save: {{{
+    def save(self):
+        '''
+        Stores the entries parsed since the last save (in one transaction)
+        '''
+        if not self._new:
+            return
+        try:
+            with self._connect() as conn:
+                conn.executemany('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)', self._new)
+            conn.close()
+        except sqlite3.Error as e:
+            self.logger.debug(f'Could not store the metadata index {self.path}: {e}')
+        self._new = []
+    #}}}
+    # clear: {{{
+    def clear(self):
+        '''
+        Deletes the index
+        '''
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._rows = None
+        self._new = []
+    #}}}
+#}}}
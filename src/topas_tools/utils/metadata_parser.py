@@ -3,10 +3,128 @@
 # Date: 02-20-2024
 #}}}
 # Imports: {{{
+import os
 import re
 import numpy as np
 from tqdm import tqdm
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 from topas_tools.utils.topas_utils import DataCollector
+from topas_tools.utils.metadata_index import MetadataIndex
+#}}}
+# Metadata patterns: {{{
+_FLOAT_RE = re.compile(r'\d+\.\d+') # e.g. epoch time, voltage, detector position
+_NUMBER_RE = re.compile(r'\d+\.\d?') # e.g. temperature, setpoint, exposure
+#}}}
+# _get_number: {{{
+def _get_number(line:str = None):
+    '''
+    The exposure related values: the first number, or the last word, or 0
+    '''
+    m = _NUMBER_RE.search(line)
+    if m:
+        return float(m.group())
+    try:
+        return float(line.split(' ')[-1])
+    except:
+        return 0
+#}}}
+# _parse_metadata_file: {{{
+def _parse_metadata_file(
+    filename:str = None,
+    time_key:str = 'time:',
+    temp_key:str = 'element_temp',
+    setpoint_key:str = 'setpoint',
+    det_z_key:str = 'Det_1_Z',
+    voltage_key:str = 'Voltage_percent',
+    exposure_key:str = 'sp_computed_exposure',
+    frame_num_key:str = 'sp_num_frames',
+    time_per_frame_key:str = 'sp_time_per_frame',
+    early_stop:bool = True,
+    ):
+    '''
+    Parses one metadata file and returns its values
+    (everything but the readable time, pattern index, and filename which depend on the run)
+
+    This is a function (not a method) so it can run in a process pool.
+    early_stop: Stop reading once every key has been found. 
+        If a key is in a file more than once, use False to get the last value (as the full scan does).
+    '''
+    time = None
+    temp = None
+    voltage = None
+    setpoint = None
+    detector_pos = None
+    exposure_time = None
+    num_frames = None
+    subframe_exposure = None
+    found = set() # The keys found so far
+    det_z_line = f'{det_z_key}:'
+    det_z_countdown = None # Lines left until the detector position
+    # Work to parse the data: {{{
+    with open(filename,'r') as f:
+        for line in f: 
+            line = line.strip() # This gets a clean line
+            # Detector Position (value line): {{{
+            if det_z_countdown is not None:
+                det_z_countdown -= 1
+                if det_z_countdown == 0:
+                    det_z_countdown = None
+                    m = _FLOAT_RE.search(line) # This should be: value: ##.##.
+                    if m:
+                        detector_pos = float(m.group())
+                        found.add('det_z')
+            #}}}
+            # Time Determination: {{{
+            if time_key in line:
+                m = _FLOAT_RE.search(line) # This gives me the epoch time if it is on a line.
+                if m:
+                    time = float(m.group()) # Gives us the epoch time in float form.   
+                    found.add('time')
+            #}}}
+            # Temp Determination: {{{
+            if temp_key in line:
+                temp = np.around(float(_NUMBER_RE.search(line).group()) - 273.15, 2) # This gives us the Celsius temperature of the element thermocouple.  
+                found.add('temp')
+            #}}}
+            # Voltage (deprecated for MTF Because we use PID): {{{
+            if voltage_key in line:
+                voltage = float(_FLOAT_RE.search(line).group())
+                found.add('voltage')
+            #}}}
+            # Setpoint: {{{
+            if line.startswith(setpoint_key):
+                setpoint = float(_NUMBER_RE.search(line).group())
+                found.add('setpoint')
+            #}}}
+            # Detector Position (key line): {{{
+            if line == det_z_line: 
+                det_z_countdown = 2 # The value is 2 lines down
+            #}}}
+            # Exposure Related Parameters: {{{
+            if exposure_key in line:
+                exposure_time = _get_number(line)
+                found.add('exposure')
+            if frame_num_key in line:
+                num_frames = _get_number(line)
+                found.add('frames')
+            if time_per_frame_key in line:
+                subframe_exposure = _get_number(line)
+                found.add('subframe')
+            #}}}
+            if early_stop and len(found) == 8 and det_z_countdown is None:
+                break # Everything has been found
+    #}}}
+    return {
+        'epoch_time': time,
+        'temperature': temp,
+        'setpoint': setpoint,
+        'pct_voltage': voltage,
+        'detector_z_pos': detector_pos,
+        'exposure_time': exposure_time,
+        'num_subframes': num_frames,
+        'subframe_exposure':subframe_exposure,
+    }
 #}}}
 # MetadataParser: {{{
 class MetadataParser:
@@ -28,7 +146,20 @@ class MetadataParser:
         voltage_key:str = 'Voltage_percent',
         metadata_data:dict = None,
         mode = 0,
+        use_index:bool = True,
+        workers:int = 1,
+        chunksize:int = 64,
+        early_stop:bool = True,
         ):
+        '''
+        use_index: Keep the parsed files in an index in the metadata folder so each run only parses new files (see get_metadata)
+        workers, chunksize: Parse the files in a process pool (see get_metadata)
+        early_stop: Stop reading each file once every key has been found
+
+        The results are in:
+            metadata_data: {readable time: {epoch_time, temperature, ...}} sorted by epoch time
+            metadata_columns: {field: array} with the same values in the same order (None is NaN)
+        '''
         if metadata_data == None:
             self.metadata_data = {}
         else:
@@ -37,7 +168,7 @@ class MetadataParser:
         md.scrape_files() # This gives us the yaml files in order in data_dict
         self.metadata = md.file_dict # This is the dictionary with all of the files.
         try:
-            self.get_metadata(time_key=time_key, temp_key=temp_key, setpoint_key=setpoint_key, det_z_key=det_z_key, voltage_key=voltage_key) 
+            self.get_metadata(time_key=time_key, temp_key=temp_key, setpoint_key=setpoint_key, det_z_key=det_z_key, voltage_key=voltage_key, use_index=use_index, workers=workers, chunksize=chunksize, early_stop=early_stop) 
         except:
             print('Failed to get metadata')
         try:
@@ -48,6 +179,7 @@ class MetadataParser:
             self._calculate_time_from_start_of_run() # Get the corrected times.
         except:
             print('Failed to calculate corrected times')
+        self.metadata_columns = self.get_metadata_columns()
         
         #os.chdir(self._data_dir) # Returns us to the original directory.
     #}}}
@@ -62,97 +194,58 @@ class MetadataParser:
         exposure_key:str = 'sp_computed_exposure',
         frame_num_key:str = 'sp_num_frames',
         time_per_frame_key:str = 'sp_time_per_frame',
+        use_index:bool = True,
+        workers:int = 1,
+        chunksize:int = 64,
+        early_stop:bool = True,
         ): 
-        metadata = tqdm(self.metadata,desc="Working on Metadata")
-        for i, key in enumerate(metadata):
-            #metadata.set_description_str(f'Working on Metadata {key}:')
-            filename = self.metadata[key] # Gives us the filename to read.
-            time = None
-            temp = None
-            voltage = None
-            setpoint = None
-            detector_pos = None
-            exposure_time = None
-            num_frames = None
-            subframe_exposure = None
-            # Work to parse the data: {{{
-            with open(filename,'r') as f:
-                lines = f.readlines()
-                for j,line in enumerate(lines): 
-                    line = line.strip() # This gets a clean line
-                    splitline  = line.split(' ')
-                    # Time Determination: {{{
-                    if time_key in line:
-                        t = re.findall(r'\d+\.\d+',line) # This gives me the epoch time if it is on a        line.
-                        if t:
-                            time = float(t[0]) # Gives us the epoch time in float form.   
-                    #}}}
-                    # Temp Determination: {{{
-                    if temp_key in line:
-                        temp = np.around(float(re.findall(r'\d+\.\d?',line)[0]) - 273.15, 2) #           This gives us the Celsius temperature of the element thermocouple.  
-                    #}}}
-                    # Voltage (deprecated for MTF Because we use PID): {{{
-                    if voltage_key in line:
-                        voltage = float(re.findall(r'\d+\.\d+',line)[0])
-                    #}}}
-                    # Setpoint: {{{
-                    if line.startswith(setpoint_key):
-                        setpoint = float(re.findall(r'\d+\.\d?', line)[0])
-                    #}}}
-                    # Detector Position: {{{
-                    if line == f'{det_z_key}:': 
-                        try:
-                            value_line = lines[j+2].strip() # This should be: value: ##.##.
-                            detector_pos = float(re.findall(r'\d+\.\d+',value_line)[0])
-                        except:
-                            pass
-                    #}}}
-                    # Exposure Related Parameters: {{{
-                    if exposure_key in line:
-                        try:
-                            exposure_time = float(re.findall(r'\d+\.\d?', line)[0])
-                        except:
-                            try:
-                                exposure_time = float(splitline[-1])
-                            except:
-                                exposure_time = 0
-                    if frame_num_key in line:
-                        try:
-                            num_frames = float(re.findall(r'\d+\.\d?', line)[0])
-                        except:
-                            try:
-                                num_frames = float(splitline[-1])
-                            except:
-                                num_frames = 0
-
-                    if time_per_frame_key in line:
-                        try:
-                            subframe_exposure = float(re.findall(r'\d+\.\d?', line)[0])
-                        except:
-                            try:
-                                subframe_exposure = float(splitline[-1])
-                            except:
-                                subframe_exposure = 0
-                    #}}}
-                        
-                f.close() 
-            #}}}
+        '''
+        use_index: If True, the parsed files are stored in .topas_metadata.sqlite (in the metadata folder)
+            so only new or changed files are parsed. 
+        workers: Processes used to parse the files (only used if there are more than chunksize files to parse)
+        chunksize: Files sent to a process at a time
+        early_stop: Stop reading each file once every key has been found
+        '''
+        options = {
+            'time_key': time_key,
+            'temp_key': temp_key,
+            'setpoint_key': setpoint_key,
+            'det_z_key': det_z_key,
+            'voltage_key': voltage_key,
+            'exposure_key': exposure_key,
+            'frame_num_key': frame_num_key,
+            'time_per_frame_key': time_per_frame_key,
+            'early_stop': early_stop,
+        }
+        self.metadata_index = MetadataIndex(os.getcwd(), options = options, enabled = use_index) # scrape_files looks in the current directory
+        keys = list(self.metadata)
+        filenames = [self.metadata[key] for key in keys] # Gives us the filenames to read.
+        try:
+            entries = self.metadata_index.get_many(filenames, lambda fns, **kwargs: self._parse_metadata_files(fns, workers, chunksize, **kwargs)) # Only the new files are parsed
+        finally:
+            self.metadata_index.save() # Keep whatever was parsed
+        for i, (key, filename, entry) in enumerate(zip(keys, filenames, entries)):
             # Update Metadata Dictionary Entry: {{{
             self.metadata_data[key] = {
                 'readable_time': int(key),
-                'epoch_time': time,
-                'temperature': temp,
-                'setpoint': setpoint,
-                'pct_voltage': voltage,
-                'detector_z_pos': detector_pos,
-                'exposure_time': exposure_time,
-                'num_subframes': num_frames,
-                'subframe_exposure':subframe_exposure,
+                **entry,
                 'pattern_index': i,
                 'filename': filename,
             } 
             #}}}
     #}}}
+    # _parse_metadata_files: {{{
+    def _parse_metadata_files(self, filenames:list = None, workers:int = 1, chunksize:int = 64, **kwargs):
+        '''
+        returns the parsed entries of the files (in order)
+        kwargs: passed to _parse_metadata_file
+        '''
+        parse = partial(_parse_metadata_file, **kwargs)
+        if workers == 1 or len(filenames) <= chunksize:
+            return [parse(fn) for fn in tqdm(filenames, desc = "Working on Metadata")]
+        with ProcessPoolExecutor(max_workers = workers) as pool:
+            return list(tqdm(pool.map(parse, filenames, chunksize = chunksize), total = len(filenames), desc = "Working on Metadata"))
+    #}}}
     # _sort_metadata_by_epoch_time: {{{
     def _sort_metadata_by_epoch_time(self,):
         # sort the metadata dictionary by epoch time: {{{ 
@@ -161,6 +254,29 @@ class MetadataParser:
         self.metadata_data = {k: v for k,v in sorted_metadata}  
         #}}}
     #}}}
+    # get_metadata_columns: {{{
+    def get_metadata_columns(self, metadata_data:dict = None):
+        '''
+        returns metadata_data as one array per field (in the order of metadata_data)
+        e.g. columns['temperature'], columns['corrected_time']
+        Numbers are float arrays (None is NaN), except readable_time and pattern_index (int). 
+        '''
+        if metadata_data is None:
+            metadata_data = self.metadata_data
+        entries = list(metadata_data.values())
+        columns = {}
+        if not entries:
+            return columns
+        for field in entries[0]:
+            values = [entry.get(field) for entry in entries]
+            if field == 'filename':
+                columns[field] = np.array(values)
+            elif field in ('readable_time', 'pattern_index'):
+                columns[field] = np.array(values, dtype = int)
+            else:
+                columns[field] = np.array([np.nan if v is None else v for v in values], dtype = float)
+        return columns
+    #}}}
     # _calculate_time_from_start_of_run: {{{
     def _calculate_time_from_start_of_run(self,):
         ''' 
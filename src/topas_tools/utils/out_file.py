@@ -0,0 +1,167 @@
+# Authorship: {{{
+'''
+Written by: Dario C. Lewczyk
+Date: 10/18/26
+'''
+#}}}
+# Imports: {{{
+import io
+import os
+import re
+import mmap
+#}}}
+# OutFile: {{{
+class OutFile:
+    '''
+    A TOPAS .out file that is memory-mapped once and shared by the parsers.
+
+    The first time a section is asked for, an index of byte offsets is built:
+        c_matrix: where C_matrix_normalized starts (None if there is none)
+        phases: [(phase_type, offset), ...] for each str, hkl_Is, xo_Is
+        outputs: offsets of the output lines (e.g. Out_X_Yobs_Ycalc_Ydiff)
+    The index is built by scanning up to the C matrix only,
+    so the C matrix (usually the largest part of the file) is only read by the parser that needs it.
+
+    Sections (all are contiguous):
+        all: the whole file
+        body: everything before the C matrix (what get_inp_out_dict and _parse_out_phases use)
+        header: everything before the first phase (r_wp, xdd, bkg, ...)
+        phases: from the first phase to the C matrix
+        c_matrix: from C_matrix_normalized to the end
+
+    e.g.
+        with OutFile('result.out') as out:
+            out_dict = TOPAS_Parser().parse_topas_file(out, section = 'header')
+            c_matrix = ResultParser()._parse_c_matrix(out)
+    '''
+    _phase_re = re.compile(rb'^[ \t]*(str|hkl_Is|xo_Is)\b', re.M)
+    _output_re = re.compile(rb'^[ \t]*(Out_\w+|out)\b', re.M)
+    _c_matrix_re = re.compile(rb'^[ \t]*C_matrix_normalized\b', re.M) # At the start of a line (not in a comment)
+    sections = ['all', 'body', 'header', 'phases', 'c_matrix']
+    # __init__: {{{
+    def __init__(self, filename:str = None):
+        self.filename = filename
+        self._file = None
+        self._data = None
+        self._index = None
+    #}}}
+    # data: {{{
+    @property
+    def data(self):
+        '''
+        The memory-mapped contents of the file (opened the first time it is needed)
+        '''
+        if self._data is None:
+            self._file = open(self.filename, 'rb')
+            if os.fstat(self._file.fileno()).st_size == 0:
+                self._data = b'' # An empty file cannot be mapped
+            else:
+                self._data = mmap.mmap(self._file.fileno(), 0, access = mmap.ACCESS_READ)
+        return self._data
+    #}}}
+    # index: {{{
+    @property
+    def index(self):
+        if self._index is None:
+            data = self.data
+            c_matrix = self._c_matrix_re.search(data) # Stops at the matrix, so the tail is never read
+            if c_matrix is not None:
+                end = c_matrix.start() # The start of that line
+            else:
+                end = len(data)
+            self._index = {
+                'c_matrix': end if c_matrix is not None else None,
+                'body_end': end,
+                'phases': [(m.group(1).decode(), m.start()) for m in self._phase_re.finditer(data, 0, end)],
+                'outputs': [m.start() for m in self._output_re.finditer(data, 0, end)],
+            }
+        return self._index
+    #}}}
+    # get_bounds: {{{
+    def get_bounds(self, section:str = 'all'):
+        '''
+        returns the (start, end) byte offsets of a section
+        '''
+        if section == 'all':
+            return (0, len(self.data))
+        index = self.index
+        body_end = index['body_end']
+        first_phase = index['phases'][0][1] if index['phases'] else body_end
+        bounds = {
+            'body': (0, body_end),
+            'header': (0, first_phase),
+            'phases': (first_phase, body_end),
+            'c_matrix': (body_end, len(self.data)) if index['c_matrix'] is not None else (body_end, body_end),
+        }
+        if section not in bounds:
+            raise ValueError(f'section must be one of: {self.sections}, got: {section}')
+        return bounds[section]
+    #}}}
+    # _decode: {{{
+    def _decode(self, start:int = None, end:int = None):
+        return self.data[start:end].decode()
+    #}}}
+    # read: {{{
+    def read(self, section:str = 'all'):
+        '''
+        returns the text of a section
+        '''
+        return self._decode(*self.get_bounds(section))
+    #}}}
+    # lines: {{{
+    def lines(self, section:str = 'all'):
+        '''
+        returns the lines of a section as readlines() would
+        (line numbers start at 0 for the start of the section)
+        '''
+        return io.StringIO(self.read(section), newline = None).readlines()
+    #}}}
+    # iter_lines: {{{
+    def iter_lines(self, section:str = 'all'):
+        '''
+        Same as lines() but yields the lines one at a time
+        '''
+        return iter(io.StringIO(self.read(section), newline = None))
+    #}}}
+    # phase_lines: {{{
+    def phase_lines(self, phase_num:int = None):
+        '''
+        returns the lines of one phase (0 is the first str, hkl_Is, or xo_Is)
+        '''
+        phases = self.index['phases']
+        start = phases[phase_num][1]
+        end = phases[phase_num+1][1] if phase_num+1 < len(phases) else self.index['body_end']
+        return io.StringIO(self._decode(start, end), newline = None).readlines()
+    #}}}
+    # output_lines: {{{
+    def output_lines(self):
+        '''
+        returns the output lines (e.g. Out_X_Yobs_Ycalc_Ydiff(...))
+        '''
+        data = self.data
+        lines = []
+        for start in self.index['outputs']:
+            end = data.find(b'\n', start)
+            lines.append(self._decode(start, end if end >= 0 else len(data)).rstrip('\r'))
+        return lines
+    #}}}
+    # close: {{{
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        if self._file is not None:
+            self._file.close()
+        self._data = None
+        self._file = None
+    #}}}
+    # __enter__/__exit__: {{{
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        self.close()
+    #}}}
+    # __getstate__: {{{
+    def __getstate__(self):
+        return {'filename': self.filename, '_file': None, '_data': None, '_index': self._index}
+    #}}}
+#}}}
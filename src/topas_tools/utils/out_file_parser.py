@@ -4,6 +4,8 @@
 #}}}
 # Imports: {{{
 import re
+from contextlib import nullcontext
+from topas_tools.utils.out_file import OutFile
 #}}}
 # OUT_Parser: {{{
 class OUT_Parser:
@@ -86,7 +88,7 @@ class OUT_Parser:
         return final_result
     #}}}
     # _parse_out_phases: {{{
-    def _parse_out_phases(self,out_file:str = None, idx:int = None):
+    def _parse_out_phases(self,out_file:str = None, idx:int = None, lines = None):
         '''
         This function is able to read in output files in a general manner and update a dictionary 
         called "out_phase_dict" as an attribute. 
@@ -95,9 +97,13 @@ class OUT_Parser:
 
         The way that the dictionary produced is formatted is as follows: 
         
+        out_file can be a path or an OutFile. 
+        Nothing is recorded past C_matrix_normalized, so only the lines before it are read.
+        lines: Any iterable of lines to use instead of reading out_file 
+            (e.g. a stream shared with another parser, see OutStreamParser)
         '''
         out_phase_dict = {} # Initialize the current pattern output file dictionary
-        with open(out_file,'r') as out:
+        with (nullcontext(out_file) if lines is not None or isinstance(out_file, OutFile) else OutFile(out_file)) as out:
             lattice_macros = ['Cubic', 'Tetragonal', 'Hexagonal', 'Rhombohedral']
             lattice_macro_keys = [
                 ['a'], # Cubic
@@ -105,7 +111,8 @@ class OUT_Parser:
                 ['a', 'c'], # Hexagonal
                 ['a', 'ga'], # Rhombohedral
             ]
-            lines = out.readlines()
+            if lines is None:
+                lines = out.lines('body')
             phase = None
             comment_block = False # This tracks if the program sees a comment block to ignore all text between the two lines. 
             phase_num = 0 # This counts all of the str, hkl_Is, xo_Is
@@ -0,0 +1,46 @@
+# Authorship: {{{
+'''
+Written by: Dario C. Lewczyk
+Date: 10/18/26
+'''
+#}}}
+# Imports: {{{
+from contextlib import nullcontext
+from topas_tools.utils.out_file import OutFile
+from topas_tools.utils.topas_parser import TOPAS_Parser
+from topas_tools.utils.out_file_parser import OUT_Parser
+#}}}
+# OutStreamParser: {{{
+class OutStreamParser(TOPAS_Parser, OUT_Parser):
+    '''
+    Reads a TOPAS .out file once and fills both of the dictionaries 
+    the two .out parsers make:
+        out_dict: from TOPAS_Parser.get_inp_out_dict (prms, bkg, displacement, fit metrics, ...)
+        out_phase_dict: from OUT_Parser._parse_out_phases (phase names, LVol, e0, lattice params, sites, ...)
+
+    Each line is handed to both parsers as it is read, 
+    so the file is only split into lines (and looked at) once.
+    '''
+    # parse_out_file: {{{
+    def parse_out_file(self, out_file = None, section:str = 'body', **kwargs):
+        '''
+        out_file: A path or an OutFile
+        section: Part of the file to read (see OutFile). 
+            Neither parser records anything past the C matrix, so "body" is the default.
+        kwargs: Options for get_inp_out_dict (e.g. fileextension, record_bkg)
+
+        returns (out_dict, out_phase_dict)
+        '''
+        kwargs.pop('debug', None) # Only accepted for the signature of get_inp_out_dict
+        state = self._start_inp_out_dict(**kwargs)
+        with (nullcontext(out_file) if isinstance(out_file, OutFile) else OutFile(out_file)) as out:
+            # Stream the lines through both parsers: {{{
+            def stream():
+                for lineno, line in enumerate(out.iter_lines(section)):
+                    self._feed_inp_out_line(state, lineno, line)
+                    yield line
+            #}}}
+            out_phase_dict = self._parse_out_phases(lines = stream())
+        return self._finish_inp_out_dict(state), out_phase_dict
+    #}}}
+#}}}
@@ -0,0 +1,125 @@
+# Authorship: {{{
+'''
+Written by: Dario C. Lewczyk
+Date: 10/18/26
+'''
+#}}}
+# Imports: {{{
+import os
+import pickle
+import hashlib
+import logging
+#}}}
+# ParseCache: {{{
+class ParseCache:
+    '''
+    An on-disk cache for the results of parsing TOPAS files (.inp, .out).
+
+    Each result is stored as a pickle in cache_dir, one file per
+    (file, parser, parser options). The key recorded with each result is:
+        the absolute path of the file
+        its size and modification time
+        (or a hash of its contents if hash_contents is True)
+        the name of the parser and the options used
+
+    If the file changes, the key no longer matches, so the file is parsed again
+    and the stored result is replaced. Loading a stored result only takes an unpickle.
+
+    e.g.
+        cache = ParseCache('.topas_cache')
+        out_dict = cache.get(out_file, 'inp_out_dict', parse_func, fileextension = 'xy')
+    where parse_func(out_file, **kwargs) returns the result to store.
+    '''
+    logger = logging.getLogger(__name__)
+    version = 3 # Bump this if a parser changes the format of its output
+    # __init__: {{{
+    def __init__(self, cache_dir:str = '.topas_cache', hash_contents:bool = False, enabled:bool = True):
+        '''
+        cache_dir: where the results are stored
+        hash_contents: If True, files are identified by a hash of their contents
+            rather than their size and modification time (slower, but survives copying files)
+        enabled: If False, every call just runs the parser
+        '''
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.hash_contents = hash_contents
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+    #}}}
+    # _get_stamp: {{{
+    def _get_stamp(self, path:str = None):
+        '''
+        returns what identifies the current version of a file
+        '''
+        if self.hash_contents:
+            with open(path, 'rb') as f:
+                return hashlib.sha1(f.read()).hexdigest()
+        stat = os.stat(path)
+        return (stat.st_size, stat.st_mtime_ns)
+    #}}}
+    # _get_cache_file: {{{
+    def _get_cache_file(self, path:str = None, kind:str = None, options:tuple = None):
+        name = hashlib.sha1(repr((path, kind, options)).encode()).hexdigest()
+        return os.path.join(self.cache_dir, f'{kind}_{name}.pkl')
+    #}}}
+    # get: {{{
+    def get(self, path:str = None, kind:str = None, parse_func = None, **kwargs):
+        '''
+        path: The file to parse
+        kind: A name for the parser (e.g. "inp_out_dict", "c_matrix", "out_phases")
+        parse_func: Called as parse_func(path, **kwargs) if there is no valid stored result
+        kwargs: Options for the parser (these are part of the key)
+
+        returns the result of parse_func
+        '''
+        if not self.enabled:
+            return parse_func(path, **kwargs)
+        path = os.path.abspath(path)
+        options = tuple(sorted(kwargs.items()))
+        cache_file = self._get_cache_file(path, kind, options)
+        stamp = self._get_stamp(path)
+        # Try the stored result: {{{
+        try:
+            with open(cache_file, 'rb') as f:
+                key, result = pickle.load(f)
+            if key == (self.version, path, kind, options, stamp):
+                self.hits += 1
+                return result
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            self.logger.debug(f'Ignoring unreadable cache file {cache_file}: {e}')
+        #}}}
+        self.misses += 1
+        result = parse_func(path, **kwargs)
+        self._store(cache_file, (self.version, path, kind, options, stamp), result)
+        return result
+    #}}}
+    # _store: {{{
+    def _store(self, cache_file:str = None, key:tuple = None, result = None):
+        '''
+        Writes to a temporary file first so a crash never leaves a partial result
+        '''
+        os.makedirs(self.cache_dir, exist_ok = True)
+        tmp = f'{cache_file}.{os.getpid()}.tmp'
+        try:
+            with open(tmp, 'wb') as f:
+                pickle.dump((key, result), f, protocol = pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, cache_file)
+        except Exception as e:
+            self.logger.debug(f'Could not store {cache_file}: {e}')
+            if os.path.exists(tmp):
+                os.remove(tmp)
+    #}}}
+    # clear: {{{
+    def clear(self):
+        '''
+        Deletes all of the stored results
+        '''
+        if not os.path.isdir(self.cache_dir):
+            return
+        for f in os.listdir(self.cache_dir):
+            if f.endswith('.pkl') or f.endswith('.tmp'):
+                os.remove(os.path.join(self.cache_dir, f))
+    #}}}
+#}}}
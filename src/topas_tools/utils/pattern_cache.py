@@ -0,0 +1,296 @@
+# Authorship: {{{
+'''
+Written by: Dario C. Lewczyk
+Date: 10/18/26
+'''
+#}}}
+# Imports: {{{
+import os
+import sys
+import glob
+import hashlib
+import logging
+import argparse
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from topas_tools.utils import xy_loader
+#}}}
+# PatternCache: {{{
+class PatternCache:
+    '''
+    A binary (.npy) cache for the pattern files read with load_xy
+    (raw .xy data, TOPAS output .xy, bkgsub files, ...).
+
+    The first time a file is loaded, its array is saved as a .npy.
+    Later loads memory-map the .npy instead of parsing the text again.
+    The name of each .npy has the size and modification time of the text file,
+    so if the file changes, the old entry is not used (and is deleted) and the file is parsed again.
+
+    The cache is opt-in. Once it is activated, every load_xy call in the package uses it:
+        cache = PatternCache('.topas_pattern_cache', max_bytes = 2*1024**3)
+        cache.activate()
+    or, to write each .npy next to its text file:
+        PatternCache(sidecar = True).activate()
+
+    If the cache grows past max_bytes, the least recently used entries are deleted.
+
+    From the command line:
+        topas_pattern_cache warm "data/*.xy" --skiprows 1
+        topas_pattern_cache info
+        topas_pattern_cache purge
+    '''
+    logger = logging.getLogger(__name__)
+    sidecar_dir = '.topas_pattern_cache' # Used next to the text files if sidecar is True
+    # __init__: {{{
+    def __init__(self,
+            cache_dir:str = '.topas_pattern_cache',
+            max_bytes:int = 1024**3,
+            sidecar:bool = False,
+            mmap_mode:str = 'c',
+            enabled:bool = True,
+        ):
+        '''
+        cache_dir: where the .npy files are stored (ignored if sidecar is True)
+        max_bytes: The most the cache can hold before the least recently used entries are deleted (None for no limit)
+        sidecar: If True, the .npy files are stored in a folder next to each text file
+        mmap_mode: How the .npy files are memory-mapped ("c" is copy-on-write so the arrays can still be changed in memory, None reads them into memory)
+        enabled: If False, every call just parses the text file
+        '''
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        self.sidecar = sidecar
+        self.mmap_mode = mmap_mode
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._size = {} # cache dir: bytes used (only counted once per dir)
+    #}}}
+    # activate: {{{
+    def activate(self):
+        '''
+        Makes load_xy use this cache
+        '''
+        xy_loader.set_pattern_cache(self)
+        return self
+    #}}}
+    # deactivate: {{{
+    def deactivate(self):
+        if xy_loader.get_pattern_cache() is self:
+            xy_loader.set_pattern_cache(None)
+    #}}}
+    # _get_dir: {{{
+    def _get_dir(self, path:str = None):
+        if self.sidecar:
+            return os.path.join(os.path.dirname(path), self.sidecar_dir)
+        return self.cache_dir
+    #}}}
+    # _get_prefix: {{{
+    def _get_prefix(self, path:str = None, options:tuple = None):
+        '''
+        The part of the .npy name shared by every version of the file
+        '''
+        name = hashlib.sha1(repr((path, options)).encode()).hexdigest()[:16]
+        return os.path.join(self._get_dir(path), f'{os.path.basename(path)}.{name}')
+    #}}}
+    # get: {{{
+    def get(self, path:str = None, parse_func = None, **kwargs):
+        '''
+        path: The text file
+        parse_func: Called as parse_func(path, **kwargs) if there is no valid entry
+        kwargs: Options for the parser (these are part of the key)
+
+        returns the array (memory-mapped if it came from the cache)
+        '''
+        if not self.enabled:
+            return parse_func(path, **kwargs)
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        prefix = self._get_prefix(path, tuple(sorted(kwargs.items())))
+        cache_file = f'{prefix}.{stat.st_size}.{stat.st_mtime_ns}.npy'
+        # Try the stored array: {{{
+        try:
+            data = np.load(cache_file, mmap_mode = self.mmap_mode)
+            os.utime(cache_file) # Marks it as recently used
+            self.hits += 1
+            return data
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            self.logger.debug(f'Ignoring unreadable cache file {cache_file}: {e}')
+        #}}}
+        self.misses += 1
+        data = parse_func(path, **kwargs)
+        self._remove_stale(prefix, cache_file)
+        self._store(cache_file, data)
+        return data
+    #}}}
+    # _remove_stale: {{{
+    def _remove_stale(self, prefix:str = None, cache_file:str = None):
+        '''
+        Deletes entries made for older versions of the file
+        '''
+        for f in glob.glob(f'{glob.escape(prefix)}.*.npy'):
+            if f != cache_file:
+                self._remove(f)
+    #}}}
+    # _store: {{{
+    def _store(self, cache_file:str = None, data:np.ndarray = None):
+        '''
+        Writes to a temporary file first so a crash never leaves a partial entry
+        '''
+        cache_dir = os.path.dirname(cache_file)
+        tmp = f'{cache_file}.{os.getpid()}.tmp'
+        try:
+            os.makedirs(cache_dir, exist_ok = True)
+            size = self._get_size(cache_dir) # Counted before the new entry is there
+            with open(tmp, 'wb') as f:
+                np.save(f, np.ascontiguousarray(data))
+            os.replace(tmp, cache_file)
+        except Exception as e:
+            self.logger.debug(f'Could not store {cache_file}: {e}')
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        self._size[cache_dir] = size + os.path.getsize(cache_file)
+        if self.max_bytes is not None and self._size[cache_dir] > self.max_bytes:
+            self.evict(cache_dir)
+    #}}}
+    # _get_size: {{{
+    def _get_size(self, cache_dir:str = None):
+        if cache_dir not in self._size:
+            self._size[cache_dir] = sum(size for _, _, size in self._entries(cache_dir))
+        return self._size[cache_dir]
+    #}}}
+    # _entries: {{{
+    def _entries(self, cache_dir:str = None):
+        '''
+        returns [(path, last used, bytes), ...] for the entries in cache_dir
+        '''
+        entries = []
+        if not os.path.isdir(cache_dir):
+            return entries
+        for entry in os.scandir(cache_dir):
+            if entry.name.endswith('.npy'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue # Removed by another process
+                entries.append((entry.path, stat.st_mtime_ns, stat.st_size))
+        return entries
+    #}}}
+    # _remove: {{{
+    def _remove(self, f:str = None):
+        try:
+            size = os.path.getsize(f)
+            os.remove(f)
+        except OSError:
+            return
+        cache_dir = os.path.dirname(f)
+        if cache_dir in self._size:
+            self._size[cache_dir] -= size
+    #}}}
+    # evict: {{{
+    def evict(self, cache_dir:str = None, max_bytes:int = None):
+        '''
+        Deletes the least recently used entries until the cache is under max_bytes
+        cache_dir: defaults to cache_dir
+        max_bytes: defaults to max_bytes
+        '''
+        cache_dir = cache_dir or self.cache_dir
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = sorted(self._entries(cache_dir), key = lambda entry: entry[1])
+        total = sum(size for _, _, size in entries)
+        for f, _, size in entries:
+            if total <= max_bytes:
+                break
+            self._remove(f)
+            total -= size
+        self._size[cache_dir] = total
+    #}}}
+    # warm: {{{
+    def warm(self, filenames:list = None, workers:int = 8, **kwargs):
+        '''
+        Loads every file given so the next loads come from the cache
+        filenames: The text files
+        workers: threads used to load the files
+        kwargs: passed to load_xy (e.g. skiprows = 1 for pyFAI files)
+
+        returns the number of files that had to be parsed
+        '''
+        misses = self.misses
+        with ThreadPoolExecutor(max_workers = workers) as pool:
+            list(pool.map(lambda fn: xy_loader.load_xy(fn, cache = self, **kwargs), filenames))
+        return self.misses - misses
+    #}}}
+    # purge: {{{
+    def purge(self, cache_dir:str = None):
+        '''
+        Deletes all of the entries in cache_dir (defaults to cache_dir)
+        '''
+        cache_dir = cache_dir or self.cache_dir
+        if not os.path.isdir(cache_dir):
+            return
+        for f in os.listdir(cache_dir):
+            if f.endswith('.npy') or f.endswith('.tmp'):
+                self._remove(os.path.join(cache_dir, f))
+        self._size[cache_dir] = 0
+    #}}}
+    # info: {{{
+    def info(self, cache_dir:str = None):
+        '''
+        returns {'cache_dir', 'entries', 'bytes', 'max_bytes'}
+        '''
+        cache_dir = cache_dir or self.cache_dir
+        entries = self._entries(cache_dir)
+        return {
+            'cache_dir': cache_dir,
+            'entries': len(entries),
+            'bytes': sum(size for _, _, size in entries),
+            'max_bytes': self.max_bytes,
+        }
+    #}}}
+#}}}
+# main: {{{
+def main(argv:list = None):
+    '''
+    Command line entry point:
+
+        topas_pattern_cache warm "data/*.xy" --skiprows 1 --cache-dir .topas_pattern_cache
+        topas_pattern_cache info
+        topas_pattern_cache purge
+
+    (or python -m topas_tools.utils.pattern_cache ...)
+    '''
+    parser = argparse.ArgumentParser(description = 'Warm, inspect, or purge the binary cache of pattern files')
+    parser.add_argument('action', choices = ['warm', 'purge', 'info'])
+    parser.add_argument('files', nargs = '*', help = 'Files or glob patterns to warm (with --sidecar, these also pick the caches to purge or inspect)')
+    parser.add_argument('--cache-dir', default = '.topas_pattern_cache', help = 'Where the cache is stored')
+    parser.add_argument('--max-bytes', type = int, default = 1024**3, help = 'Size limit of the cache (least recently used entries are deleted)')
+    parser.add_argument('--sidecar', action = 'store_true', help = 'Store the cache next to each file')
+    parser.add_argument('--skiprows', type = int, default = None, help = 'Header lines to skip (default: detect them)')
+    parser.add_argument('--delimiter', default = None, help = 'Column delimiter (default: detect it)')
+    parser.add_argument('--workers', type = int, default = 8, help = 'Threads used to warm the cache')
+    args = parser.parse_args(argv)
+
+    cache = PatternCache(args.cache_dir, max_bytes = args.max_bytes, sidecar = args.sidecar)
+    filenames = []
+    for pattern in args.files:
+        filenames.extend(sorted(glob.glob(pattern)) or [pattern])
+    if args.sidecar:
+        cache_dirs = sorted({cache._get_dir(os.path.abspath(fn)) for fn in filenames})
+    else:
+        cache_dirs = [cache.cache_dir]
+    if args.action == 'warm':
+        parsed = cache.warm(filenames, workers = args.workers, skiprows = args.skiprows, delimiter = args.delimiter)
+        print(f'Warmed {len(filenames)} files ({parsed} parsed, {len(filenames) - parsed} already cached)')
+    for cache_dir in cache_dirs:
+        if args.action == 'purge':
+            cache.purge(cache_dir)
+            print(f'Purged {cache_dir}')
+        else:
+            info = cache.info(cache_dir)
+            print(f'{info["cache_dir"]}: {info["entries"]} entries, {info["bytes"]/1024**2:.1f} MB (limit: {info["max_bytes"]/1024**2:.1f} MB)')
+    return 0
+#}}}
+if __name__ == '__main__':
+    sys.exit(main())
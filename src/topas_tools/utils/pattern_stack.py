@@ -0,0 +1,288 @@
+# Authorship: {{{
+'''
+Written by: Dario C. Lewczyk
+Date: 10/18/26
+'''
+#}}}
+# Imports: {{{
+import os
+import sys
+import glob
+import json
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from topas_tools.utils.xy_loader import load_xy
+#}}}
+# _fill_rows: {{{
+def _fill_rows(path:str = None, filenames:list = None, rows:list = None, skiprows:int = None):
+    '''
+    Loads a chunk of files into their rows of the stack.
+    This runs in a worker process, so it opens the stack itself.
+
+    returns [(row, n_points, interpolated), ...]
+    '''
+    tth = np.load(os.path.join(path, PatternStack.tth_file))
+    intensities = np.load(os.path.join(path, PatternStack.intensities_file), mmap_mode = 'r+')
+    info = []
+    for fn, row in zip(filenames, rows):
+        data = load_xy(fn, skiprows = skiprows)
+        x, y = data[:,0], data[:,1]
+        interpolated = len(x) != len(tth) or not np.allclose(x, tth)
+        if interpolated:
+            y = np.interp(tth, x, y, left = np.nan, right = np.nan) # Points outside of the pattern are NaN
+        intensities[row] = y
+        info.append((row, len(x), interpolated))
+    intensities.flush()
+    return info
+#}}}
+# PatternStack: {{{
+class PatternStack:
+    '''
+    All of the patterns of an experiment stored as one array on disk.
+
+    A stack is a folder with:
+        tth.npy: The 2theta axis shared by every pattern
+        intensities.npy: float32 array (patterns x points) opened as a memory map
+        index.json: The filename, time, and temperature of each pattern (row order)
+
+    Since the intensities are memory-mapped, slicing only reads the rows (and points) you ask for:
+        stack = PatternStack('experiment.stack')
+        tth, y = stack.get_pattern('pattern_000123.xy')
+        rows = stack.select(start_time = 10, end_time = 60, num_patterns = 20)
+        tth, i_arr = stack.waterfall(rows, tth_min = 2, tth_max = 8)
+
+    Build one from a directory of .xy files with:
+        PatternStack.build('experiment.stack', data_dir = 'data', skiprows = 1)
+    Patterns that do not share the 2theta axis of the first one are interpolated onto it.
+    '''
+    tth_file = 'tth.npy'
+    intensities_file = 'intensities.npy'
+    index_file = 'index.json'
+    version = 1
+    # __init__: {{{
+    def __init__(self, path:str = None, mode:str = 'r'):
+        '''
+        path: The stack folder
+        mode: How the intensities are memory-mapped ("r" for read only, "r+" to change them on disk, "c" for copy-on-write)
+        '''
+        self.path = os.path.abspath(path)
+        with open(os.path.join(self.path, self.index_file), 'r') as f:
+            self.index = json.load(f)
+        if self.index.get('version') != self.version:
+            raise ValueError(f'{self.path} is a version {self.index.get("version")} PatternStack. Rebuild it with version {self.version}')
+        self.tth = np.load(os.path.join(self.path, self.tth_file))
+        self.intensities = np.load(os.path.join(self.path, self.intensities_file), mmap_mode = mode)
+        self.filenames = self.index['filenames']
+        self.times = np.asarray(self.index['times'], dtype = float) if self.index.get('times') is not None else None
+        self.temperatures = np.asarray(self.index['temperatures'], dtype = float) if self.index.get('temperatures') is not None else None
+        self._paths = {os.path.normcase(os.path.abspath(fn)): i for i, fn in enumerate(self.filenames)}
+        self._names = {} # basename: row (None if more than one file has that name)
+        for i, fn in enumerate(self.filenames):
+            name = os.path.basename(fn)
+            self._names[name] = None if name in self._names else i
+    #}}}
+    # build: {{{
+    @classmethod
+    def build(cls,
+            path:str = None,
+            filenames:list = None,
+            data_dir:str = None,
+            fileextension:str = 'xy',
+            skiprows:int = None,
+            times:list = None,
+            temperatures:list = None,
+            workers:int = None,
+            chunksize:int = 64,
+        ):
+        '''
+        Converts text pattern files to a stack.
+
+        path: The stack folder to make
+        filenames: The pattern files in the order you want (default: every *.fileextension in data_dir, sorted)
+        data_dir: The directory with the files (if filenames are not full paths)
+        skiprows: Header lines (None detects them)
+        times: The time of each pattern (optional)
+        temperatures: The temperature of each pattern (optional)
+        workers: Processes used to load the files (None for one per CPU, 1 to load them here)
+        chunksize: Files loaded per task
+
+        returns the PatternStack
+        '''
+        # Get the files: {{{
+        if filenames is None:
+            filenames = sorted(glob.glob(os.path.join(data_dir or '.', f'*.{fileextension}')))
+        elif data_dir is not None:
+            filenames = [os.path.join(data_dir, fn) for fn in filenames]
+        filenames = [os.path.abspath(fn) for fn in filenames]
+        if not filenames:
+            raise ValueError(f'There are no .{fileextension} files to stack in {data_dir}')
+        for name, values in (('times', times), ('temperatures', temperatures)):
+            if values is not None and len(values) != len(filenames):
+                raise ValueError(f'Got {len(values)} {name} for {len(filenames)} files')
+        #}}}
+        # Make the arrays (the first file sets the 2theta axis): {{{
+        os.makedirs(path, exist_ok = True)
+        tth = load_xy(filenames[0], skiprows = skiprows)[:,0]
+        np.save(os.path.join(path, cls.tth_file), tth)
+        intensities = np.lib.format.open_memmap(
+                os.path.join(path, cls.intensities_file),
+                mode = 'w+',
+                dtype = np.float32,
+                shape = (len(filenames), len(tth)),
+        )
+        del intensities # The workers open it themselves
+        #}}}
+        # Fill the rows: {{{
+        chunks = [(filenames[i:i+chunksize], list(range(i, min(i+chunksize, len(filenames))))) for i in range(0, len(filenames), chunksize)]
+        info = []
+        if workers == 1 or len(chunks) == 1:
+            for fns, rows in chunks:
+                info.extend(_fill_rows(path, fns, rows, skiprows))
+        else:
+            with ProcessPoolExecutor(max_workers = workers) as pool:
+                futures = [pool.submit(_fill_rows, path, fns, rows, skiprows) for fns, rows in chunks]
+                for future in futures:
+                    info.extend(future.result())
+        info.sort()
+        #}}}
+        index = {
+            'version': cls.version,
+            'filenames': filenames,
+            'times': [float(t) for t in times] if times is not None else None,
+            'temperatures': [float(t) for t in temperatures] if temperatures is not None else None,
+            'n_points': [n for _, n, _ in info],
+            'interpolated': [row for row, _, interpolated in info if interpolated],
+            'skiprows': skiprows,
+        }
+        with open(os.path.join(path, cls.index_file), 'w') as f:
+            json.dump(index, f)
+        return cls(path)
+    #}}}
+    # __len__: {{{
+    def __len__(self):
+        return len(self.filenames)
+    #}}}
+    # shape: {{{
+    @property
+    def shape(self):
+        return self.intensities.shape
+    #}}}
+    # find: {{{
+    def find(self, filename:str = None, data_dir:str = None):
+        '''
+        returns the row of a file or None if it is not in the stack
+
+        filename: The file (relative to data_dir or the current directory)
+        data_dir: The directory with the file (optional)
+
+        The file is looked up by its absolute path. If that is not in the stack,
+        the name alone is used, but only if one file in the stack has that name
+        and the path given is not a different file (e.g. an air or glass pattern with the same name).
+        '''
+        if data_dir is not None:
+            filename = os.path.join(data_dir, filename)
+        path = os.path.abspath(filename)
+        row = self._paths.get(os.path.normcase(path))
+        if row is not None:
+            return row
+        row = self._names.get(os.path.basename(path))
+        if row is None:
+            return None
+        stored = self.filenames[row]
+        if os.path.exists(path) and os.path.exists(stored) and not os.path.samefile(path, stored):
+            return None # Another file with the same name
+        return row
+    #}}}
+    # __contains__: {{{
+    def __contains__(self, filename):
+        return self.find(filename) is not None
+    #}}}
+    # _get_row: {{{
+    def _get_row(self, key = None):
+        if isinstance(key, (int, np.integer)):
+            return int(key)
+        row = self.find(key)
+        if row is None:
+            raise KeyError(f'{key} is not in {self.path}')
+        return row
+    #}}}
+    # get_pattern: {{{
+    def get_pattern(self, key = None):
+        '''
+        key: A row or a filename
+        returns (tth, intensities)
+        '''
+        return self.tth, self.intensities[self._get_row(key)]
+    #}}}
+    # get_data: {{{
+    def get_data(self, key = None):
+        '''
+        key: A row or a filename
+        returns a (points x 2) array like load_xy gives for a pyFAI .xy
+        '''
+        tth, y = self.get_pattern(key)
+        return np.column_stack((tth, y.astype(float)))
+    #}}}
+    # tth_range: {{{
+    def tth_range(self, tth_min:float = None, tth_max:float = None):
+        '''
+        returns the slice of points from tth_min to tth_max
+        '''
+        start = int(np.searchsorted(self.tth, tth_min, side = 'left')) if tth_min is not None else 0
+        end = int(np.searchsorted(self.tth, tth_max, side = 'right')) if tth_max is not None else len(self.tth)
+        return slice(start, end)
+    #}}}
+    # select: {{{
+    def select(self, start_time:float = None, end_time:float = None, num_patterns:int = None):
+        '''
+        returns num_patterns rows spaced evenly from start_time to end_time
+        (the closest patterns to those times). Without times, the rows are used as the times.
+        '''
+        times = self.times if self.times is not None else np.arange(len(self), dtype = float)
+        first = int(np.argmin(np.abs(times - start_time))) if start_time is not None else 0
+        last = int(np.argmin(np.abs(times - end_time))) if end_time is not None else len(self) - 1
+        num_patterns = num_patterns or abs(last - first) + 1
+        return [int(row) for row in np.linspace(first, last, num_patterns)]
+    #}}}
+    # waterfall: {{{
+    def waterfall(self, rows:list = None, tth_min:float = None, tth_max:float = None):
+        '''
+        returns (tth, i_arr) for the rows given (default: all) from tth_min to tth_max.
+        Only those rows and points are read from disk.
+        '''
+        points = self.tth_range(tth_min, tth_max)
+        if rows is None:
+            i_arr = self.intensities[:, points]
+        else:
+            i_arr = self.intensities[np.asarray(rows), points]
+        return self.tth[points], np.asarray(i_arr)
+    #}}}
+    # __repr__: {{{
+    def __repr__(self):
+        return f'PatternStack({self.path!r}, {len(self)} patterns x {len(self.tth)} points)'
+    #}}}
+#}}}
+# main: {{{
+def main(argv:list = None):
+    '''
+    Command line entry point:
+
+        python -m topas_tools.utils.pattern_stack data_dir experiment.stack --skiprows 1 --workers 8
+    '''
+    parser = argparse.ArgumentParser(description = 'Convert a directory of pattern files to a memory-mapped PatternStack')
+    parser.add_argument('data_dir', help = 'The directory with the patterns')
+    parser.add_argument('path', help = 'The stack folder to make')
+    parser.add_argument('--fileextension', default = 'xy', help = 'Extension of the pattern files')
+    parser.add_argument('--skiprows', type = int, default = None, help = 'Header lines to skip (default: detect them)')
+    parser.add_argument('--workers', type = int, default = None, help = 'Processes used to load the files')
+    args = parser.parse_args(argv)
+
+    stack = PatternStack.build(args.path, data_dir = args.data_dir, fileextension = args.fileextension, skiprows = args.skiprows, workers = args.workers)
+    print(stack)
+    if stack.index['interpolated']:
+        print(f'{len(stack.index["interpolated"])} patterns were interpolated onto the 2theta axis of {os.path.basename(stack.filenames[0])}')
+    return 0
+#}}}
+if __name__ == '__main__':
+    sys.exit(main())
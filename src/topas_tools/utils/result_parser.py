@@ -3,10 +3,11 @@
 # Date: 02-20-2024
 #}}}
 # Imports: {{{
-import re
 import sys
 import numpy as np
-
+from topas_tools.utils.c_matrix import CMatrix
+from topas_tools.utils.out_file import OutFile
+from topas_tools.utils.xy_loader import load_xy
 #}}}
 # ResultParser: {{{
 class ResultParser:
@@ -18,23 +19,6 @@ class ResultParser:
     .csv
     .hkli 
     '''
-    # _replace_nan_with_previous: {{{
-    def _replace_nan_with_previous(self,):
-        '''
-        This function is designed to replace the 1.QNAN0 values
-        with the last valid value for parse_xy
-        '''
-        last_valid = [None]*4 # Assumes 4 column data are being imported
-        def converter(val, col):
-            nonlocal last_valid
-            try:
-                float_val = float(val)
-                last_valid[col] = float_val
-                return float_val
-            except ValueError:
-                return last_valid[col] if last_valid[col] is not None else 0
-        return converter
-    #}}}
     # _parse_xy: {{{
     def _parse_xy(self,xy_file:str = None,delimiter:str = ',', skiprows:int = 0):
         '''
@@ -43,11 +27,7 @@ class ResultParser:
         Sometimes TOPAS may output a string called "1.#QNAN0" which will essentially break this function. 
         By default, this function will replace it with the last valid value.
         '''
-        try:
-            xy_data = np.loadtxt(xy_file, delimiter=delimiter, skiprows=skiprows) # imports the xy data to an array 
-        except:
-            converters = {i: lambda val, col=i: self._replace_nan_with_previous()(val,col) for i in range(4)}
-            xy_data = np.genfromtxt(xy_file, delimiter=delimiter, converters=converters, autostrip=True, invalid_raise=False, skip_header = skiprows) # imports the xy data to an array 
+        xy_data = load_xy(xy_file, delimiter=delimiter, skiprows=skiprows) # imports the xy data to an array (QNANs are filled in)
         tth = xy_data[:,0]
         yobs = xy_data[:,1]
         try:
@@ -69,94 +49,18 @@ class ResultParser:
         The purpose of this function is to automatically generate a dictionary
         for the user to quickly view the c matrices for any of the refined patterns.  
         We want to also have each of the correlations be clearly labeled.
-        '''
-        c_matrix = {} # This is the matrix object we create
-        c_matrix_lines = []
-        c_matrix_var_names = [] # We want to correlate the variable names with the correlation values
-        # Get the rows of the matrix: {{{
-        with open(out_file,'r') as out:
-            lines = out.readlines()
-            c_mat_line = None
-            for i, line in enumerate(lines):
-                if 'C_matrix_normalized' in line: 
-                    c_mat_line = i
-                if c_mat_line:
-                    if i > c_mat_line:
-                        # At this point, we have passed the point of introduction of the matrix. 
-                        splitline = line.split(' ') # The vars and numbers are separated by whitespace
-                        corrected_line = [] # We need to do some post-processing before we pass the lines onward.
-                        if len(splitline) > 1 and '\n' not in splitline:
-                            # This check ensures we do not get unimportant lines.
-                            for l in splitline:
-                                if l != '':
-                                    corrected_line.append(l) # Add only non-blank entries
-                            c_matrix_lines.append(corrected_line)
-                            #print(i,corrected_line)
-            out.close() # We are done with the file now. 
-        #}}}
-        # Generate the C matrix Object: {{{
-        if c_matrix_lines:
-            for i, row in enumerate(c_matrix_lines):
-                if i == 0:
-                    # The first entry should be the top row of the matrix with variable indices.
-                    ints = np.loadtxt(row)
-                    #print(ints)
-                    #print(len(ints))
-                    for num in ints:
-                        c_matrix[int(num)] = {} # Initialize the entry
-                else:
-                    # Get the Var names and Numbers: {{{
-                    var_name = row[0]
-                    c_matrix_var_names.append(var_name) # Store the name
-                    var_num = int(row[1].strip(':')) # The number correlated to the variable name is recorded next
-                    # Update the C Matrix: 
-                    c_matrix[var_num].update({
-                        'name': var_name,
-                        'correlations':{},
-                    })
-                    #}}}
-                    # GET Correlations: {{{
-                    numbers = row[2:]
-                    fixed_numbers = []
-                    for v in numbers: 
-                        combined_num = re.findall(r'\D?\d+',v) # This gets any digit (either positive or negative) and can split combined numbers
-                        if combined_num:
-                            fixed_numbers.extend(combined_num) # This adds the positive and negative numbers
-                    correlations = np.loadtxt(fixed_numbers)
-                    #print(len(correlations))
-                    #}}}
-                    # UPDATE THE MATRIX: {{{
-                    for j, v in enumerate(correlations):
-                        j = j+1 # This brings the variable numbers in line with the correlations
-                        c_matrix[var_num]['correlations'].update({
-                            j:v
-                        })
-                    #}}}
-        #}}}
-        # Update the correlations with the names of the variables: {{{ 
-        for i in c_matrix:
-            entry = c_matrix[i]
-            correlations = entry['correlations']
-            for j in correlations:
-                correlation = correlations[j]
-                # Get correlation Flags: {{{
-                if correlation_threshold:
-                    if correlation > correlation_threshold or correlation < -1*correlation_threshold:
-                        flag = 'CHECK'
-                    else:
-                        flag = 'OK'
-                else:
-                    flag = 'N/A'
 
-                #}}}
-                correlations[j] = {
-                        'name': c_matrix_var_names[j-1], # Need the index, so j-1
-                        'correlation': correlation,
-                        'flag':flag,
-                }
+        This returns a CMatrix: the correlations are stored in a dense int8 array (c_matrix.values)
+        with the names in c_matrix.names. 
+        It can still be used like the old dictionary: 
+            c_matrix[num]['correlations'][j] = {'name', 'correlation', 'flag'}
+        but those entries are only made when you ask for them.
 
-        #}}}
-        return c_matrix
+        out_file can also be an OutFile, in which case only the C matrix section is read.
+        '''
+        if isinstance(out_file, OutFile):
+            return CMatrix.from_lines(out_file.lines('c_matrix'), correlation_threshold) # Only reads the matrix
+        return CMatrix.from_out_file(out_file, correlation_threshold)
     #}}}
     # _get_correlations: {{{
     def _get_correlations(self, c_matrix:dict = None, flag_search:str = 'CHECK',debug:bool = False):
@@ -170,6 +74,8 @@ class ResultParser:
         if type(c_matrix) == None:
             print('No C Matrix Present.')
             sys.exit() 
+        elif isinstance(c_matrix, CMatrix):
+            return c_matrix.get_correlations(flag_search, debug) # Lookup on the array
         else:
             # Find the correlations matching your search flag: {{{ 
             for i in c_matrix:
@@ -0,0 +1,252 @@
+# Authorship: {{{
+'''
+Written by: Dario C. Lewczyk
+Date: 10/18/26
+'''
+#}}}
+# Imports: {{{
+import copy
+import threading
+import numpy as np
+from collections import OrderedDict
+from collections.abc import MutableMapping
+#}}}
+_NOT_LOADED = object() # Marks a member that is read from disk when it is used
+# _set_writeable: {{{
+def _set_writeable(value = None, writeable:bool = False):
+    '''
+    Sets the WRITEABLE flag of every array in value (a heavy member)
+    '''
+    if isinstance(value, np.ndarray):
+        try:
+            value.setflags(write = writeable)
+        except ValueError:
+            pass # A view of read only memory stays read only
+    elif isinstance(value, dict):
+        for v in value.values():
+            _set_writeable(v, writeable)
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            _set_writeable(v, writeable)
+#}}}
+# _PinOnWrite: {{{
+class _PinOnWrite(dict):
+    '''
+    The dictionaries inside the heavy members of a LazyRietveldEntry.
+    Changing one pins the entry, so the change is not lost when the entry is unloaded.
+    '''
+    def __init__(self, value:dict = None, entry = None):
+        super().__init__((k, _PinOnWrite.wrap(v, entry)) for k, v in value.items())
+        self._entry = entry
+    @staticmethod
+    def wrap(value = None, entry = None):
+        if isinstance(value, dict) and not isinstance(value, _PinOnWrite):
+            return _PinOnWrite(value, entry)
+        return value
+    @staticmethod
+    def unwrap(value = None):
+        if isinstance(value, _PinOnWrite):
+            return {k: _PinOnWrite.unwrap(v) for k, v in value.items()}
+        return value
+    def _pin(self):
+        self._entry.pin()
+    def __setitem__(self, key, value):
+        self._pin()
+        super().__setitem__(key, value)
+    def __delitem__(self, key):
+        self._pin()
+        super().__delitem__(key)
+    def update(self, *args, **kwargs):
+        self._pin()
+        super().update(*args, **kwargs)
+    def setdefault(self, key, default = None):
+        if key not in self:
+            self._pin()
+        return super().setdefault(key, default)
+    def pop(self, *args):
+        self._pin()
+        return super().pop(*args)
+    def popitem(self):
+        self._pin()
+        return super().popitem()
+    def clear(self):
+        self._pin()
+        super().clear()
+    def __ior__(self, other):
+        self.update(other)
+        return self
+    def __reduce__(self):
+        return (dict, (_PinOnWrite.unwrap(self),))
+#}}}
+# EntryLRU: {{{
+class EntryLRU:
+    '''
+    Keeps track of which LazyRietveldEntry objects have their heavy members in memory.
+    When more than max_loaded are loaded, the least recently used one drops them
+    (they are read again the next time they are used).
+    '''
+    # __init__: {{{
+    def __init__(self, max_loaded:int = 64):
+        '''
+        max_loaded: The most entries with heavy members in memory (None for no limit)
+        '''
+        self.max_loaded = max_loaded
+        self._loaded = OrderedDict() # id(entry): entry
+        self._lock = threading.Lock()
+    #}}}
+    # touch: {{{
+    def touch(self, entry = None):
+        '''
+        Marks an entry as the most recently used and unloads the oldest if there are too many
+        (pinned entries are not tracked, so they are never unloaded)
+        '''
+        with self._lock:
+            self._loaded[id(entry)] = entry
+            self._loaded.move_to_end(id(entry))
+            dropped = []
+            while self.max_loaded is not None and len(self._loaded) > self.max_loaded:
+                dropped.append(self._loaded.popitem(last = False)[1])
+        for old in dropped:
+            old._heavy = None
+    #}}}
+    # discard: {{{
+    def discard(self, entry = None):
+        with self._lock:
+            self._loaded.pop(id(entry), None)
+    #}}}
+    # __len__: {{{
+    def __len__(self):
+        return len(self._loaded)
+    #}}}
+#}}}
+# LazyRietveldEntry: {{{
+class LazyRietveldEntry(MutableMapping):
+    '''
+    One entry of RefinementAnalyzer.rietveld_data whose heavy members
+    (lazy_keys: the xy arrays, C matrix, hkli, phase xy, and background)
+    are only read from disk the first time one of them is used.
+
+    The CSV values, OUT dictionaries, names, and anything added later (times, temperatures, ...)
+    are kept in memory like a normal dictionary.
+
+    All of the heavy members of an entry are loaded together by loader() and
+    dropped together when the EntryLRU it shares with the other entries unloads it.
+    Anything you set yourself is kept (even for a heavy member).
+
+    Since an unloaded member is read again from disk, changes made inside the heavy members would be lost:
+        The arrays are read only, so entry['xy']['yobs'][:] = ... raises an error.
+        Call entry.pin() first to keep the members in memory and make the arrays writeable.
+        Setting a value in one of their dictionaries (entry['xy']['yobs'] = ...) pins the entry.
+
+    It behaves like the dictionary it replaces:
+        entry['xy']['yobs'], entry['csv'], entry.update({...}), dict(entry)
+    '''
+    lazy_keys = ('xy', 'c_matrix', 'c_matrix_filtered', 'hkli', 'phase_xy', 'bkg', 'bkg_name')
+    # __init__: {{{
+    def __init__(self, entry:dict = None, loader = None, lru:EntryLRU = None):
+        '''
+        entry: The entry (any values under lazy_keys are ignored)
+        loader: Called with no arguments, returns a dictionary with the lazy_keys
+        lru: Shared by the entries of one rietveld_data
+        '''
+        self._data = dict(entry or {})
+        for key in self.lazy_keys:
+            self._data[key] = _NOT_LOADED
+        self._loader = loader
+        self._lru = lru if lru is not None else EntryLRU(None)
+        self._heavy = None
+        self._pinned = False
+    #}}}
+    # loaded: {{{
+    @property
+    def loaded(self):
+        '''
+        True if the heavy members are in memory
+        '''
+        return self._heavy is not None
+    #}}}
+    # pinned: {{{
+    @property
+    def pinned(self):
+        '''
+        True if the heavy members are kept in memory (see pin)
+        '''
+        return self._pinned
+    #}}}
+    # load: {{{
+    def load(self):
+        '''
+        returns the heavy members (reading them if needed)
+        '''
+        heavy = self._heavy
+        if heavy is None:
+            heavy = self._loader()
+            _set_writeable(heavy, self._pinned)
+            heavy = {key: _PinOnWrite.wrap(value, self) for key, value in heavy.items()}
+            self._heavy = heavy
+        if not self._pinned:
+            self._lru.touch(self)
+        return heavy
+    #}}}
+    # pin: {{{
+    def pin(self):
+        '''
+        Keeps the heavy members in memory (the LRU never drops them) and makes their arrays writeable,
+        so changes made to them are kept
+        '''
+        if self._pinned:
+            return
+        self._pinned = True
+        self._lru.discard(self)
+        _set_writeable(self.load(), True)
+    #}}}
+    # unload: {{{
+    def unload(self):
+        '''
+        Drops the heavy members (they are read again from disk the next time they are used).
+        This also unpins the entry, so any changes to them are lost.
+        '''
+        self._heavy = None
+        self._pinned = False
+        self._lru.discard(self)
+    #}}}
+    # Mapping: {{{
+    def __getitem__(self, key):
+        value = self._data[key]
+        if value is _NOT_LOADED:
+            return self.load()[key]
+        return value
+    def __setitem__(self, key, value):
+        self._data[key] = value
+    def __delitem__(self, key):
+        del self._data[key]
+    def __iter__(self):
+        return iter(self._data)
+    def __len__(self):
+        return len(self._data)
+    def __contains__(self, key):
+        return key in self._data
+    #}}}
+    # to_dict: {{{
+    def to_dict(self):
+        '''
+        returns a normal dictionary with every member loaded
+        (the arrays are shared with the entry, so they are read only unless it is pinned)
+        '''
+        return {key: _PinOnWrite.unwrap(self[key]) for key in self}
+    #}}}
+    # __reduce__/__deepcopy__: {{{
+    def __reduce__(self):
+        '''
+        Pickles as a normal dictionary (with every member loaded)
+        so the analyzer and files are not needed to load it
+        '''
+        return (dict, (self.to_dict(),))
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(self.to_dict(), memo)
+    #}}}
+    # __repr__: {{{
+    def __repr__(self):
+        return f'LazyRietveldEntry({self._data.get("csv_name")!r}, loaded={self.loaded})'
+    #}}}
+#}}}
@@ -5,6 +5,7 @@
 #}}}
 # Imports: {{{
 from topas_tools.utils.topas_utils import DataCollector
+from topas_tools.utils.xy_loader import load_xy
 import numpy as np
 #}}}
 # MTFLogParser: {{{
@@ -36,7 +37,7 @@ class MTFLogParser(DataCollector):
         8. kd
         '''
         for i, fn in self.file_dict.items():
-            data = np.loadtxt(fn, skiprows=1, delimiter=',')
+            data = load_xy(fn, skiprows=1, delimiter=',')
             time = data[:,0]
             tc = data[:,1]
             td = data[:,2]
@@ -0,0 +1,107 @@
+# Authorship: {{{
+'''
+Written by: Dario C. Lewczyk
+Date: 10/18/26
+'''
+#}}}
+# Imports: {{{
+import bisect
+#}}}
+# TopasDocument: {{{
+class TopasDocument:
+    '''
+    The lines of an INP along with a record of every edit made to them.
+
+    Lines are always addressed by their linenumber in the ORIGINAL file
+    (the linenumbers stored in an inp_dict or a refreshed out_dict).
+    Inserted lines shift everything after them, but the document keeps
+    track of where each insertion happened, so the original linenumbers
+    stay valid and no entry of the dictionaries ever has to be offset.
+
+    e.g.
+        doc = TopasDocument(lines)
+        doc[12] = 'new line\\n'         # replace original line 12
+        doc.insert(5, ['a\\n', 'b\\n'])   # insert before original line 5
+        doc[12]                         # still original line 12 (now at 14)
+        doc.lines                       # the lines to write
+        doc.edits                       # the diff
+    '''
+    # __init__: {{{
+    def __init__(self, lines:list = None):
+        self.lines = list(lines or [])
+        self.edits = [] # The diff: one dictionary per replacement or insertion
+        self._insert_at = [] # Sorted original linenumbers with insertions before them
+        self._insert_counts = [] # Cumulative number of lines inserted (same order as _insert_at)
+    #}}}
+    # current_linenumber: {{{
+    def current_linenumber(self, linenumber:int = None):
+        '''
+        Converts an original linenumber to the index in self.lines
+        '''
+        i = bisect.bisect_right(self._insert_at, linenumber)
+        if i == 0:
+            return linenumber
+        return linenumber + self._insert_counts[i-1]
+    #}}}
+    # __getitem__: {{{
+    def __getitem__(self, linenumber:int = None):
+        return self.lines[self.current_linenumber(linenumber)]
+    #}}}
+    # __setitem__: {{{
+    def __setitem__(self, linenumber:int = None, line:str = None):
+        self.replace(linenumber, line)
+    #}}}
+    # __len__: {{{
+    def __len__(self):
+        return len(self.lines)
+    #}}}
+    # __iter__: {{{
+    def __iter__(self):
+        return iter(self.lines)
+    #}}}
+    # replace: {{{
+    def replace(self, linenumber:int = None, line:str = None):
+        '''
+        Replaces an original line
+        '''
+        idx = self.current_linenumber(linenumber)
+        old = self.lines[idx]
+        if old == line:
+            return
+        self.lines[idx] = line
+        self.edits.append({'op': 'replace', 'linenumber': linenumber, 'old': old, 'new': line})
+    #}}}
+    # insert: {{{
+    def insert(self, linenumber:int = None, new_lines:list = None):
+        '''
+        Inserts lines before an original line.
+        Lines inserted before the same original line keep the order they were inserted in.
+        '''
+        if isinstance(new_lines, str):
+            new_lines = [new_lines]
+        new_lines = list(new_lines)
+        if not new_lines:
+            return
+        # Insert after anything already inserted at this position: {{{
+        i = bisect.bisect_right(self._insert_at, linenumber)
+        idx = linenumber + (self._insert_counts[i-1] if i > 0 else 0)
+        self.lines[idx:idx] = new_lines
+        #}}}
+        # Update the insertion record: {{{
+        n = len(new_lines)
+        if i > 0 and self._insert_at[i-1] == linenumber:
+            i -= 1 # Already have an insertion here
+        else:
+            self._insert_at.insert(i, linenumber)
+            self._insert_counts.insert(i, self._insert_counts[i-1] if i > 0 else 0)
+        for j in range(i, len(self._insert_counts)):
+            self._insert_counts[j] += n # Only insertions after this one move
+        #}}}
+        self.edits.append({'op': 'insert', 'linenumber': linenumber, 'new': new_lines})
+    #}}}
+    # inserted_lines: {{{
+    @property
+    def inserted_lines(self):
+        return self._insert_counts[-1] if self._insert_counts else 0
+    #}}}
+#}}}
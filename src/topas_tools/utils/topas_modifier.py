@@ -6,6 +6,7 @@ Date: 01/16/2026
 #}}}
 # imports: {{{
 from topas_tools.utils.topas_parser import TOPAS_Parser
+from topas_tools.utils.topas_document import TopasDocument
 import re
 import os
 import logging
@@ -266,13 +267,16 @@ class TOPAS_Modifier(TOPAS_Parser):
             out_dict:dict = None, 
             macro_blocks:dict = None, I="I", P = "P", S = "S",
             modes_for_phases:dict = None,
+            document:TopasDocument = None,
     ):
         '''
-        This writes the lines necessary for running IxPxSx type refinements 
-        and ensures that the added lines are all accounted for so that 
-        future refinements can still find an output XY line if it exists.
+        This writes the lines necessary for running IxPxSx type refinements. 
 
-        lines: read from an INP file
+        The lines are inserted into a TopasDocument so that 
+        future edits can still find an output XY line (or anything else after the insertion)
+        by its original linenumber.
+
+        lines: read from an INP file (ignored if document is given)
         cry_files: list of files for the IxPxSx technique
         out_dict: output file dictionary generated by TOPAS_Parser
         macro_blocks: macro_blocks dictionary generated by TOPAS_Parser
@@ -284,11 +288,14 @@ class TOPAS_Modifier(TOPAS_Parser):
             This is the dictionary that can overwrite what the current IxPxSx method is 
             for a specific phase
             ex: {1: 'xxx'} set Ph 1 to xxx always
+        document: The TopasDocument to insert the lines into 
 
         Returns: 
             lines 
         ''' 
-        added_lines = 0 
+        if document is None:
+            document = TopasDocument(lines)
+        new_lines = []
         # Now, write the WPF IxPxSx stuff: {{{ 
         # This gives us the index where we can insert new lines
         insert_idx = macro_blocks[max(list(macro_blocks.keys()))][1] + 2 
@@ -296,9 +303,7 @@ class TOPAS_Modifier(TOPAS_Parser):
             # The positioning of the WPF_IxPxSx stuff does matter
             # Write a macro for each phase: {{{
             if 'Ph' in ph:
-                lines.insert(insert_idx, '\n') # Insert a break
-                insert_idx +=1
-                added_lines += 1
+                new_lines.append('\n') # Insert a break
                 # This will be used for making the WPF macros
                 ph_num = int(re.search(r'(\d+)', ph).group(1)) 
                 
@@ -311,33 +316,19 @@ class TOPAS_Modifier(TOPAS_Parser):
                 else:
                     wpf_macro = f'WPF_{I}{P}{S}_{ph_num}()\n' # write the macro 
 
-                lines.insert(insert_idx, wpf_macro) # Write the macro
-                insert_idx += 1 # Advance by 1
-                lines.insert(insert_idx, '\n')
-                insert_idx += 1 
-                added_lines += 2 
+                new_lines.append(wpf_macro) # Write the macro
+                new_lines.append('\n')
             #}}} 
         #}}}
         # Add the include statements for the CRY: {{{
         for cry in cry_files:
             cry = os.path.basename(cry) # This removes the path stuff
             cry = cry.removesuffix('.out')
-            lne = f'#include {cry}.inp'
-
-            lines.insert(insert_idx,lne)
-            insert_idx += 1
-            lines.insert(insert_idx,'\n')
-            insert_idx += 1
-            added_lines += 2
+            new_lines.append(f'#include {cry}.inp')
+            new_lines.append('\n')
         #}}}    
-        # Freeze the updates to the output_xy after it is updated: {{{
-        if "output_xy" in out_dict and out_dict.get('output_xy') is not None:
-            # This offsets the lines by the number necessary
-            self.apply_line_offset(out_dict['output_xy'], added_lines) 
-            # Freezes updates for the lifetime of the inp file
-            self.freeze_updates(out_dict['output_xy']) 
-        #}}} 
-        return lines
+        document.insert(insert_idx, new_lines) # Everything after this keeps its original linenumber in the document
+        return document.lines
     #}}}    
     # update_output_xy_line: {{{
     def update_output_xy_line(
@@ -441,6 +432,7 @@ class TOPAS_Modifier(TOPAS_Parser):
             update_output_xy_line:bool = True,
             new_suffix:str = None,
             modes_for_phases:dict = None,
+            inp_dict:dict = None,
         ):
         ''' 
         This function wraps all the line modification lines
@@ -456,46 +448,54 @@ class TOPAS_Modifier(TOPAS_Parser):
         modes_for_phases: 
             A dictionary of the form: {1:'xxx'} where you tell the code which 
             phase number to pay attention to and what mode you want
+        inp_dict:
+            The dictionary of the unmodified lines (from get_inp_out_dict). 
+            If you already parsed the template, passing it here skips parsing it again.
+
+        All of the edits are made through a TopasDocument, so the linenumbers 
+        of inp_dict/out_dict stay valid after the IxPxSx lines are inserted.
         ''' 
-        # 1.  Re-parse the INP to detect drift: {{{ 
-        inp_dict = self.get_inp_out_dict(
-                lines, 
-                record_fit_metrics = False, 
-                record_xdd = False
-        ) # This gives us the INP dictionary 
+        # 1.  Parse the INP to detect drift (if not given): {{{ 
+        if inp_dict is None:
+            inp_dict = self.get_inp_out_dict(
+                    lines, 
+                    record_fit_metrics = False, 
+                    record_xdd = False
+            ) # This gives us the INP dictionary 
+        document = TopasDocument(lines)
         #}}}
         # 2. Refresh out_dict to match INP: {{{
         self.refresh_out_dict(out_dict, inp_dict) # IF there are differences, this will resolve them
         #}}}
         # 3. Modify_ph: {{{
         if modify_ph:
-            lines = self.modify_ph_lines(
-                lines=lines, out_dict=out_dict, I=I,P=P,S=S, modes_for_phases=modes_for_phases
+            self.modify_ph_lines(
+                lines=document, out_dict=out_dict, I=I,P=P,S=S, modes_for_phases=modes_for_phases
             )
         #}}} 
         # 4. Modify_specimen_displacement_lines: {{{
         if modify_specimen_displacement:
-            lines = self.modify_specimen_displacement_lines(
-                lines=lines, out_dict=out_dict,P=P,
+            self.modify_specimen_displacement_lines(
+                lines=document, out_dict=out_dict,P=P,
                 modes_for_phases = modes_for_phases,
             )
         #}}}
         # 4a. Modify 2D specimen displacement: {{{ 
         if modify_specimen_displacement:
-            lines = self.modify_sd2d_lines(
-                lines=lines, out_dict=out_dict, P=P,
+            self.modify_sd2d_lines(
+                lines=document, out_dict=out_dict, P=P,
                 modes_for_phases = modes_for_phases,
             )
         #}}}
         # 5. Modify background: {{{
         if modify_bkg:
-            lines = self.modify_bkg(lines, out_dict)
+            self.modify_bkg(document, out_dict)
         #}}}
         # 7. Write_ixpxsx_lines: {{{
         if write_ixpxsx_lines:
-            macro_blocks = self.find_ixpxsx_macro_blocks(lines) # This returns a dict. Keys == phase num, vals == (start, end)
-            lines = self.write_ixpxsx_lines(
-                    lines=lines, 
+            macro_blocks = self.find_ixpxsx_macro_blocks(document.lines) # This returns a dict. Keys == phase num, vals == (start, end)
+            self.write_ixpxsx_lines(
+                    document=document, 
                     cry_files=cry_files,
                     out_dict=out_dict,
                     macro_blocks=macro_blocks,
@@ -507,12 +507,12 @@ class TOPAS_Modifier(TOPAS_Parser):
         #}}}
         # 7. Update outuput_xy filename: {{{
         if update_output_xy_line:
-            lines, new_name = self.update_output_xy_line(lines = lines, inp_dict = out_dict, new_suffix = new_suffix)
+            _, new_name = self.update_output_xy_line(lines = document, inp_dict = out_dict, new_suffix = new_suffix)
         else:
             new_name = None
         #}}}
 
-        return (lines, new_name)
+        return (document.lines, new_name)
 
     #}}}
 #}}}
@@ -0,0 +1,135 @@
+# Authorship: {{{
+'''
+Written by: Dario C. Lewczyk
+Date: 10/18/26
+'''
+#}}}
+# Imports: {{{
+from collections.abc import MutableMapping
+#}}}
+_MISSING = object() # Marks a field that was deleted
+# Param: {{{
+class Param(MutableMapping):
+    '''
+    A compact record for one phase parameter of an INP/OUT dictionary
+    (what parse_phase_prms stores under out_dict[phase][var]).
+
+    The fields are stored in __slots__ instead of a dictionary per parameter,
+    and the "_meta" dictionary is only made the first time it is used.
+    This matters when an out_dict is kept for every temperature and method.
+
+    It still behaves like the dictionary it replaces:
+        prm['value'], prm['linenumber'] = 12, prm.get('error'), dict(prm), prm == {...}
+    and it can also be used with attributes: prm.value, prm.linenumber
+    Any other key you set is stored in a small dictionary of extras.
+    '''
+    fields = ('value', 'error', 'min', 'max', 'fixed', 'is_assignment', 'linenumber', 'line')
+    __slots__ = fields + ('_file_version', '_meta', '_extra')
+    # __init__: {{{
+    def __init__(self,
+            value:float = None,
+            error:float = None,
+            min:float = None,
+            max:float = None,
+            fixed:bool = False,
+            is_assignment:bool = False,
+            linenumber:int = None,
+            line:str = None,
+            file_version:int = 0,
+            **extra
+        ):
+        self.value = value
+        self.error = error
+        self.min = min
+        self.max = max
+        self.fixed = fixed
+        self.is_assignment = is_assignment
+        self.linenumber = linenumber
+        self.line = line
+        self._file_version = file_version # Used when "_meta" is first made
+        self._meta = None
+        self._extra = extra or None
+    #}}}
+    # meta: {{{
+    @property
+    def meta(self):
+        '''
+        The same dictionary LineNumberManager._default_meta makes, created on first use
+        '''
+        if self._meta is None:
+            self._meta = {
+                "file_version": self._file_version,
+                "auto_update": True,
+                "last_offset_applied": 0,
+                "dirty": False,
+            }
+        return self._meta
+    #}}}
+    # Mapping: {{{
+    def __getitem__(self, key):
+        if key in self.fields:
+            value = getattr(self, key)
+            if value is not _MISSING:
+                return value
+        elif key == '_meta':
+            return self.meta
+        elif self._extra and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+    def __setitem__(self, key, value):
+        if key in self.fields:
+            setattr(self, key, value)
+        elif key == '_meta':
+            self._meta = value
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+    def __delitem__(self, key):
+        if key in self.fields and getattr(self, key) is not _MISSING:
+            setattr(self, key, _MISSING)
+        elif key == '_meta':
+            self._meta = None
+        elif self._extra and key in self._extra:
+            del self._extra[key]
+        else:
+            raise KeyError(key)
+    def __iter__(self):
+        for key in self.fields:
+            if getattr(self, key) is not _MISSING:
+                yield key
+        if self._extra:
+            yield from self._extra
+        yield '_meta'
+    def __len__(self):
+        return sum(1 for _ in self)
+    def __contains__(self, key):
+        if key in self.fields:
+            return getattr(self, key) is not _MISSING
+        return key == '_meta' or bool(self._extra and key in self._extra)
+    #}}}
+    # to_dict: {{{
+    def to_dict(self):
+        return {key: self[key] for key in self}
+    #}}}
+    # __getstate__/__setstate__: {{{
+    def __getstate__(self):
+        '''
+        returns (values, names of deleted fields).
+        _MISSING would come back as a different object after pickling, so deleted fields are stored by name.
+        '''
+        values = tuple(None if getattr(self, key) is _MISSING else getattr(self, key) for key in self.__slots__)
+        deleted = tuple(key for key in self.fields if getattr(self, key) is _MISSING)
+        return values, deleted
+    def __setstate__(self, state):
+        values, deleted = state
+        for key, value in zip(self.__slots__, values):
+            setattr(self, key, value)
+        for key in deleted:
+            setattr(self, key, _MISSING)
+    #}}}
+    # __repr__: {{{
+    def __repr__(self):
+        return f'Param({", ".join(f"{k}={getattr(self, k)!r}" for k in self.fields if k != "line")})'
+    #}}}
+#}}}
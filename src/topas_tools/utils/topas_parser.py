@@ -7,6 +7,9 @@ Date: 01/16/2026
 # Imports: {{{
 import re
 import bisect
+from collections.abc import Mapping
+from topas_tools.utils.out_file import OutFile
+from topas_tools.utils.topas_param import Param
 #}}}
 # line_parser: {{{
 def line_parser(pattern, flags=0):
@@ -67,9 +70,9 @@ class LineNumberManager:
         having to worry about nesting
         '''
         for key, val in out_dict.items():
-            if isinstance(val, dict):
+            if isinstance(val, Mapping):
                 # Phase dictionary
-                if all(isinstance(v, dict) for v in val.values()):
+                if all(isinstance(v, Mapping) for v in val.values()):
                     for entry in val.values():
                         yield entry
                 else:
@@ -264,22 +267,41 @@ class TOPAS_Parser(LineNumberManager):
     TOKEN_SPEC = [
         ("NUMBER",   r"[+-]?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?"),
         ("WORD",     r"[A-Za-z_]\w*"),
-        ("STRING",   r'"[^"]*"'),
+        ("STRING",   r'"[^"\n]*"'),
         ("LPAREN",   r"\("),
         ("RPAREN",   r"\)"),
         ("COMMA",    r","),
         ("EQUAL",    r"="),
+        ("BACKTICK", r"`_?"),
         ("COMMENT",  r"'[^\n]*"),
         ("SKIP",     r"[ \t]+"),
         ("NEWLINE",  r"\n"),
         ("MISMATCH", r"."),
     ]
-
+    # Compiled once for the class. Nothing in TOKEN_SPEC can match across a newline, 
+    # so a whole file can be tokenized in one pass.
+    TOKEN_RE = re.compile("|".join(f"(?P<{name}>{pattern})" for name, pattern in TOKEN_SPEC))
     #}}}
     # global_regex: {{{
     float_re = r"[+-]?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?"
     term_re  = re.compile(rf"({float_re})(?:`_({float_re}))?")
     #}}}
+    # LINE_PREFIXES: {{{
+    '''
+    Used by get_inp_out_dict to send each line only to the parser that can match it. 
+    The keys are the first 3 characters of a (stripped) line in lowercase. 
+    Every line parser is anchored at the start of the line, so no other line can match. 
+    (fit metrics are the exception since "r_wp" can be anywhere in the line)
+    '''
+    LINE_PREFIXES = {
+        'prm': 'phase_prms',
+        'spe': 'Specimen_Displacement',
+        'sd2': 'SD2D',
+        'out': 'output_xy',
+        'xdd': 'xdd',
+        'bkg': 'bkg',
+    }
+    #}}}
     # tokenize_line: {{{ 
     def tokenize_line(self, line):
         """ 
@@ -287,12 +309,8 @@ class TOPAS_Parser(LineNumberManager):
         The best way to do this is to use my "topas_lines"
         implementation 
         """
-        tok_regex = "|".join(
-            f"(?P<{name}>{pattern})"
-            for name, pattern in self.TOKEN_SPEC
-        )
         tokens = []
-        for m in re.finditer(tok_regex, line):
+        for m in self.TOKEN_RE.finditer(line):
             kind = m.lastgroup
             value = m.group()
             if kind in ("SKIP", "COMMENT"):
@@ -303,11 +321,27 @@ class TOPAS_Parser(LineNumberManager):
     #}}}
     # tokenize_topas_lines: {{{ 
     def tokenize_topas_lines(self, topas_lines):
+        """ 
+        Tokenizes all of the lines in a single pass over the joined text. 
+        The NEWLINE tokens are used to keep the line boundaries, 
+        so this returns: [(lineno, tokens), ...] in the order of the linenumbers
+        """
+        linenumbers = sorted(topas_lines.keys())
+        if not linenumbers:
+            return []
+        text = "\n".join(topas_lines[lineno] for lineno in linenumbers)
         stream = []
-        for lineno in sorted(topas_lines.keys()):
-            line = topas_lines[lineno]
-            tokens = self.tokenize_line(line)
-            stream.append((lineno, tokens))
+        line_idx = 0
+        tokens = []
+        for m in self.TOKEN_RE.finditer(text):
+            kind = m.lastgroup
+            if kind == "NEWLINE":
+                stream.append((linenumbers[line_idx], tokens))
+                line_idx += 1
+                tokens = []
+            elif kind not in ("SKIP", "COMMENT"):
+                tokens.append((kind, m.group()))
+        stream.append((linenumbers[line_idx], tokens))
         return stream
 
     #}}}
@@ -418,6 +452,74 @@ class TOPAS_Parser(LineNumberManager):
             "line": line,
         }
 
+    #}}}
+    # parse_prm_tokens: {{{ 
+    def parse_prm_tokens(self, tokens):
+        """
+        Token version of parse_generic_prm_line used by build_ast_from_topas_lines. 
+        Handles:
+            prm Ph1(lp_a) 4.123`_0.002 min 4 max 5
+            prm Ph1(!lp_a) 4.123
+            prm lp_a 4.123`_0.002
+            prm lp_a = 4.123
+            prm myVar = 10 min 5 max 20
+        """
+        if not tokens or tokens[0] != ("WORD", "prm"):
+            return None
+        kinds = [k for k, v in tokens]
+        # Get the phase and variable: {{{
+        phase = None
+        fixed = False
+        if kinds[1:3] == ["WORD", "LPAREN"] and "RPAREN" in kinds[3:]:
+            # Phase-style prm: Ph1(lp_a)
+            close = kinds.index("RPAREN", 3)
+            inside = tokens[3:close]
+            words = [v for k, v in inside if k == "WORD"]
+            if len(words) != 1:
+                return None
+            phase = tokens[1][1]
+            var = words[0]
+            fixed = ("MISMATCH", "!") in inside
+            rest = tokens[close+1:]
+        elif kinds[1:2] == ["WORD"]:
+            # Simple prm: var ...
+            var = tokens[1][1]
+            rest = tokens[2:]
+        else:
+            return None
+        #}}}
+        # Extract value, error, min, max: {{{
+        val = None
+        err = None
+        mn = None
+        mx = None
+        for j, (kind, v) in enumerate(rest):
+            if kind != "NUMBER":
+                continue
+            previous = rest[j-1] if j > 0 else (None, None)
+            if previous[0] == "BACKTICK":
+                if err is None:
+                    err = float(v)
+            elif previous == ("WORD", "min"):
+                if mn is None:
+                    mn = float(v)
+            elif previous == ("WORD", "max"):
+                if mx is None:
+                    mx = float(v)
+            elif val is None:
+                val = float(v)
+        #}}}
+        fixed = fixed or ("MISMATCH", "@") not in rest  # @ means refined
+        return {
+            "phase": phase,
+            "var": var,
+            "value": val,
+            "error": err,
+            "min": mn,
+            "max": mx,
+            "fixed": fixed,
+        }
+
     #}}}
     # build_ast_from_topas_lines: {{{ 
     def build_ast_from_topas_lines(self, topas_lines):
@@ -439,9 +541,9 @@ class TOPAS_Parser(LineNumberManager):
                 continue
     
             # 2. Try prm (single-line)
-            line = topas_lines[lineno]
-            prm = self.parse_generic_prm_line(line)
+            prm = self.parse_prm_tokens(tokens)
             if prm:
+                prm["line"] = topas_lines[lineno]
                 prm["linenumber"] = lineno
                 ast["prms"].append(prm)
                 i += 1
@@ -526,12 +628,16 @@ class TOPAS_Parser(LineNumberManager):
         for lineno, line in topas_lines.items():
             result = parser_func(line)
             if result is not None:
-                result['linenumber'] = lineno
-                result['line'] = line
-                result["_meta"] = self._default_meta()
-                return result
+                return self._add_line_info(result, lineno, line)
         return None
     #}}}
+    # _add_line_info: {{{
+    def _add_line_info(self, result:dict = None, lineno:int = None, line:str = None):
+        result['linenumber'] = lineno
+        result['line'] = line
+        result["_meta"] = self._default_meta()
+        return result
+    #}}}
     # extract_terms: {{{
     def extract_terms(self, text):
         return [
@@ -644,22 +750,32 @@ class TOPAS_Parser(LineNumberManager):
             entry = self.parse_phase_prm_line(line)
             if entry is None:
                 continue
-    
-            phase = entry.pop("phase")
-            var   = entry.pop("var")
-    
-            entry["linenumber"] = lineno
-            entry["line"] = line
-            entry["_meta"] = self._default_meta()
-
-            if phase not in result:
-                result[phase] = {}
-    
-            result[phase][var] = entry
+            self._add_phase_prm_entry(result, entry, lineno, line)
     
         return result
 
     #}}}
+    # _add_phase_prm_entry: {{{
+    def _add_phase_prm_entry(self, result:dict = None, entry:dict = None, lineno:int = None, line:str = None):
+        '''
+        Adds the output of parse_phase_prm_line to the nested dictionary 
+        of phases and their parameters
+
+        Each parameter is stored as a Param (a slotted record that behaves like the dictionary)
+        '''
+        phase = entry.pop("phase")
+        var   = entry.pop("var")
+
+        if phase not in result:
+            result[phase] = {}
+
+        result[phase][var] = Param(
+                linenumber = lineno, 
+                line = line, 
+                file_version = self._inp_file_version,
+                **entry
+        )
+    #}}}
     # parse_sd2d_line: {{{ 
     @line_parser(
         rf"""
@@ -893,35 +1009,42 @@ class TOPAS_Parser(LineNumberManager):
             if topas_lines == str:
                 returns the filename
         '''
-        if not fileextension.startswith('.'):
-            fileextension = f'.{fileextension}'
-        ext = re.escape(fileextension)
-
-        pattern = re.compile(
-                rf'^\s*xdd\s+"?(?:[^"\s]*?([A-Za-z0-9._-]+{ext}))"?\s*$'
-        ) 
+        pattern = self._get_xdd_pattern(fileextension)
         # if topas_lines dictionary: {{{
         if type(topas_lines) ==dict:
             for linenumber, line in topas_lines.items():
                 m = pattern.match(line)
                 if m:
-                    filename = m.group(1) # This gives just the filename
-                    return {
-                        'linenumber': linenumber, 
-                        'filename':filename, 
-                        'line': line,
-                        '_meta': self._default_meta()
-                    }
+                    return self._get_xdd_entry(m, linenumber, line)
     
         #}}}
         # if topas_lines not a dictionary: {{{
         else: 
-            m = pattern.match(line)
+            m = pattern.match(topas_lines)
             if m:
                 filename = m.group(1)
                 return filename
         #}}}
     #}}} 
+    # _get_xdd_pattern: {{{
+    def _get_xdd_pattern(self, fileextension:str = 'xy'):
+        if not fileextension.startswith('.'):
+            fileextension = f'.{fileextension}'
+        ext = re.escape(fileextension)
+        return re.compile(
+                rf'^\s*xdd\s+"?(?:[^"\s]*?([A-Za-z0-9._-]+{ext}))"?\s*$'
+        ) 
+    #}}}
+    # _get_xdd_entry: {{{
+    def _get_xdd_entry(self, m = None, linenumber:int = None, line:str = None):
+        filename = m.group(1) # This gives just the filename
+        return {
+            'linenumber': linenumber, 
+            'filename':filename, 
+            'line': line,
+            '_meta': self._default_meta()
+        }
+    #}}}
     # extract_temp_from_string: {{{
     def extract_temp_from_string(self,s:str = None):
         m = re.search(r"(\d+)C", s)
@@ -1004,6 +1127,25 @@ class TOPAS_Parser(LineNumberManager):
     
         return blocks 
     #}}} 
+    # parse_topas_file: {{{
+    def parse_topas_file(self, filename = None, section:str = 'all', **kwargs):
+        '''
+        Reads an INP or OUT file and returns get_inp_out_dict for its lines. 
+        filename: A path or an OutFile
+        section: Part of the file to read (see OutFile). 
+            e.g. "header" is enough for the fit metrics and xdd and never reads the C matrix.
+        kwargs are passed to get_inp_out_dict
+        '''
+        if isinstance(filename, OutFile):
+            lines = filename.lines(section)
+        elif section != 'all':
+            with OutFile(filename) as out:
+                lines = out.lines(section)
+        else:
+            with open(filename, 'r') as f:
+                lines = f.readlines()
+        return self.get_inp_out_dict(lines, **kwargs)
+    #}}}
     # get_inp_out_dict: {{{
     def get_inp_out_dict(self, 
             lines:list = None,  
@@ -1029,59 +1171,149 @@ class TOPAS_Parser(LineNumberManager):
         This function will gather all of the prms for a given phase and throw them into a dictionary 
         All linenumbers for the original .out file will also be preserved
         '''
-        out_dict = {} # This is the default state for the dictionary
+        state = self._start_inp_out_dict(
+                record_phase_prms = record_phase_prms, 
+                record_xdd = record_xdd,
+                record_bkg = record_bkg,
+                fileextension = fileextension,
+                record_displacement = record_displacement,
+                record_fit_metrics = record_fit_metrics,
+                record_output_xy = record_output_xy,
+                record_lines = record_lines,
+        )
+        for lineno, line in enumerate(lines):
+            self._feed_inp_out_line(state, lineno, line)
+        return self._finish_inp_out_dict(state)
+    #}}}
+    # _start_inp_out_dict: {{{
+    def _start_inp_out_dict(self, 
+            record_phase_prms:bool = True, 
+            record_xdd:bool = True,
+            record_bkg:bool = True,
+            fileextension:str = 'xy',
+            record_displacement:bool = True, 
+            record_fit_metrics:bool = True,
+            record_output_xy:bool = True,
+            record_lines:bool = False,
+    ):
+        '''
+        get_inp_out_dict is done in 3 steps so that the lines can be streamed 
+        (e.g. shared with another parser in a single pass, see OutStreamParser): 
+            state = self._start_inp_out_dict(**options)
+            self._feed_inp_out_line(state, lineno, line) # for each line, in order
+            out_dict = self._finish_inp_out_dict(state)
         
-        topas_lines = self.get_lines_visible_to_topas(lines) # dictionary with keys as linenumbers and entries as lines
-        # phase_prms: {{{
+        Each line is only sent to the parser its first characters point to (see LINE_PREFIXES).
+        Apart from the phase prms, only the first match of each parser is kept 
+        so a parser is dropped as soon as it finds its line.
+        '''
+        parsers = {}
         if record_phase_prms:
-            phase_prms = self.parse_phase_prms(topas_lines)
-            for key, entry in phase_prms.items():
-                out_dict.update({key:entry}) # Contains all phases, variable names, and values along with linenumber and if var is refining
-            #if debug:
-            #    print(f'Phase Prms: {phase_prms}')
+            parsers['phase_prms'] = self.parse_phase_prm_line
+        if record_displacement:
+            parsers['Specimen_Displacement'] = self.parse_specimen_displacement_line
+            parsers['SD2D'] = self.parse_sd2d_line # This is my custom 2D specimen Displacement
+        if record_output_xy:
+            parsers['output_xy'] = self.parse_output_xy_line
+        if record_xdd:
+            xdd_pattern = self._get_xdd_pattern(fileextension)
+            parsers['xdd'] = xdd_pattern.match
+        if record_bkg:
+            parsers['bkg'] = self.parse_bkg_line
+        return {
+            'options': {
+                'record_phase_prms': record_phase_prms,
+                'record_displacement': record_displacement,
+                'record_fit_metrics': record_fit_metrics,
+                'record_output_xy': record_output_xy,
+                'record_xdd': record_xdd,
+                'record_bkg': record_bkg,
+                'record_lines': record_lines,
+            },
+            'parsers': parsers,
+            'find_fit_metrics': record_fit_metrics,
+            'block': False, # Inside of a comment block
+            'phase_prms': {},
+            'found': {},
+            'topas_lines': {},
+        }
+    #}}}
+    # _feed_inp_out_line: {{{
+    def _feed_inp_out_line(self, state:dict = None, lineno:int = None, line:str = None):
+        '''
+        Parses one line of the file (lineno is its linenumber in the file)
+        '''
+        # Only look at lines visible to TOPAS (same rules as get_lines_visible_to_topas): {{{
+        line = line.strip()
+        if line.startswith('/*'):
+            state['block'] = True
+        if line.startswith('*/'):
+            state['block'] = False
+        if state['block'] or line.startswith("'"):
+            return
+        if state['options']['record_lines']:
+            state['topas_lines'][lineno] = line
+        #}}}
+        # fit metrics: {{{
+        if state['find_fit_metrics'] and 'r_wp' in line:
+            fit_metrics = self.parse_fit_metrics_line(line)
+            if fit_metrics is not None:
+                state['found']['fit_metrics'] = self._add_line_info(fit_metrics, lineno, line)
+                state['find_fit_metrics'] = False
+        #}}}
+        parsers = state['parsers']
+        key = self.LINE_PREFIXES.get(line[:3].lower())
+        parser = parsers.get(key)
+        if parser is None:
+            return
+        entry = parser(line)
+        if entry is None:
+            return
+        if key == 'phase_prms':
+            self._add_phase_prm_entry(state['phase_prms'], entry, lineno, line)
+        elif key == 'xdd':
+            state['found'][key] = self._get_xdd_entry(entry, lineno, line)
+            del parsers[key]
+        else:
+            state['found'][key] = self._add_line_info(entry, lineno, line)
+            del parsers[key]
+    #}}}
+    # _finish_inp_out_dict: {{{
+    def _finish_inp_out_dict(self, state:dict = None):
+        '''
+        returns the out_dict from the lines fed so far
+        '''
+        out_dict = {} # This is the default state for the dictionary
+        options = state['options']
+        found = state['found']
+        # phase_prms: {{{
+        if options['record_phase_prms']:
+            out_dict.update(state['phase_prms']) # Contains all phases, variable names, and values along with linenumber and if var is refining
         #}}}
         # record_displacement: {{{
-        if record_displacement:
-            displacement_entry = self.apply_parser_over_topas_lines(topas_lines, self.parse_specimen_displacement_line)
-            out_dict['Specimen_Displacement'] = displacement_entry
-
-            sd2d = self.apply_parser_over_topas_lines(topas_lines, self.parse_sd2d_line) # This is my custom 2D specimen Displacement
-            out_dict["SD2D"] = sd2d
-
-            #if debug:
-            #    print(f'Displacement Entry: {displacement_entry}')
+        if options['record_displacement']:
+            out_dict['Specimen_Displacement'] = found.get('Specimen_Displacement')
+            out_dict["SD2D"] = found.get('SD2D')
         #}}}  
         # record_fit_metrics: {{{
-        if record_fit_metrics:
-            fit_metrics = self.apply_parser_over_topas_lines(topas_lines, self.parse_fit_metrics_line)
-            out_dict['fit_metrics'] = fit_metrics # Store the fit metrics
-            #if debug:
-            #    print(f'Fit Metrics: {fit_metrics}')
+        if options['record_fit_metrics']:
+            out_dict['fit_metrics'] = found.get('fit_metrics') # Store the fit metrics
         #}}}
         # record_output_xy: {{{
-        if record_output_xy:
-            output_xy = self.apply_parser_over_topas_lines(topas_lines, self.parse_output_xy_line)
-            out_dict['output_xy'] = output_xy
-            #if debug:
-            #    print(f'Output XY: {output_xy}')
+        if options['record_output_xy']:
+            out_dict['output_xy'] = found.get('output_xy')
         #}}}
         # record_xdd: {{{
-        if record_xdd:
-            xdd = self.parse_xdd_line(topas_lines, fileextension)
-            out_dict['xdd'] = xdd
-            #if debug:
-            #    print(f'XDD: {xdd}')
+        if options['record_xdd']:
+            out_dict['xdd'] = found.get('xdd')
         #}}}
         # record bkg: {{{
-        if record_bkg:
-            bkg = self.apply_parser_over_topas_lines(topas_lines, self.parse_bkg_line)
-            out_dict['bkg'] = bkg
-            #if debug:
-            #    print(f'BKG: {bkg}')
+        if options['record_bkg']:
+            out_dict['bkg'] = found.get('bkg')
         #}}}
         # record_lines: {{{
-        if record_lines:
-            out_dict.update({'topas_lines': topas_lines}) # Record the lines 
+        if options['record_lines']:
+            out_dict.update({'topas_lines': state['topas_lines']}) # Record the lines 
         #}}}
 
         return out_dict
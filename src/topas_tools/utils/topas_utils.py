@@ -4,15 +4,20 @@
 #}}}
 # Imports: {{{
 import os
+import time
 import re
 import glob
+from collections.abc import Mapping
 import numpy as np
 import texttable
+from concurrent.futures import ThreadPoolExecutor
 from scipy.optimize import fsolve
 #from PIL import Image
 import fabio
 from scipy.signal import savgol_filter
 from topas_tools.IO import IO
+from topas_tools.utils.xy_loader import load_xy
+from topas_tools.utils.pattern_stack import PatternStack
 #}}}
 # Utils: {{{
 class Utils: 
@@ -613,18 +618,78 @@ class Utils:
         noise = np.std(y)
         return signal/noise if noise !=0 else 0
     #}}}
+    # calculate_snr_stack: {{{
+    def calculate_snr_stack(self, ys:list = None):
+        '''
+        Same as calculate_snr but for a whole stack of patterns at once. 
+
+        ys: list of intensity arrays (they do not need to be the same length)
+
+        returns an array with the SNR of each pattern 
+        '''
+        n_points = max((len(y) for y in ys), default = 0)
+        # Pad the patterns with NaN so they fit in one array: {{{
+        stack = np.full((len(ys), n_points), np.nan)
+        for i, y in enumerate(ys):
+            stack[i, :len(y)] = y
+        #}}}
+        signal = np.nanmean(stack, axis = 1)
+        noise = np.nanstd(stack, axis = 1)
+        snr = np.zeros(len(ys))
+        np.divide(signal, noise, out = snr, where = noise != 0) # 0 where the noise is 0
+        return snr
+    #}}}
+    # screen_patterns_by_snr: {{{
+    def screen_patterns_by_snr(self, 
+            filenames:list = None, 
+            data_dir:str = None, 
+            snr_threshold:float = 2.0, 
+            workers:int = 8,
+            print_report:bool = True,
+        ):
+        '''
+        Loads every pattern given on a pool of threads and 
+        computes the SNR of all of them in one step. 
+
+        filenames: the data files to check
+        data_dir: the directory with the data files
+        snr_threshold: patterns with an SNR above this are skipped
+        workers: threads used to load the data 
+
+        returns: (skip, report)
+            skip: boolean array (True if the pattern should be skipped)
+            report: list of dictionaries with filename, snr, skip
+        '''
+        with ThreadPoolExecutor(max_workers = workers) as pool:
+            ys = list(pool.map(lambda fn: self._load_raw_xy(fn, data_dir)[1], filenames))
+        snr = self.calculate_snr_stack(ys)
+        skip = snr > snr_threshold
+        report = [
+            {'filename': fn, 'snr': float(snr[i]), 'skip': bool(skip[i])} 
+            for i, fn in enumerate(filenames)
+        ]
+        # Print out the patterns that were skipped: {{{
+        if print_report and skip.any():
+            print(f'Your SNR threshold of: {snr_threshold} triggered to prevent {skip.sum()} of {len(filenames)} patterns from being refined:')
+            table = texttable.Texttable()
+            table.set_cols_align(['l', 'c'])
+            table.set_cols_dtype(['t', 'f'])
+            table.add_rows([['Pattern', 'SNR']] + [[e['filename'], e['snr']] for e in report if e['skip']])
+            print(table.draw())
+        #}}}
+        return skip, report
+    #}}}
     # _load_raw_xy: {{{
     def _load_raw_xy(self,fn:str = None, data_dir:str = None):
         """ 
         This function simply loads an XY file generated by 
         pyFAI. 
         """
-        home = os.getcwd()
-        os.chdir(data_dir)
-        data = np.loadtxt(fn, skiprows=1)
+        if data_dir is not None:
+            fn = os.path.join(data_dir, fn) # No need to change directories (safe for threads)
+        data = load_xy(fn, skiprows=1)
         x = data[:,0]
         y = data[:,1]
-        os.chdir(home)
         return x,y
     #}}}
     # load_output_xy: {{{
@@ -634,7 +699,7 @@ class Utils:
         produced as output from TOPAS using my macro
         Out_X_Yobs_Ycalc_Ydiff()
         """
-        xy = np.loadtxt(fn,delimiter=',')
+        xy = load_xy(fn,delimiter=',')
         try:
             tth = xy[:,0]
             yobs = xy[:,1]
@@ -865,6 +930,42 @@ class Utils:
             
             # entry.is_dir() → ignored automatically
     #}}}
+    # wait_for_file_ready: {{{
+    def wait_for_file_ready(self, filename:str = None, timeout:float = 10.0, poll:float = 0.01, max_poll:float = 0.5):
+        '''
+        Waits until a file written by another program (e.g. TOPAS) is ready to be moved.
+
+        A file is ready when:
+            1. it exists
+            2. its size and modification time did not change between two checks
+            3. it can be opened (on Windows, TOPAS locks the files it is still writing)
+
+        The time between checks starts at "poll" and doubles up to "max_poll"
+        so that a file that is already finished returns almost immediately.
+
+        filename: the file to wait on
+        timeout: the maximum time to wait (seconds)
+
+        returns True if the file is ready, False if the timeout was reached
+        '''
+        deadline = time.monotonic() + timeout
+        previous = None
+        while True:
+            try:
+                stat = os.stat(filename)
+                current = (stat.st_size, stat.st_mtime_ns)
+                if current == previous:
+                    with open(filename, 'ab'):
+                        pass # Raises if the file is still locked
+                    return True
+                previous = current
+            except OSError:
+                previous = None # Missing or locked. Start over
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(min(poll, max(deadline - time.monotonic(), 0)))
+            poll = min(poll*2, max_poll)
+    #}}}
     # make_unique_dir: {{{
     def make_unique_dir(self,base):
         if not os.path.exists(base):
@@ -892,7 +993,7 @@ class Utils:
             d[key1][key2][key3]...[keyn]
         """
         for k in keys:
-            if not isinstance(d, dict) or k not in d:
+            if not isinstance(d, Mapping) or k not in d:
                 return None
             d = d[k]
         return d
@@ -977,6 +1078,7 @@ class DataCollector:
             skiprows = 1, 
             metadata_data:dict = {},
             mode = 0,
+            pattern_stack = None,
         ):
         '''
         1. fileextension: The extension (without a .)
@@ -990,6 +1092,8 @@ class DataCollector:
             The mode is 0 by default. This means that the program will expect to see time stamps in your xy files
             If you want to just get all files of a particular extension without that requirement, use "1"
 
+        pattern_stack: A PatternStack (or the path to one) with these files.
+            If given, _get_arrs slices the patterns from it instead of reading each file.
         '''
         # Initialize values: {{{
         self._fileextension = fileextension
@@ -1000,6 +1104,9 @@ class DataCollector:
         self.skiprows = skiprows  
         self.metadata_data = metadata_data # Transfer the metadata or start fresh 
         self._datacollector_mode = mode
+        if isinstance(pattern_stack, str):
+            pattern_stack = PatternStack(pattern_stack)
+        self.pattern_stack = pattern_stack
         #}}}
         # Determine if working with images: {{{
         if self._fileextension == 'tif' or self._fileextension == 'tiff':
@@ -1155,8 +1262,18 @@ class DataCollector:
         min_tth = None
         max_tth = None
         max_len = None
+        # Slice the patterns from the PatternStack: {{{
+        stack = getattr(self, 'pattern_stack', None)
+        rows = [stack.find(f) for f in files] if stack is not None else [None]
+        if None not in rows:
+            tth, zs = stack.waterfall(rows) # Only reads the rows selected
+            min_tth, max_tth, max_len = tth[0], tth[-1], len(tth)
+            self.max_i = max(self.max_i, float(np.nanmax(zs)))
+            self.min_i = min(self.min_i, float(np.nanmin(zs)))
+            files = [] # Nothing left to read
+        #}}}
         for f in files:
-            data = np.loadtxt(f,skiprows=self.skiprows)
+            data = load_xy(f,skiprows=self.skiprows)
             tth = data[:,0]
             iau = data[:,1]
             # Record max angle: {{{
@@ -1411,8 +1528,11 @@ class DataCollector:
         without having to refine all the data first. 
 
         The resulting dataset will have evenly spaced data given your input parameters
+
+        If the DataCollector has a pattern_stack, the patterns are sliced from it
+        (only the rows selected are read). Files that are not in the stack are read as before.
         '''
-        os.chdir(self.data_dir)
+        stack = getattr(self, 'pattern_stack', None)
         files = self.metadata_data # It is better to use this because these keys are sorted in time order
         total_files = len(files)
         
@@ -1433,7 +1553,12 @@ class DataCollector:
             try:
                 f = self.file_dict[key] 
                 if i in pattern_rng:
-                    tth, yobs = self._load_raw_xy(f, self.data_dir) 
+                    row = stack.find(f, self.data_dir) if stack is not None else None
+                    if row is not None:
+                        tth, yobs = stack.get_pattern(row)
+                        yobs = np.asarray(yobs, dtype = float) # Reads just this row
+                    else:
+                        tth, yobs = self._load_raw_xy(f, self.data_dir) 
                     temp = md['temperature'] # This is the temp in deg C
                     corrected_time = md['corrected_time']
                     time = np.around(corrected_time/60, 2) # This is the time in minutes
@@ -1454,7 +1579,6 @@ class DataCollector:
                 index = md['pattern_index']
                 print(f'Key: {key} not found in file dict: \n\tTime: {time_min} min\n\tPattern index: {index}\n\tpossible missing data')
                 pass
-        os.chdir(self.current_dir)
 
     #}}}
 #}}}
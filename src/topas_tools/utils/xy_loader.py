@@ -0,0 +1,145 @@
+# Authorship: {{{
+'''
+Written by: Dario C. Lewczyk
+Date: 10/18/26
+'''
+#}}}
+# Imports: {{{
+import io
+import os
+import re
+import numpy as np
+#}}}
+# Bulk parser: {{{
+'''
+np.loadtxt is a C parser from numpy 1.23 on.
+Before that it parses in Python, so pandas' C reader is used instead.
+'''
+_NUMPY_C_PARSER = np.lib.NumpyVersion(np.__version__) >= '1.23.0'
+if not _NUMPY_C_PARSER:
+    import pandas as pd
+#}}}
+# TOPAS writes things like 1.#QNAN0, -1.#IND00, 1.#INF00 for values it could not compute
+_BAD_VALUE_RE = re.compile(r'[-+]?\d*\.?\d*#(?:QNAN|SNAN|IND|INF)\d*')
+_BAD_MARK_RE = re.compile(r'#(?:QNAN|SNAN|IND|INF)') # Quick check (_BAD_VALUE_RE is slow to search a whole file)
+# _is_number: {{{
+def _is_number(s:str = None):
+    try:
+        float(s)
+        return True
+    except ValueError:
+        return False
+#}}}
+# _detect_format: {{{
+def _detect_format(lines = None, delimiter:str = None, skiprows:int = None, comments:str = '#'):
+    '''
+    Looks at the start of the file (lines is any iterable of its lines) to find:
+        skiprows: The number of header lines (lines that do not start with a number)
+        delimiter: "," if the first data line has commas, otherwise whitespace (None)
+    Anything given is kept as is. Stops at the first data line.
+    '''
+    start = skiprows or 0
+    first = None # The first data line
+    n_header = start
+    for i, line in enumerate(lines):
+        if i < start:
+            continue
+        if comments:
+            line = line.split(comments, 1)[0]
+        line = line.strip()
+        if not line:
+            if skiprows is None:
+                n_header = i + 1
+            continue
+        if skiprows is None:
+            token = re.split(r'[,\s]+', line, maxsplit = 1)[0]
+            if not _is_number(token):
+                n_header = i + 1 # A header line
+                continue
+        first = line
+        break
+    if skiprows is None:
+        skiprows = n_header
+    if delimiter is None and first is not None and ',' in first:
+        delimiter = ','
+    return delimiter, skiprows
+#}}}
+# _forward_fill: {{{
+def _forward_fill(data:np.ndarray = None):
+    '''
+    Replaces each NaN with the last valid value in its column (0 if there is none)
+    '''
+    mask = np.isnan(data)
+    if not mask.any():
+        return data
+    rows = np.arange(data.shape[0])[:, None]
+    idx = np.where(mask, 0, rows)
+    has_valid = np.maximum.accumulate(~mask, axis = 0)
+    idx = np.maximum.accumulate(idx, axis = 0)
+    filled = data[idx, np.arange(data.shape[1])]
+    filled[~has_valid] = 0
+    return filled
+#}}}
+# Pattern cache: {{{
+_pattern_cache = None # A PatternCache used by load_xy (see PatternCache.activate)
+def set_pattern_cache(cache = None):
+    global _pattern_cache
+    _pattern_cache = cache
+def get_pattern_cache():
+    return _pattern_cache
+#}}}
+# load_xy: {{{
+def load_xy(fn = None, delimiter:str = None, skiprows:int = None, comments:str = '#', fill_bad_values:bool = True, cache = None):
+    '''
+    Fast reader for the column data files used throughout the package
+    (pyFAI .xy, TOPAS Out_X_Yobs_Ycalc_Ydiff, bkgsub, temperature logs, ...).
+
+    fn: A filename or a list of lines
+    delimiter: None detects it ("," if the data has commas, otherwise whitespace)
+    skiprows: None skips any header lines (lines at the top that do not start with a number)
+    comments: Text after this is ignored (as in np.loadtxt)
+    fill_bad_values: TOPAS sometimes writes values like "1.#QNAN0".
+        If True, these are replaced with the last valid value in the column (0 if there is none).
+    cache: A PatternCache to use for this file (defaults to the active one, if any).
+        Arrays from the cache are memory-mapped .npy files.
+
+    returns a 2D float array (one column per column of the file) like np.loadtxt(..., ndmin = 2)
+    '''
+    if cache is None:
+        cache = _pattern_cache
+    if cache is not None and isinstance(fn, (str, os.PathLike)):
+        return cache.get(fn, _parse_xy_text, delimiter = delimiter, skiprows = skiprows, comments = comments, fill_bad_values = fill_bad_values)
+    return _parse_xy_text(fn, delimiter, skiprows, comments, fill_bad_values)
+#}}}
+# _parse_xy_text: {{{
+def _parse_xy_text(fn = None, delimiter:str = None, skiprows:int = None, comments:str = '#', fill_bad_values:bool = True):
+    '''
+    Parses the text of a file for load_xy
+    '''
+    if isinstance(fn, (list, tuple)):
+        text = ''.join(line if line.endswith('\n') else f'{line}\n' for line in fn)
+    else:
+        with open(fn, 'r') as f:
+            text = f.read()
+    # "#" starts a comment, so the bad values have to be replaced before parsing: {{{
+    bad_values = '#' in text and _BAD_MARK_RE.search(text) is not None
+    if bad_values:
+        text = '\n'.join(_BAD_VALUE_RE.sub('nan', line) if '#' in line else line for line in text.split('\n'))
+    #}}}
+    delimiter, skiprows = _detect_format(io.StringIO(text), delimiter, skiprows, comments)
+    if _NUMPY_C_PARSER:
+        data = np.loadtxt(io.StringIO(text), delimiter = delimiter, skiprows = skiprows, comments = comments, ndmin = 2)
+    else:
+        data = pd.read_csv(
+                io.StringIO(text),
+                sep = delimiter if delimiter else r'\s+',
+                skiprows = skiprows,
+                comment = comments,
+                header = None,
+                skipinitialspace = True,
+                float_precision = 'round_trip',
+        ).to_numpy(dtype = float)
+    if bad_values and fill_bad_values:
+        data = _forward_fill(data)
+    return data
+#}}}